@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready.
+from listings.stream import PET_STREAM_PATH, pet_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # The pet event stream is served outside Django so that long-lived idle
+    # connections do not each hold a thread.
+    if scope['type'] == 'http' and scope['path'] == PET_STREAM_PATH:
+        return await pet_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
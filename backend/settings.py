@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_countries',
     'accounts',
     'listings',
@@ -69,6 +71,10 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'listings.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
@@ -126,6 +132,32 @@ AUTH_USER_MODEL = 'accounts.User'
 
 
 
+# Cache
+# Local memory by default (tests, single process). Set REDIS_URL to share the
+# response cache, stats counters and generation counter across workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+LISTINGS_RESPONSE_CACHE_TIMEOUT = 300
+# Pet events for /pets/stream/ go through Redis pub/sub when set, so every
+# ASGI worker sees writes made by any other; otherwise they stay in-process.
+LISTINGS_EVENTS_REDIS_URL = os.environ.get('REDIS_URL')
+# Threads per process that build pet image derivatives (listings/images.py).
+LISTINGS_IMAGE_WORKERS = 2
+# Changes-feed cursors older than this get 410 Gone; prune_pet_tombstones uses it too.
+LISTINGS_TOMBSTONE_RETENTION_DAYS = 30
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -162,11 +194,27 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
-import os
-
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How /media/ hands files to the front proxy: 'nginx' (X-Accel-Redirect to an
+# internal location aliased to MEDIA_ROOT), 'sendfile' (X-Sendfile for Apache
+# mod_xsendfile / lighttpd), or unset to stream them from Django.
+#   location /protected-media/ { internal; alias /srv/app/media/; }
+LISTINGS_MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+LISTINGS_MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Resumable uploads (/api/uploads/): largest accepted image, and how long an
+# unfinished session may sit before prune_upload_sessions removes it.
+LISTINGS_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+LISTINGS_UPLOAD_EXPIRY_HOURS = 24
+
+# Hash uploads while they stream in, for listings' content-addressed image storage.
+FILE_UPLOAD_HANDLERS = [
+    'listings.uploadhandlers.HashingMemoryFileUploadHandler',
+    'listings.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
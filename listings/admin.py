@@ -1,9 +1,14 @@
 from django.contrib import admin
 from .models import Pet
 from .models import ContactMessage
+from .models import PetDuplicate
 
 # Register your models here.
-admin.site.register(Pet)
+@admin.register(Pet)
+class PetAdmin(admin.ModelAdmin):
+    # Kept in step by the Favorite signals; Pet.save() never writes it.
+    readonly_fields = ['favorites_count']
+
 
 @admin.register(ContactMessage)
 class ContactMessageAdmin(admin.ModelAdmin):
@@ -16,4 +21,20 @@ class ContactMessageAdmin(admin.ModelAdmin):
         return False
     
     def has_change_permission(self, request, obj=None):
-        return False
\ No newline at end of file
+        return False
+
+
+@admin.register(PetDuplicate)
+class PetDuplicateAdmin(admin.ModelAdmin):
+    """Suspected re-posts; deleting a row dismisses it until either listing's fingerprint changes."""
+    list_display = ['pet', 'original', 'same_owner', 'image_distance', 'text_similarity', 'created_at']
+    list_filter = ['same_owner', 'created_at']
+    list_select_related = ['pet', 'original']
+    raw_id_fields = ['pet', 'original']
+    readonly_fields = ['pet', 'original', 'same_owner', 'image_distance', 'text_similarity', 'created_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
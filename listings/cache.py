@@ -0,0 +1,200 @@
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+# Anonymous GETs are cached under the current generation. Pet/Favorite writes
+# bump the generation, which orphans every older entry in O(1); they then age
+# out through the normal cache timeout instead of being scanned and deleted.
+GENERATION_KEY = 'listings:generation'
+RESPONSE_KEY_PREFIX = 'listings:response'
+METRICS_KEY_PREFIX = 'listings:response-cache:'
+METRICS = ('hits', 'misses', 'collapsed')
+
+# A miss takes this lock while it recomputes; concurrent misses for the same
+# key wait for that result instead of running the view themselves.
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.02
+
+BOOLEAN_PARAMS = ('vaccinated', 'is_urgent')
+# What django-filter's BooleanWidget accepts (after lower-casing); nothing else filters.
+BOOLEAN_VALUES = {'true': 'true', '1': 'true', 'false': 'false', '0': 'false'}
+LIST_PARAMS = ('fields', 'exclude', 'include')
+# Replayed on hits: the validators, and the Vary: Accept DRF adds to negotiated responses.
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Vary')
+
+
+def get_cache():
+    return caches[getattr(settings, 'LISTINGS_CACHE_ALIAS', 'default')]
+
+
+def response_cache_timeout():
+    return getattr(settings, 'LISTINGS_RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def get_generation():
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start from the clock rather than 1 so an evicted counter can never
+        # come back at a value that older entries were stored under.
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+
+
+def invalidate_on_commit(using='default'):
+    """Invalidate cached responses once the current transaction commits."""
+    transaction.on_commit(bump_generation, using=using)
+
+
+def record(metric):
+    cache = get_cache()
+    key = METRICS_KEY_PREFIX + metric
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_metrics():
+    cache = get_cache()
+    values = cache.get_many([METRICS_KEY_PREFIX + metric for metric in METRICS])
+    metrics = {metric: values.get(METRICS_KEY_PREFIX + metric, 0) for metric in METRICS}
+    lookups = metrics['hits'] + metrics['collapsed'] + metrics['misses']
+    metrics['hit_ratio'] = round((metrics['hits'] + metrics['collapsed']) / lookups, 4) if lookups else None
+    metrics['generation'] = get_generation()
+    return metrics
+
+
+def canonical_query(query_dict, defaults=None):
+    """
+    Canonical form of a query string, so `?b=1&a=2`, `?a=2&b=1` and the same
+    request with explicit default values all share one cache entry.
+
+    Only spellings the views themselves read alike are merged: every
+    parameter is read with `.get()`, so the last of repeated values is the
+    one that counts, and a boolean filter takes `true/false/1/0` in any case
+    (anything else leaves it unfiltered, so it keeps its own key).
+    """
+    defaults = defaults or {}
+    items = []
+    for key in sorted(query_dict):
+        value = query_dict.getlist(key)[-1]
+        if key in LIST_PARAMS:
+            parts = sorted({part.strip() for part in value.split(',') if part.strip()})
+            # `?include=` (nothing) is not the same as leaving include out.
+            if not parts and key != 'include':
+                continue
+            value = ','.join(parts)
+        elif not value:
+            continue
+        elif key in BOOLEAN_PARAMS:
+            value = BOOLEAN_VALUES.get(value.lower(), value)
+        if value == defaults.get(key):
+            continue
+        items.append((key, value))
+    return urlencode(items)
+
+
+def canonical_accept(request):
+    """
+    The Accept header the renderer is negotiated from, without whitespace:
+    `application/json; indent=4` renders differently from a plain JSON Accept.
+    """
+    return ''.join(request.META.get('HTTP_ACCEPT', '').split()).lower()
+
+
+def response_cache_key(request, defaults=None):
+    canonical = canonical_query(request.GET, defaults)
+    source = f'{request.get_host()}{request.path}?{canonical}\n{canonical_accept(request)}'
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+    return f'{RESPONSE_KEY_PREFIX}:{get_generation()}:{digest}'
+
+
+def is_cacheable_request(request):
+    if request.method != 'GET' or 'HTTP_AUTHORIZATION' in request.META:
+        return False
+    # The browsable API renders HTML per user; only JSON responses are cached.
+    return 'text/html' not in request.META.get('HTTP_ACCEPT', '') and 'format' not in request.GET
+
+
+def _from_cache(request, entry, label):
+    content, content_type, status, headers = entry
+    response = HttpResponse(content, content_type=content_type, status=status)
+    for header, value in headers.items():
+        response[header] = value
+    last_modified = parse_http_date_safe(headers.get('Last-Modified', ''))
+    response = get_conditional_response(request, etag=headers.get('ETag'), last_modified=last_modified, response=response)
+    response['X-Cache'] = label
+    return response
+
+
+def anonymous_response_cache(defaults=None):
+    """
+    Cache rendered responses for anonymous GETs, keyed on the canonical query
+    string, the Accept header and the current generation.
+
+        @method_decorator(anonymous_response_cache({'page_size': '20'}), name='dispatch')
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = response_cache_key(request, defaults)
+            entry = cache.get(key)
+            if entry is not None:
+                record('hits')
+                return _from_cache(request, entry, 'HIT')
+
+            lock_key = key + ':lock'
+            have_lock = cache.add(lock_key, 1, timeout=LOCK_TIMEOUT)
+            if not have_lock:
+                deadline = time.monotonic() + LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL_INTERVAL)
+                    entry = cache.get(key)
+                    if entry is not None:
+                        record('collapsed')
+                        return _from_cache(request, entry, 'HIT')
+
+            record('misses')
+            try:
+                response = view_func(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                content_type = response.get('Content-Type', '')
+                if response.status_code == 200 and content_type.startswith('application/json'):
+                    headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+                    entry = (response.content, content_type, response.status_code, headers)
+                    cache.set(key, entry, response_cache_timeout())
+            finally:
+                if have_lock:
+                    cache.delete(lock_key)
+            response['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,119 @@
+import decimal
+
+from django.utils import timezone
+
+from .images import derivative_urls
+from .models import Pet
+
+# Output key -> `.values()` column, in PetSerializer's field order.
+CARD_COLUMNS = {
+    'id': 'id',
+    'owner': 'owner__username',
+    'is_favorited': 'is_favorited',
+    'image_derivatives': 'image_derivatives',
+    'name': 'name',
+    'type': 'type',
+    'breed': 'breed',
+    'age': 'age',
+    'gender': 'gender',
+    'description': 'description',
+    'status': 'status',
+    'price': 'price',
+    'vaccinated': 'vaccinated',
+    'is_urgent': 'is_urgent',
+    'city': 'city',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'image': 'image',
+    'favorites_count': 'favorites_count',
+}
+# Cards leave out the heavy description text unless it is asked for by name.
+CARD_FIELDS = [key for key in CARD_COLUMNS if key != 'description']
+
+PRICE_QUANTUM = decimal.Decimal(1).scaleb(-Pet._meta.get_field('price').decimal_places)
+IMAGE_STORAGE = Pet._meta.get_field('image').storage
+
+
+def card_queryset(queryset, fields=None):
+    """
+    Narrow a Pet queryset to the card columns as plain `.values()` rows.
+    The queryset must already carry annotate_favorited().
+
+    Annotations the queryset is ordered by (e.g. `search_rank`) are kept so
+    the keyset paginator can still read them off the last row.
+    """
+    columns = [CARD_COLUMNS[key] for key in (fields or CARD_FIELDS)]
+    columns += [name for name in ('id', 'created_at') if name not in columns]
+    columns += [name for name in queryset.query.annotations if name not in columns]
+    return queryset.values(*columns)
+
+
+def format_datetime(value, tz):
+    # Same output as DRF's DateTimeField with the ISO-8601 format.
+    if value is None:
+        return None
+    value = value.astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def format_price(value):
+    # Same output as DRF's DecimalField with COERCE_DECIMAL_TO_STRING.
+    if value is None:
+        return None
+    return '{:f}'.format(value.quantize(PRICE_QUANTUM))
+
+
+def pet_cards(rows, request=None, fields=None):
+    """
+    Turn `card_queryset()` rows into dicts that match PetSerializer's output
+    for every field they share, without instantiating models or serializers.
+    """
+    tz = timezone.get_current_timezone()
+    build_uri = request.build_absolute_uri if request is not None else None
+
+    def format_image(name):
+        if not name:
+            return None
+        url = IMAGE_STORAGE.url(name)
+        return build_uri(url) if build_uri is not None else url
+
+    if fields is None:
+        # Hot path for the default card: one literal dict per row.
+        return [
+            {
+                'id': row['id'],
+                'owner': row['owner__username'],
+                'is_favorited': row['is_favorited'],
+                'image_derivatives': derivative_urls(row['image_derivatives'], build_uri),
+                'name': row['name'],
+                'type': row['type'],
+                'breed': row['breed'],
+                'age': row['age'],
+                'gender': row['gender'],
+                'status': row['status'],
+                'price': format_price(row['price']),
+                'vaccinated': row['vaccinated'],
+                'is_urgent': row['is_urgent'],
+                'city': row['city'],
+                'created_at': format_datetime(row['created_at'], tz),
+                'updated_at': format_datetime(row['updated_at'], tz),
+                'image': format_image(row['image']),
+                'favorites_count': row['favorites_count'],
+            }
+            for row in rows
+        ]
+
+    formatters = {
+        'price': format_price,
+        'created_at': lambda value: format_datetime(value, tz),
+        'updated_at': lambda value: format_datetime(value, tz),
+        'image': format_image,
+        'image_derivatives': lambda value: derivative_urls(value, build_uri),
+    }
+    plan = [(key, CARD_COLUMNS[key], formatters.get(key)) for key in fields]
+    return [
+        {key: row[column] if formatter is None else formatter(row[column]) for key, column, formatter in plan}
+        for row in rows
+    ]
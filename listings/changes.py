@@ -0,0 +1,113 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from .cards import card_queryset, pet_cards
+from .export import EXPORT_FIELDS
+from .models import Pet, PetTombstone
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Changes younger than this are held back: a transaction that stamped
+# updated_at (or took a tombstone id) earlier may still be committing, and a
+# cursor that moved past it would never see it.
+SETTLE_SECONDS = 5
+
+
+def tombstone_retention():
+    return datetime.timedelta(days=getattr(settings, 'LISTINGS_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'This cursor is older than the tombstone retention period. Sync again without a cursor.'
+    default_code = 'cursor_expired'
+
+
+def to_micros(value):
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_micros(value):
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+
+def encode_cursor(position):
+    raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(encoded):
+    try:
+        raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        position = json.loads(raw.decode('utf-8'))
+        if not all(isinstance(position[key], int) for key in ('t', 's')):
+            raise ValueError('cursor positions must be integers')
+        if position['u'] is not None and not all(isinstance(position[key], int) for key in ('u', 'p')):
+            raise ValueError('cursor positions must be integers')
+    except (TypeError, KeyError, ValueError, binascii.Error, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+    return position
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def get_changes(cursor=None, limit=DEFAULT_LIMIT):
+    """
+    One page of the changes feed.
+
+    The cursor holds two independent positions: (updated_at, id) into the
+    pets, served through pet_updated_idx, and the last tombstone id. A
+    request without a cursor starts a full sync: every pet, plus only the
+    tombstones written from now on.
+    """
+    now = timezone.now()
+    horizon = now - datetime.timedelta(seconds=SETTLE_SECONDS)
+    if cursor:
+        position = decode_cursor(cursor)
+        if from_micros(position['s']) < now - tombstone_retention():
+            raise CursorExpired()
+    else:
+        last_tombstone = PetTombstone.objects.filter(deleted_at__lte=horizon).aggregate(last=Max('id'))['last']
+        position = {'u': None, 'p': None, 't': last_tombstone or 0}
+
+    pets = Pet.objects.filter(updated_at__lte=horizon)
+    if position['u'] is not None:
+        updated_at = from_micros(position['u'])
+        pets = pets.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=position['p']))
+    rows = list(card_queryset(pets.order_by('updated_at', 'id'), EXPORT_FIELDS)[:limit + 1])
+
+    tombstones = list(
+        PetTombstone.objects.filter(id__gt=position['t'], deleted_at__lte=horizon)
+        .order_by('id').values_list('id', 'pet_id')[:limit + 1]
+    )
+
+    has_more = len(rows) > limit or len(tombstones) > limit
+    rows, tombstones = rows[:limit], tombstones[:limit]
+    if rows:
+        position['u'], position['p'] = to_micros(rows[-1]['updated_at']), rows[-1]['id']
+    if tombstones:
+        position['t'] = tombstones[-1][0]
+    position['s'] = to_micros(now)
+    return {
+        'upserts': pet_cards(rows, fields=EXPORT_FIELDS),
+        # Apply after the upserts: a deleted pet is never in them.
+        'deletes': [pet_id for _, pet_id in tombstones],
+        'cursor': encode_cursor(position),
+        'has_more': has_more,
+    }
@@ -0,0 +1,104 @@
+import hashlib
+
+from django.db.models import Exists, OuterRef
+from django.db.models.fields.json import KT
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+
+from .cache import canonical_query, get_generation
+from .models import Favorite, Pet
+
+
+def pet_version(pk, updated_at):
+    """Opaque version of one pet row; changes whenever updated_at does."""
+    return f'{pk}.{int(updated_at.timestamp() * 1_000_000)}'
+
+
+def make_etag(request, version, *state):
+    """
+    Strong ETag: `"<version>-<variant>"`.
+
+    The variant hashes everything else that changes the body for the same
+    row(s): the query string (fields, view, cursor...), the negotiated media
+    type, `state` that moves without touching updated_at (favorites_count,
+    and for a signed-in user `is_favorited`) and the user. If-Match
+    on writes only compares the version part, so a tag from any
+    representation of the pet can be sent back.
+    """
+    accept = request.META.get('HTTP_ACCEPT', '')
+    user = request.user.pk if request.user.is_authenticated else ''
+    source = '|'.join([canonical_query(request.GET), accept, str(user)] + [str(part) for part in state])
+    variant = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+    return f'"{version}-{variant}"'
+
+
+def etag_versions(header):
+    """The versions named by the strong tags of an If-Match header; '*' stays as is."""
+    versions = []
+    for etag in parse_etags(header):
+        if etag == '*':
+            versions.append(etag)
+        elif etag.startswith('"'):
+            versions.append(etag.strip('"').rsplit('-', 1)[0])
+    return versions
+
+
+def detail_validators(request, pk):
+    """(etag, last_modified) for one pet from a single primary-key lookup, or None if it does not exist."""
+    # The image and its derivatives change without moving updated_at (see
+    # listings.images.generate_derivatives), so they are part of the variant.
+    queryset = Pet.objects.filter(pk=pk).annotate(derivatives=KT('image_derivatives__source'))
+    columns = ['updated_at', 'favorites_count', 'image', 'derivatives']
+    if request.user.is_authenticated:
+        queryset = queryset.annotate(favorited=Exists(Favorite.objects.filter(user=request.user, pet=OuterRef('pk'))))
+        columns.append('favorited')
+    row = queryset.values_list(*columns).first()
+    if row is None:
+        return None
+    updated_at = row[0]
+    return make_etag(request, pet_version(pk, updated_at), *row[1:]), updated_at
+
+
+def list_validators(request, queryset, paginator):
+    """
+    (etag, last_modified) for the page `paginator` is about to return: the
+    ids, updated_at and favorite state of its keyset slice, read as narrow
+    rows off the ordering index, plus the response cache generation. Every
+    Pet and Favorite write bumps the generation, which covers what the
+    slice cannot show: the stats banner and rows leaving the filtered set.
+    """
+    field, _ = paginator.get_ordering(queryset)
+    names = ['pk', 'updated_at', 'favorites_count'] + ([field] if field not in ('pk', 'favorites_count') else [])
+    if request.user.is_authenticated:
+        queryset = queryset.annotate(favorited=Exists(Favorite.objects.filter(user=request.user, pet=OuterRef('pk'))))
+        names.append('favorited')
+    rows = paginator.paginate_queryset(queryset.values(*names), request)
+    page = [
+        (row['pk'], int(row['updated_at'].timestamp() * 1_000_000), row['favorites_count'], row.get('favorited'))
+        for row in rows
+    ]
+    digest = hashlib.sha1(repr((page, paginator.next_position)).encode('utf-8')).hexdigest()[:16]
+    last_modified = max((row['updated_at'] for row in rows), default=None)
+    return make_etag(request, f'g{get_generation()}.{digest}'), last_modified
+
+
+def not_modified(request, validators):
+    """The 304 (or 412) response for a conditional request, or None to render normally."""
+    if validators is None:
+        return None
+    etag, last_modified = validators
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None and response.status_code == 304:
+        set_validators(response, validators, status=304)
+    return response
+
+
+def set_validators(response, validators, status=200):
+    if validators is None or response.status_code != status:
+        return response
+    etag, last_modified = validators
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
@@ -0,0 +1,84 @@
+import decimal
+
+from django.db import connections
+
+DEFAULT_BUCKETS = 10
+MAX_BUCKETS = 50
+DISTRIBUTION_FIELDS = ('price', 'age')
+PRICE_QUANTUM = decimal.Decimal('0.01')
+
+
+def bucket_sql(vendor, column, low, high, buckets):
+    """1-based bucket of `column` in [low, high]; the maximum lands in the last bucket."""
+    if vendor == 'postgresql':
+        bucket = f'LEAST(width_bucket({column}::numeric, {low}::numeric, {high}::numeric, {buckets}), {buckets})'
+    elif vendor == 'sqlite':
+        # width_bucket() by hand: floor((x - low) * n / (high - low)) + 1.
+        bucket = f'MIN(CAST(({column} - {low}) * {buckets} / ({high} - {low}) AS INTEGER) + 1, {buckets})'
+    else:
+        bucket = f'LEAST(FLOOR(({column} - {low}) * {buckets} / ({high} - {low})) + 1, {buckets})'
+    # width_bucket() rejects an empty range; every value then shares bucket 1.
+    return f'CASE WHEN {high} = {low} THEN 1 ELSE {bucket} END'
+
+
+def distribution(queryset, buckets=DEFAULT_BUCKETS):
+    """
+    min, max and an N-bucket histogram of price and age for a filtered Pet
+    queryset, from a single query: the filtered rows feed one bounds row and
+    one GROUP BY per field, glued together with UNION ALL.
+    """
+    using = queryset.db
+    connection = connections[using]
+    pets_sql, params = queryset.order_by().values(*DISTRIBUTION_FIELDS).query.get_compiler(using).as_sql()
+
+    parts = []
+    for field in DISTRIBUTION_FIELDS:
+        low, high = f'bounds.min_{field}', f'bounds.max_{field}'
+        bucket = bucket_sql(connection.vendor, f'pets.{field}', low, high, buckets)
+        parts.append(
+            f"SELECT '{field}', {bucket}, COUNT(*), {low}, {high} "
+            f'FROM pets CROSS JOIN bounds WHERE pets.{field} IS NOT NULL '
+            f'GROUP BY {bucket}, {low}, {high}'
+        )
+    bounds = ', '.join(f'MIN({field}) AS min_{field}, MAX({field}) AS max_{field}' for field in DISTRIBUTION_FIELDS)
+    sql = (
+        f'WITH pets AS ({pets_sql}), bounds AS (SELECT {bounds}, COUNT(*) AS total FROM pets) '
+        f"SELECT 'total', NULL, total, NULL, NULL FROM bounds UNION ALL " + ' UNION ALL '.join(parts)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    result = {'count': 0}
+    counts = {field: {} for field in DISTRIBUTION_FIELDS}
+    limits = {field: (None, None) for field in DISTRIBUTION_FIELDS}
+    for kind, bucket, count, low, high in rows:
+        if kind == 'total':
+            result['count'] = count
+        else:
+            counts[kind][bucket] = count
+            limits[kind] = (low, high)
+    for field in DISTRIBUTION_FIELDS:
+        result[field] = histogram(field, *limits[field], counts[field], buckets)
+    return result
+
+
+def histogram(field, low, high, counts, buckets):
+    if low is None:
+        return {'min': None, 'max': None, 'buckets': []}
+    if field == 'price':
+        low, high = decimal.Decimal(str(low)), decimal.Decimal(str(high))
+    width = (high - low) / buckets
+    edges = [low + width * i for i in range(buckets)] + [high]
+    if field == 'price':
+        edges = [edge.quantize(PRICE_QUANTUM) for edge in edges]
+    else:
+        edges = [round(edge, 2) for edge in edges]
+    return {
+        'min': edges[0],
+        'max': edges[-1],
+        'buckets': [
+            {'from': edges[i], 'to': edges[i + 1], 'count': counts.get(i + 1, 0)}
+            for i in range(buckets)
+        ],
+    }
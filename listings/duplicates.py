@@ -0,0 +1,232 @@
+import hashlib
+import random
+import re
+import struct
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from rest_framework.filters import BaseFilterBackend
+
+from .cache import invalidate_on_commit
+from .models import Pet, PetDuplicate, PetFingerprint, PetFingerprintBucket
+
+# Descriptions are compared as sets of word 3-grams ("shingles").
+SHINGLE_SIZE = 3
+# Fewer shingles than this ("Friendly and house trained.") says too little
+# to call two listings the same, so short descriptions get no signature.
+MIN_SHINGLES = 8
+MINHASH_PERMUTATIONS = 64
+# LSH: listings that agree on every value of any one band are candidates.
+# 16 bands of 4 finds pairs at similarity 0.7 with p > 0.98 while pairs
+# below 0.2 only collide with p < 0.03.
+MINHASH_BANDS = 16
+MINHASH_ROWS = MINHASH_PERMUTATIONS // MINHASH_BANDS
+# A renamed re-post with a sentence touched up still scores above this.
+DUPLICATE_TEXT_SIMILARITY = 0.7
+# dHash bits a re-encoded, resized or lightly edited copy may differ in.
+DUPLICATE_IMAGE_DISTANCE = 4
+# The hash is filed under its 3 segments (21-22 bits). Two hashes within 4
+# bits differ by at most 1 bit in one of them (pigeonhole), so a lookup asks
+# for each segment and its one-bit neighbours: 66 keys, and at a million
+# listings well under one random collision per key.
+IMAGE_SEGMENT_COUNT = 3
+IMAGE_SEGMENT_RADIUS = DUPLICATE_IMAGE_DISTANCE // IMAGE_SEGMENT_COUNT
+# Candidates verified per pet, those sharing the most keys first; bounds the
+# work for a photo or text that thousands of listings share.
+DUPLICATE_MAX_CANDIDATES = 200
+HIDE_DUPLICATES_PARAM = 'hide_duplicates'
+
+_MASK64 = (1 << 64) - 1
+# Fixed seed: signatures are stored, so every process must permute alike.
+_seed = random.Random(0x5EED)
+PERMUTATIONS = [(_seed.getrandbits(64) | 1, _seed.getrandbits(64)) for _ in range(MINHASH_PERMUTATIONS)]
+_signature = struct.Struct(f'<{MINHASH_PERMUTATIONS}I')
+_bounds = [64 * i // IMAGE_SEGMENT_COUNT for i in range(IMAGE_SEGMENT_COUNT + 1)]
+IMAGE_SEGMENTS = list(zip(_bounds, _bounds[1:]))
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _signed(value):
+    """Unsigned 64-bit value as stored in a BigIntegerField."""
+    return value - (1 << 64) if value is not None and value >= 1 << 63 else value
+
+
+def _unsigned(value):
+    return value & _MASK64 if value is not None else None
+
+
+def shingles(text):
+    words = re.findall(r'\w+', (text or '').lower())
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+    """MinHash signature of a description as a tuple of 32-bit values, or None when it is too short."""
+    hashes = [_hash64(shingle) for shingle in shingles(text)]
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    # Multiply-add mod 2**64 with an odd multiplier permutes the hashes; the high bits mix best.
+    return tuple(min([(a * h + b) & _MASK64 for h in hashes]) >> 32 for a, b in PERMUTATIONS)
+
+
+def pack_signature(signature):
+    return _signature.pack(*signature) if signature is not None else None
+
+
+def unpack_signature(data):
+    return _signature.unpack(bytes(data)) if data is not None else None
+
+
+def text_similarity(first, second):
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return sum(a == b for a, b in zip(first, second)) / MINHASH_PERMUTATIONS
+
+
+def image_distance(first, second):
+    return (first ^ second).bit_count()
+
+
+def _segment_key(index, value):
+    return _hash64(f'i{index}:{value}')
+
+
+def _band_keys(signature):
+    return [
+        _hash64(f't{band}:' + ','.join(map(str, signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS])))
+        for band in range(MINHASH_BANDS)
+    ]
+
+
+def bucket_keys(image_hash, signature):
+    """The PetFingerprintBucket keys a fingerprint is filed under: its dHash segments and MinHash bands."""
+    keys = []
+    if image_hash is not None:
+        for index, (low, high) in enumerate(IMAGE_SEGMENTS):
+            keys.append(_segment_key(index, (image_hash >> low) & ((1 << (high - low)) - 1)))
+    if signature is not None:
+        keys += _band_keys(signature)
+    return [_signed(key) for key in keys]
+
+
+def lookup_keys(image_hash, signature):
+    """The keys to look a fingerprint's near-duplicates up under: bucket_keys() plus the segments' neighbours."""
+    keys = []
+    if image_hash is not None:
+        for index, (low, high) in enumerate(IMAGE_SEGMENTS):
+            value = (image_hash >> low) & ((1 << (high - low)) - 1)
+            for flips in range(IMAGE_SEGMENT_RADIUS + 1):
+                for bits in combinations(range(high - low), flips):
+                    flipped = value
+                    for bit in bits:
+                        flipped ^= 1 << bit
+                    keys.append(_segment_key(index, flipped))
+    if signature is not None:
+        keys += _band_keys(signature)
+    return [_signed(key) for key in keys]
+
+
+def pet_fingerprint(description, image, derivatives):
+    """(image hash, MinHash signature) of a pet row; the dHash comes with its image derivatives."""
+    digest = derivatives.get('dhash') if image and derivatives and derivatives.get('source') == image else None
+    return (int(digest, 16) if digest else None), minhash(description)
+
+
+def find_duplicates(pet_id, owner_id, image_hash, signature, using='default'):
+    """
+    PetDuplicate rows (unsaved) pairing the pet with every listing whose
+    fingerprint is close enough. Candidates come from one indexed
+    `key IN (...)` lookup and are then verified exactly; the newer listing of
+    each pair is the duplicate.
+    """
+    keys = lookup_keys(image_hash, signature)
+    if not keys:
+        return []
+    candidates = (
+        PetFingerprintBucket.objects.using(using).filter(key__in=keys).exclude(pet_id=pet_id)
+        .values('pet_id').annotate(hits=Count('id')).order_by('-hits', 'pet_id')
+        .values_list('pet_id', flat=True)[:DUPLICATE_MAX_CANDIDATES]
+    )
+    rows = (
+        PetFingerprint.objects.using(using).filter(pet_id__in=list(candidates))
+        .values_list('pet_id', 'pet__owner_id', 'image_hash', 'text_signature')
+    )
+    duplicates = []
+    for other_id, other_owner_id, other_hash, other_signature in rows:
+        distance = similarity = None
+        if image_hash is not None and other_hash is not None:
+            distance = image_distance(image_hash, _unsigned(other_hash))
+        if signature is not None and other_signature is not None:
+            similarity = text_similarity(signature, unpack_signature(other_signature))
+        if (distance is None or distance > DUPLICATE_IMAGE_DISTANCE) and (
+            similarity is None or similarity < DUPLICATE_TEXT_SIMILARITY
+        ):
+            continue
+        copy, original = (pet_id, other_id) if other_id < pet_id else (other_id, pet_id)
+        duplicates.append(PetDuplicate(
+            pet_id=copy, original_id=original, same_owner=owner_id == other_owner_id,
+            image_distance=distance, text_similarity=similarity,
+        ))
+    return duplicates
+
+
+def fingerprint_pets(pet_ids, using='default'):
+    """
+    Recompute the fingerprints of `pet_ids` and, for those that changed,
+    re-file their buckets and re-record their duplicates. Returns the
+    PetDuplicate rows created.
+    """
+    pet_ids = list(pet_ids)
+    stored = {
+        pk: (image_hash, bytes(signature) if signature is not None else None)
+        for pk, image_hash, signature in PetFingerprint.objects.using(using)
+        .filter(pet_id__in=pet_ids).values_list('pet_id', 'image_hash', 'text_signature')
+    }
+    rows = Pet.objects.using(using).filter(id__in=pet_ids).values_list(
+        'id', 'owner_id', 'description', 'image', 'image_derivatives',
+    )
+    created = []
+    for pk, owner_id, description, image, derivatives in rows:
+        image_hash, signature = pet_fingerprint(description, image, derivatives)
+        values = {'image_hash': _signed(image_hash), 'text_signature': pack_signature(signature)}
+        if stored.get(pk, (None, None)) == (values['image_hash'], values['text_signature']):
+            # A status or price edit: nothing duplicate detection looks at changed.
+            continue
+        with transaction.atomic(using=using):
+            PetFingerprint.objects.using(using).update_or_create(pet_id=pk, defaults=values)
+            PetFingerprintBucket.objects.using(using).filter(pet_id=pk).delete()
+            PetDuplicate.objects.using(using).filter(Q(pet_id=pk) | Q(original_id=pk)).delete()
+            PetFingerprintBucket.objects.using(using).bulk_create(
+                [PetFingerprintBucket(pet_id=pk, key=key) for key in bucket_keys(image_hash, signature)],
+                ignore_conflicts=True,
+            )
+            duplicates = find_duplicates(pk, owner_id, image_hash, signature, using)
+            PetDuplicate.objects.using(using).bulk_create(duplicates, ignore_conflicts=True)
+            # ?hide_duplicates= list responses change with them.
+            invalidate_on_commit(using)
+        created += duplicates
+    return created
+
+
+def fingerprint_on_commit(pet_ids, using='default'):
+    pet_ids = list(pet_ids)
+    if pet_ids:
+        transaction.on_commit(lambda: fingerprint_pets(pet_ids, using), using=using, robust=True)
+
+
+def hide_duplicates(queryset, params):
+    """`queryset` without the listings their own owner re-posted if `params` ask for it; the original stays."""
+    if params.get(HIDE_DUPLICATES_PARAM) not in ('1', 'true', 'True'):
+        return queryset
+    reposts = PetDuplicate.objects.filter(pet=OuterRef('pk'), same_owner=True)
+    return queryset.filter(~Exists(reposts))
+
+
+class HideDuplicatesFilter(BaseFilterBackend):
+    """`?hide_duplicates=true` on the list views; see hide_duplicates()."""
+
+    def filter_queryset(self, request, queryset, view):
+        return hide_duplicates(queryset, request.query_params)
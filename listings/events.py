@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import threading
+from itertools import product
+
+from django.conf import settings
+from django.db import transaction
+
+from .cards import card_queryset, pet_cards
+from .export import EXPORT_FIELDS
+from .models import Pet
+
+logger = logging.getLogger(__name__)
+
+# Events a subscriber has not read yet. A client that falls this far behind
+# is disconnected (and reconnects) instead of buffering without bound.
+SUBSCRIBER_QUEUE_SIZE = 256
+REDIS_CHANNEL = 'listings:pet-events'
+REDIS_RECONNECT_SECONDS = 1
+
+
+def subscription_key(pet_type=None, city=None, is_urgent=None):
+    """The key a stream filter is stored under; None matches anything."""
+    return (pet_type, city.casefold() if city else None, is_urgent)
+
+
+def event_keys(pet):
+    """The 2**3 subscription keys a pet matches: each filter either pinned to the pet's value or unset."""
+    return product((pet['type'], None), (pet['city'].casefold(), None), (pet['is_urgent'], None))
+
+
+def format_event(event):
+    data = json.dumps(event['pet'], ensure_ascii=False, separators=(',', ':'))
+    return f"event: {event['event']}\ndata: {data}\n\n".encode('utf-8')
+
+
+class Subscription:
+    def __init__(self, key, loop):
+        self.key = key
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def close(self):
+        # The reader stops at None, or at the overflow flag if the queue is full.
+        self.deliver(None)
+
+
+def _deliver_all(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.deliver(message)
+
+
+class LocalBroker:
+    """
+    In-process fan-out. Subscribers are grouped by filter key, so an event
+    costs eight dict lookups however many clients are connected, and is
+    encoded once for all of them. publish() may be called from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, key):
+        subscription = Subscription(key, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def broadcast(self, message, loop):
+        """Deliver `message` to every subscription on `loop`, from that loop; returns how many."""
+        with self._lock:
+            subscriptions = [
+                subscription
+                for subscribers in self._subscribers.values()
+                for subscription in subscribers
+                if subscription.loop is loop
+            ]
+        _deliver_all(subscriptions, message)
+        return len(subscriptions)
+
+    def publish(self, events):
+        self.dispatch(events)
+
+    def dispatch(self, events):
+        for event in events:
+            with self._lock:
+                targets = [
+                    subscription
+                    for key in event_keys(event['pet'])
+                    for subscription in self._subscribers.get(key, ())
+                ]
+            if not targets:
+                continue
+            message = format_event(event)
+            by_loop = {}
+            for subscription in targets:
+                by_loop.setdefault(subscription.loop, []).append(subscription)
+            for loop, subscriptions in by_loop.items():
+                try:
+                    loop.call_soon_threadsafe(_deliver_all, subscriptions, message)
+                except RuntimeError:
+                    # The loop has shut down; its subscriptions are going away with it.
+                    pass
+
+
+class RedisBroker(LocalBroker):
+    """
+    Publishes through Redis pub/sub so every worker process sees every event.
+    Each process keeps one subscription to the channel and fans the messages
+    out to its own clients through LocalBroker.
+    """
+
+    def __init__(self, url, channel=REDIS_CHANNEL):
+        import redis
+
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def has_subscribers(self):
+        # Clients may be connected to any worker.
+        return True
+
+    def subscribe(self, key):
+        subscription = super().subscribe(key)
+        if self._listener is None or self._listener.done():
+            self._listener = subscription.loop.create_task(self._listen())
+        return subscription
+
+    def publish(self, events):
+        self._client.publish(self.channel, json.dumps(events, separators=(',', ':')))
+
+    async def _listen(self):
+        import redis.asyncio as aioredis
+
+        while True:
+            client = aioredis.Redis.from_url(self.url)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    self.dispatch(json.loads(message['data']))
+            except (OSError, aioredis.RedisError):
+                logger.warning('Lost the pet events subscription; reconnecting', exc_info=True)
+                await asyncio.sleep(REDIS_RECONNECT_SECONDS)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_event_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = getattr(settings, 'LISTINGS_EVENTS_REDIS_URL', None)
+                _broker = RedisBroker(url) if url else LocalBroker()
+    return _broker
+
+
+def publish_pets(pet_ids, event, using='default'):
+    """Publish the cards of `pet_ids` as `event` ('created' or 'updated')."""
+    broker = get_event_broker()
+    if not broker.has_subscribers():
+        return
+    rows = card_queryset(Pet.objects.using(using).filter(id__in=pet_ids).order_by('id'), EXPORT_FIELDS)
+    broker.publish([{'event': event, 'pet': pet} for pet in pet_cards(rows, fields=EXPORT_FIELDS)])
+
+
+def publish_on_commit(pet_ids, event, using='default'):
+    pet_ids = list(pet_ids)
+    # A broker outage is logged rather than failing a write that already committed.
+    transaction.on_commit(lambda: publish_pets(pet_ids, event, using), using=using, robust=True)
@@ -0,0 +1,87 @@
+import hashlib
+
+from django.db.models import Count
+from django.http import QueryDict
+from rest_framework.exceptions import ValidationError
+
+from .cache import canonical_query, get_cache, get_generation, response_cache_timeout
+from .duplicates import HIDE_DUPLICATES_PARAM, hide_duplicates
+from .filters import PetFilter
+from .models import Pet
+from .search import get_search_backend
+
+FACETS_KEY_PREFIX = 'listings:facets'
+SEARCH_PARAM = 'search'
+CITY_FACET_LIMIT = 50
+
+# Facet -> the query parameters that filter on it. A facet is counted with
+# every other filter applied but its own, so the sidebar can show what each
+# alternative value would return (drill-down / "OR within a facet" counts).
+FACETS = {
+    'type': ('type',),
+    'status': ('status',),
+    'gender': ('gender',),
+    'city': ('city', 'city__icontains'),
+    'vaccinated': ('vaccinated',),
+}
+FACET_CHOICES = {
+    'type': [value for value, _ in Pet.PET_TYPE],
+    'status': [value for value, _ in Pet.PET_STATUS],
+    'gender': [value for value, _ in Pet.GENDER_CHOICES],
+    'vaccinated': [True, False],
+}
+
+
+def facet_params(query_params):
+    """Only the filter parameters, so paging or ordering never splits the cache."""
+    params = QueryDict(mutable=True)
+    for name in list(PetFilter.base_filters) + [SEARCH_PARAM, HIDE_DUPLICATES_PARAM]:
+        if name in query_params:
+            params.setlist(name, query_params.getlist(name))
+    return params
+
+
+def filtered_pets(params):
+    """PetFilter (plus `?hide_duplicates=` and `?search=`) applied to every pet, as the list endpoint does."""
+    filterset = PetFilter(params, queryset=Pet.objects.all())
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    queryset = hide_duplicates(filterset.qs, params)
+    text = params.get(SEARCH_PARAM, '').strip()
+    if text:
+        queryset = get_search_backend(queryset.db).search(queryset, text)
+    return queryset
+
+
+def facet_counts(params):
+    """
+    {facet: [{'value': ..., 'count': n}, ...]} with one GROUP BY per facet,
+    so five queries whatever the filters. Choice facets list every choice,
+    including zeros; cities list the most common ones.
+    """
+    facets = {}
+    for facet, own_params in FACETS.items():
+        others = params.copy()
+        for name in own_params:
+            others.pop(name, None)
+        rows = filtered_pets(others).order_by().values(facet).annotate(count=Count('id'))
+        counts = {row[facet]: row['count'] for row in rows}
+        if facet in FACET_CHOICES:
+            facets[facet] = [{'value': value, 'count': counts.get(value, 0)} for value in FACET_CHOICES[facet]]
+        else:
+            top = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:CITY_FACET_LIMIT]
+            facets[facet] = [{'value': value, 'count': count} for value, count in top]
+    return facets
+
+
+def cached_facet_counts(query_params):
+    """facet_counts() cached per filter combination until the next Pet write."""
+    params = facet_params(query_params)
+    cache = get_cache()
+    digest = hashlib.sha1(canonical_query(params).encode('utf-8')).hexdigest()
+    key = f'{FACETS_KEY_PREFIX}:{get_generation()}:{digest}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = facet_counts(params)
+        cache.set(key, facets, response_cache_timeout())
+    return facets
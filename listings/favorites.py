@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models import BooleanField, Count, Exists, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .cache import invalidate_on_commit
+from .models import Favorite, Pet
+from .writes import delete_rows
+
+
+def annotate_favorited(queryset, user):
+    """
+    `is_favorited` for every pet in the queryset: an EXISTS subquery against
+    the user's favorites, or a constant False for anonymous users.
+    """
+    if not user.is_authenticated:
+        return queryset.annotate(is_favorited=Value(False, output_field=BooleanField()))
+    return queryset.annotate(is_favorited=Exists(Favorite.objects.filter(user=user, pet=OuterRef('pk'))))
+
+
+def favorites_count_subquery():
+    """The true favorite count of the outer pet, as a correlated subquery."""
+    counts = (
+        Favorite.objects.filter(pet=OuterRef('pk')).order_by()
+        .values('pet').annotate(count=Count('id')).values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def adjust_favorites_count(pet_id, delta, using='default'):
+    """Atomic `favorites_count = favorites_count + delta` in the database, never below zero."""
+    pets = Pet.objects.using(using).filter(pk=pet_id)
+    if delta < 0:
+        pets = pets.filter(favorites_count__gte=-delta)
+    pets.update(favorites_count=F('favorites_count') + delta)
+
+
+def recount_favorites(queryset):
+    """Set favorites_count from the Favorite table for every pet in the queryset."""
+    return queryset.update(favorites_count=favorites_count_subquery())
+
+
+def add_favorites(user, pet_ids, using='default'):
+    """Favorite every existing pet among `pet_ids`; returns their ids."""
+    found = list(Pet.objects.using(using).filter(id__in=pet_ids).values_list('id', flat=True))
+    if found:
+        with transaction.atomic(using=using):
+            # Already favorited pets are skipped by the unique (user, pet) constraint.
+            Favorite.objects.using(using).bulk_create(
+                [Favorite(user=user, pet_id=pk) for pk in found], ignore_conflicts=True
+            )
+            # bulk_create() sends no post_save and does not say which rows were
+            # new, so the counters of the touched pets are recounted instead.
+            recount_favorites(Pet.objects.using(using).filter(id__in=found))
+            invalidate_on_commit(using)
+    return found
+
+
+def remove_favorites(user, pet_ids, using='default'):
+    """Unfavorite `pet_ids` with one DELETE; returns how many favorites were removed."""
+    with transaction.atomic(using=using):
+        # No post_delete per favorite: the counters are recounted below instead.
+        removed = delete_rows(Favorite.objects.using(using).filter(user=user, pet__in=pet_ids))
+        if removed:
+            recount_favorites(Pet.objects.using(using).filter(id__in=pet_ids))
+            invalidate_on_commit(using)
+    return removed
@@ -0,0 +1,93 @@
+import functools
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+
+from .models import Pet
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+# Serializer fields that are not a Pet column of the same name.
+PET_FIELD_COLUMNS = {'owner': 'owner__username'}
+# Serializer fields computed by an annotation rather than loaded from a column.
+PET_ANNOTATED_FIELDS = ('is_favorited',)
+
+
+@functools.lru_cache(maxsize=None)
+def pet_field_names():
+    """PetSerializer's field names, in output order."""
+    from .serializers import PetSerializer
+    return tuple(PetSerializer().fields)
+
+
+def _split(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def parse_fieldset(query_params, available, default=None):
+    """
+    Resolve `?fields=` / `?exclude=` against the `available` field names.
+
+    Returns the selected names in `available` order, or None when the client
+    did not ask for a subset. Unknown names are rejected with a 400.
+    """
+    fields = query_params.get(FIELDS_PARAM)
+    exclude = query_params.get(EXCLUDE_PARAM)
+    if not fields and not exclude:
+        return None
+
+    requested = _split(fields) if fields else list(default or available)
+    excluded = _split(exclude) if exclude else []
+    errors = {}
+    for param, names in [(FIELDS_PARAM, requested), (EXCLUDE_PARAM, excluded)]:
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            errors[param] = [
+                f"Unknown field(s): {', '.join(unknown)}. Available fields: {', '.join(available)}."
+            ]
+    if errors:
+        raise ValidationError(errors)
+
+    return [name for name in available if name in requested and name not in excluded]
+
+
+def _is_pet_column(name):
+    try:
+        return Pet._meta.get_field(name).concrete
+    except FieldDoesNotExist:
+        return False
+
+
+def prune_pet_columns(queryset, fieldset, prefix=''):
+    """
+    Push a fieldset down to SQL with `.only()`.
+
+    The pk and every column the queryset is ordered by stay loaded, so the
+    keyset paginator never triggers a deferred-field query. `prefix` is the
+    path to the Pet from the queryset's model (e.g. `pet__` for favorites).
+    """
+    if fieldset is None:
+        return queryset
+
+    columns = {'id', 'created_at'}
+    for name in fieldset:
+        if name not in PET_ANNOTATED_FIELDS:
+            columns.add(PET_FIELD_COLUMNS.get(name, name))
+    for term in queryset.query.order_by:
+        if isinstance(term, str):
+            name = term.lstrip('-')
+            if not name.startswith(prefix):
+                continue
+            name = name[len(prefix):]
+            if _is_pet_column(name):
+                columns.add(name)
+
+    # select_related and only() must agree on which relations are loaded.
+    related = [prefix[:-2]] if prefix else []
+    if 'owner' in fieldset:
+        related.append(prefix + 'owner')
+    queryset = queryset.select_related(None)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*[prefix + column for column in sorted(columns)])
@@ -15,5 +15,6 @@ class PetFilter(filters.FilterSet):
             'gender': ['exact'],
             'status': ['exact'],
             'vaccinated': ['exact'],
+            'is_urgent': ['exact'],
             'city': ['exact', 'icontains'],
         }
\ No newline at end of file
@@ -0,0 +1,219 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .cache import invalidate_on_commit
+from .duplicates import fingerprint_on_commit
+from .models import Pet
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels; smaller originals are never upscaled.
+DERIVATIVE_SIZES = {
+    'thumb': 200,
+    'card': 480,
+    'full': 1280,
+}
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DERIVATIVE_DIR = 'pets/derivatives'
+JPEG_BACKGROUND = (255, 255, 255)
+
+IMAGE_STORAGE = Pet._meta.get_field('image').storage
+# Plain storage: derivative names are derived from the source blob's name, so
+# pets sharing a blob share its derivatives too.
+DERIVATIVE_STORAGE = default_storage
+
+_executor = None
+_executor_lock = threading.Lock()
+# Pet ids queued or being built in this process -> whether another request
+# came in meanwhile (e.g. the image was replaced mid-build), so it runs again.
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def derivative_dir(source):
+    return f'{DERIVATIVE_DIR}/{os.path.basename(source)}'
+
+
+def derivative_name(source, size, extension):
+    return f'{derivative_dir(source)}/{size}.{extension}'
+
+
+def _replace(name, content):
+    DERIVATIVE_STORAGE.delete(name)
+    return DERIVATIVE_STORAGE.save(name, content)
+
+
+def _encode(image, image_format, options):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        flat = Image.new('RGB', image.size, JPEG_BACKGROUND)
+        flat.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = flat
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def image_hash(image):
+    """64-bit dHash: whether each pixel of a 9x8 grayscale copy is brighter than its right neighbour."""
+    pixels = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    bits = 0
+    for row in range(0, 72, 9):
+        for column in range(row, row + 8):
+            bits = bits << 1 | (pixels[column] > pixels[column + 1])
+    return bits
+
+
+def build_derivatives(name):
+    """
+    Write every size in every format for the stored image `name` and return
+    what Pet.image_derivatives keeps: `{'source': name, 'sizes': {size:
+    {'width', 'height', <format>: storage name}}, 'dhash': hex}`.
+    """
+    largest = max(DERIVATIVE_SIZES.values())
+    with IMAGE_STORAGE.open(name, 'rb') as source:
+        image = Image.open(source)
+        # JPEGs decode straight at a reduced scale, which is most of the work for camera photos.
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+    sizes = {}
+    # Largest first, each size resampled from the previous one.
+    for size, edge in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        entry = {'width': image.width, 'height': image.height}
+        for extension, (image_format, options) in DERIVATIVE_FORMATS.items():
+            content = ContentFile(_encode(image, image_format, options))
+            entry[extension] = _replace(derivative_name(name, size, extension), content)
+        sizes[size] = entry
+    # From the smallest size, which is cheap and already free of noise a dHash ignores anyway.
+    return {
+        'source': name,
+        'sizes': {size: sizes[size] for size in DERIVATIVE_SIZES},
+        'dhash': f'{image_hash(image):016x}',
+    }
+
+
+def delete_derivative_files(source):
+    """Remove the derivatives of a source image that no pet references any more."""
+    directory = derivative_dir(source)
+    try:
+        _, files = DERIVATIVE_STORAGE.listdir(directory)
+    except FileNotFoundError:
+        return
+    for file in files:
+        DERIVATIVE_STORAGE.delete(f'{directory}/{file}')
+
+
+def generate_derivatives(pet_id, using='default', force=False):
+    """
+    Build and record the derivatives of a pet's current image. The row is
+    only written if the image is still the one that was resized, and the pet
+    is fingerprinted again with the image's dHash. updated_at stays put: it
+    is the pet's version for If-Match, and the owner's last write response
+    must still name it. Cached responses are invalidated and the detail
+    ETag's variant follows the derivatives instead.
+    Pets sharing the image's blob share its derivatives, so a blob is only
+    resized once; `force` rebuilds it anyway.
+    """
+    row = Pet.objects.using(using).filter(pk=pet_id).values_list('image', 'image_derivatives').first()
+    if row is None or not row[0]:
+        return None
+    name, current = row
+    if current.get('source') == name and not force:
+        # Already built (or already failed) for this image.
+        return current
+    shared = None
+    if not force:
+        shared = (
+            Pet.objects.using(using).filter(image=name, image_derivatives__source=name)
+            .values_list('image_derivatives', flat=True).first()
+        )
+    try:
+        derivatives = shared or build_derivatives(name)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Could not build derivatives of %s for pet %s', name, pet_id, exc_info=True)
+        # Recorded so that reads stop asking for it again.
+        derivatives = {'source': name, 'failed': True}
+    updated = Pet.objects.using(using).filter(pk=pet_id, image=name).update(image_derivatives=derivatives)
+    if not updated:
+        # The image changed meanwhile; the files stay with the blob, which is
+        # released (with its derivatives) once nothing references it.
+        return None
+    invalidate_on_commit(using)
+    fingerprint_on_commit([pet_id], using)
+    return derivatives
+
+
+def _generate_in_worker(pet_id, using):
+    try:
+        while True:
+            try:
+                generate_derivatives(pet_id, using)
+            except Exception:
+                logger.exception('Derivative generation failed for pet %s', pet_id)
+            with _pending_lock:
+                if not _pending[pet_id]:
+                    del _pending[pet_id]
+                    return
+                _pending[pet_id] = False
+    finally:
+        # Worker threads do not go through the request cycle that closes connections.
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Pillow releases the GIL while it decodes, resamples and encodes.
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'LISTINGS_IMAGE_WORKERS', 2), thread_name_prefix='pet-images',
+                )
+    return _executor
+
+
+def request_derivatives(pet_ids, using='default'):
+    """Queue derivative generation for `pet_ids`; a pet already queued in this process is not queued twice."""
+    for pet_id in pet_ids:
+        with _pending_lock:
+            if pet_id in _pending:
+                _pending[pet_id] = True
+                continue
+            _pending[pet_id] = False
+        get_executor().submit(_generate_in_worker, pet_id, using)
+
+
+def derivatives_on_commit(pet_ids, using='default'):
+    pet_ids = list(pet_ids)
+    if pet_ids:
+        transaction.on_commit(lambda: request_derivatives(pet_ids, using), using=using, robust=True)
+
+
+def derivative_urls(derivatives, build_uri=None):
+    """The API shape of Pet.image_derivatives: storage names become URLs. None until ready."""
+    if not derivatives or 'sizes' not in derivatives:
+        return None
+    result = {}
+    for size, entry in derivatives['sizes'].items():
+        result[size] = {'width': entry['width'], 'height': entry['height']}
+        for extension in DERIVATIVE_FORMATS:
+            url = DERIVATIVE_STORAGE.url(entry[extension])
+            result[size][extension] = build_uri(url) if build_uri is not None else url
+    return result
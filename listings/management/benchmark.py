@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class BenchmarkCommand(BaseCommand):
+    """
+    A management command that seeds synthetic rows and times queries against
+    them inside one transaction, rolled back at the end so nothing is left
+    behind. Subclasses implement benchmark().
+    """
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.benchmark(**options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, **options):
+        raise NotImplementedError('subclasses of BenchmarkCommand must provide a benchmark() method')
@@ -0,0 +1,165 @@
+import random
+import statistics
+import time
+from array import array
+
+from django.contrib.auth import get_user_model
+
+from listings.duplicates import (
+    DUPLICATE_IMAGE_DISTANCE, DUPLICATE_TEXT_SIMILARITY, _signed, _unsigned, bucket_keys, find_duplicates,
+    image_distance, minhash, pack_signature, text_similarity, unpack_signature,
+)
+from listings.management.benchmark import BenchmarkCommand
+from listings.models import Pet, PetFingerprint, PetFingerprintBucket
+
+
+VOCABULARY = [f'word{i}' for i in range(5000)]
+
+
+def description(seed):
+    rng = random.Random(seed)
+    return rng.sample(VOCABULARY, rng.randint(30, 60))
+
+
+def repost(words, image_hash, rng):
+    """What an owner bumping a listing does: touch up a word or two and re-upload a re-encoded photo."""
+    words = list(words)
+    for _ in range(rng.randint(0, 2)):
+        words[rng.randrange(len(words))] = rng.choice(VOCABULARY)
+    if image_hash is not None:
+        for _ in range(rng.randint(0, 3)):
+            image_hash ^= 1 << rng.randrange(64)
+    return words, image_hash
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Benchmark duplicate lookups through the fingerprint buckets over a synthetic corpus, against '
+        'comparing a new listing with every fingerprint. Runs inside a rolled-back transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000, help='Synthetic listings to create.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--repost-rate', type=float, default=0.05, help='Share of listings that re-post an earlier one.')
+        parser.add_argument('--probes', type=int, default=400, help='New listings to look up, half of them re-posts.')
+        parser.add_argument('--naive-sample', type=int, default=20000, help='Fingerprints to time a full scan on.')
+
+    def benchmark(self, **options):
+        self.seed(options['listings'], options['users'], options['repost_rate'])
+        self.run(options['probes'], options['naive_sample'])
+
+    def pets(self, owner_ids, rows):
+        """Insert pets for (owner index, words, image hash) rows with their fingerprints and buckets."""
+        pets = Pet.objects.bulk_create([
+            Pet(
+                name='Bench pet', type='dog', age=12, gender='male', description=' '.join(words),
+                city='Baku', owner_id=owner_ids[owner],
+            )
+            for owner, words, _ in rows
+        ])
+        fingerprints, buckets = [], []
+        for pet, (_, words, image_hash) in zip(pets, rows):
+            signature = minhash(' '.join(words))
+            fingerprints.append(PetFingerprint(
+                pet_id=pet.pk, image_hash=_signed(image_hash), text_signature=pack_signature(signature),
+            ))
+            buckets += [PetFingerprintBucket(pet_id=pet.pk, key=key) for key in bucket_keys(image_hash, signature)]
+        PetFingerprint.objects.bulk_create(fingerprints)
+        PetFingerprintBucket.objects.bulk_create(buckets, batch_size=10000)
+        return pets
+
+    def seed(self, count, users, repost_rate):
+        User = get_user_model()
+        self.rng = rng = random.Random(42)
+        # UUID primary keys are set client-side, so the returned objects can be used directly.
+        self.owner_ids = [
+            user.pk for user in User.objects.bulk_create([
+                User(username=f'bench-user-{i}', email=f'bench-user-{i}@example.com') for i in range(users)
+            ])
+        ]
+        started = time.perf_counter()
+        # Enough to rebuild any listing: owner, description seed (the words of
+        # a re-post) and photo hash; the pet ids line up with it.
+        self.corpus, self.ids = [], array('q')
+        batch = []
+        for i in range(count):
+            if self.corpus and rng.random() < repost_rate:
+                owner, words, image_hash = self.listing(rng.randrange(len(self.corpus)))
+                words, image_hash = repost(words, image_hash, rng)
+                self.corpus.append((owner, words, image_hash))
+            else:
+                owner, image_hash = rng.randrange(users), rng.getrandbits(64) if rng.random() < 0.9 else None
+                self.corpus.append((owner, i, image_hash))
+                words = description(i)
+            batch.append((owner, words, image_hash))
+            if len(batch) == 5000:
+                self.ids.extend(pet.pk for pet in self.pets(self.owner_ids, batch))
+                batch = []
+            if i and i % 100000 == 0:
+                self.stdout.write(f'  {i} listings, {time.perf_counter() - started:.0f}s')
+        self.ids.extend(pet.pk for pet in self.pets(self.owner_ids, batch))
+        self.stdout.write(
+            f'seeded {count} listings ({PetFingerprintBucket.objects.count()} bucket rows) '
+            f'in {time.perf_counter() - started:.1f}s'
+        )
+
+    def listing(self, index):
+        owner, words, image_hash = self.corpus[index]
+        return owner, description(words) if isinstance(words, int) else words, image_hash
+
+    def run(self, probes, naive_sample):
+        rng = self.rng
+        rows, expected = [], []
+        for i in range(probes):
+            if i % 2:
+                source = rng.randrange(len(self.corpus))
+                owner, words, image_hash = self.listing(source)
+                rows.append((owner, *repost(words, image_hash, rng)))
+                expected.append(source)
+            else:
+                rows.append((rng.randrange(len(self.owner_ids)), description(len(self.corpus) + i), rng.getrandbits(64)))
+                expected.append(None)
+        # Inserted without fingerprints: find_duplicates is what runs when one is filed.
+        pets = Pet.objects.bulk_create([
+            Pet(name='Probe', type='dog', age=12, gender='male', description=' '.join(words), city='Baku',
+                owner_id=self.owner_ids[owner])
+            for owner, words, _ in rows
+        ])
+        signatures = [minhash(' '.join(words)) for _, words, _ in rows]
+        find_duplicates(pets[0].pk, pets[0].owner_id, rows[0][2], signatures[0])  # warm up
+
+        timings, found, missed, false_positives = [], 0, 0, 0
+        for pet, (_, _, image_hash), signature, source in zip(pets, rows, signatures, expected):
+            start = time.perf_counter()
+            duplicates = find_duplicates(pet.pk, pet.owner_id, image_hash, signature)
+            timings.append((time.perf_counter() - start) * 1000)
+            originals = {duplicate.original_id for duplicate in duplicates}
+            if source is None:
+                false_positives += bool(originals)
+            elif self.ids[source] in originals:
+                found += 1
+            else:
+                missed += 1
+        timings.sort()
+        self.stdout.write(
+            f'bucket lookup  mean {statistics.mean(timings):7.2f} ms  p50 {timings[len(timings) // 2]:7.2f} ms  '
+            f'p95 {timings[int(len(timings) * 0.95)]:7.2f} ms'
+        )
+        self.stdout.write(
+            f're-posts found {found}/{found + missed}, fresh listings flagged {false_positives}/{len(rows) - found - missed}'
+        )
+
+        # The naive detector: read every fingerprint and compare it with the new listing.
+        image_hash, signature = rows[1][2], signatures[1]
+        start = time.perf_counter()
+        hits = 0
+        for other_hash, other_signature in PetFingerprint.objects.values_list('image_hash', 'text_signature')[:naive_sample]:
+            if other_hash is not None and image_distance(image_hash, _unsigned(other_hash)) <= DUPLICATE_IMAGE_DISTANCE:
+                hits += 1
+            elif other_signature is not None and text_similarity(signature, unpack_signature(other_signature)) >= DUPLICATE_TEXT_SIMILARITY:
+                hits += 1
+        per_row = (time.perf_counter() - start) * 1000 / naive_sample
+        total = PetFingerprint.objects.count()
+        self.stdout.write(f'full scan      {per_row * 1000:7.2f} us/listing -> ~{per_row * total:,.0f} ms per new listing for {total}')
+        self.stdout.write(self.style.SUCCESS(f'speedup: {per_row * total / statistics.mean(timings):,.0f}x'))
@@ -0,0 +1,82 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.renderers import JSONRenderer
+
+from listings.cards import card_queryset, pet_cards
+from listings.favorites import annotate_favorited
+from listings.management.benchmark import BenchmarkCommand
+from listings.models import Pet
+from listings.renderers import FastJSONRenderer
+from listings.serializers import PetSerializer
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Benchmark a list page rendered with PetSerializer + JSONRenderer against '
+        '`.values()` cards + FastJSONRenderer. Runs inside a rolled-back transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pets', type=int, default=2000, help='Synthetic pets to create.')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def benchmark(self, **options):
+        self.seed(options['pets'])
+        self.run(options['page_size'], options['repeat'])
+
+    def seed(self, count):
+        User = get_user_model()
+        owner = User.objects.create_user(username='bench-owner', email='bench-owner@example.com', password='unused-password')
+        rng = random.Random(42)
+        Pet.objects.bulk_create([
+            Pet(
+                name=f'Pet {i}',
+                type=rng.choice(['dog', 'cat', 'bird', 'rabbit']),
+                breed=rng.choice(['Labrador', 'Siamese', 'Poodle', 'Mixed']),
+                age=rng.randint(1, 120),
+                gender=rng.choice(['male', 'female']),
+                description='Friendly, vaccinated and house trained. ' * 8,
+                status=rng.choice(['adopting', 'selling', 'breeding']),
+                price=rng.randint(0, 2000),
+                vaccinated=rng.random() < 0.5,
+                is_urgent=rng.random() < 0.1,
+                city=rng.choice(['Baku', 'Ganja', 'Sumqayit']),
+                owner=owner,
+                image=f'pets/bench-{i}.jpg',
+            )
+            for i in range(count)
+        ], batch_size=500)
+
+    def run(self, page_size, repeat):
+        # As the list views serve anonymous users: a constant is_favorited.
+        queryset = annotate_favorited(
+            Pet.objects.select_related('owner').order_by('-created_at', '-id'), AnonymousUser(),
+        )
+
+        def full_page():
+            pets = list(queryset[:page_size])
+            return JSONRenderer().render(PetSerializer(pets, many=True).data)
+
+        def card_page():
+            rows = list(card_queryset(queryset)[:page_size])
+            return FastJSONRenderer().render(pet_cards(rows))
+
+        results = {}
+        for label, func in [('PetSerializer + JSONRenderer', full_page), ('cards + FastJSONRenderer', card_page)]:
+            func()  # warm up
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            elapsed = time.perf_counter() - start
+            results[label] = elapsed
+            self.stdout.write(
+                f'{label:32s} {elapsed / repeat * 1000:8.2f} ms/page  '
+                f'{repeat * page_size / elapsed:10.0f} pets/s'
+            )
+
+        baseline, cards = results.values()
+        self.stdout.write(self.style.SUCCESS(f'speedup: {baseline / cards:.1f}x'))
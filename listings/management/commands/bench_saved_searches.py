@@ -0,0 +1,109 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+
+from listings.filters import PetFilter
+from listings.management.benchmark import BenchmarkCommand
+from listings.models import Pet, SavedSearch
+from listings.saved_searches import MATCH_FIELDS, index_fields, matching_searches, normalize_params
+
+
+TYPES = ['dog', 'cat', 'bird', 'rabbit']
+BREEDS = ['Labrador', 'Siamese', 'Poodle', 'Mixed']
+CITIES = ['Baku', 'Ganja', 'Sumqayit', 'Lankaran', 'Shaki', 'Quba']
+STATUSES = ['adopting', 'selling', 'breeding']
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Benchmark matching new pets against saved searches through the shape-key index, '
+        'against running saved searches as queries. Runs inside a rolled-back transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--searches', type=int, default=100000, help='Synthetic saved searches to create.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--pets', type=int, default=200, help='New pets to match.')
+        parser.add_argument('--naive-sample', type=int, default=500, help='Saved searches to time as queries.')
+
+    def benchmark(self, **options):
+        searches = self.seed(options['searches'], options['users'], options['pets'])
+        self.run(searches, options['naive_sample'])
+
+    def random_params(self, rng):
+        params = {}
+        for name, values, chance in [
+            ('type', TYPES, 0.8), ('city', CITIES, 0.6), ('status', STATUSES, 0.3),
+            ('breed', BREEDS, 0.2), ('gender', ['male', 'female'], 0.2), ('vaccinated', [True], 0.2),
+        ]:
+            if rng.random() < chance:
+                params[name] = rng.choice(values)
+        if rng.random() < 0.5:
+            params['max_price'] = rng.choice([100, 250, 500, 1000])
+        if rng.random() < 0.3:
+            params['min_age'] = rng.choice([3, 6, 12])
+        return params or {'type': rng.choice(TYPES)}
+
+    def seed(self, count, users, pets):
+        User = get_user_model()
+        rng = random.Random(42)
+        # UUID primary keys are set client-side, so the returned objects can be used directly.
+        owners = User.objects.bulk_create([
+            User(username=f'bench-user-{i}', email=f'bench-user-{i}@example.com') for i in range(users + 1)
+        ])
+        started = time.perf_counter()
+        normalized = {}
+        batch = []
+        for i in range(count):
+            params = self.random_params(rng)
+            key = repr(sorted(params.items()))
+            if key not in normalized:
+                normalized[key] = normalize_params(params)
+            params = normalized[key]
+            batch.append(SavedSearch(user=owners[1 + i % users], params=params, **index_fields(params)))
+            if len(batch) == 5000:
+                SavedSearch.objects.bulk_create(batch)
+                batch = []
+        SavedSearch.objects.bulk_create(batch)
+        self.stdout.write(f'seeded {count} saved searches in {time.perf_counter() - started:.1f}s')
+
+        # bulk_create() skips the post_save matcher, so seeding pets does not match them.
+        Pet.objects.bulk_create([
+            Pet(
+                name=f'Pet {i}', type=rng.choice(TYPES), breed=rng.choice(BREEDS), age=rng.randint(1, 120),
+                gender=rng.choice(['male', 'female']), description='Bench pet.', status=rng.choice(STATUSES),
+                price=rng.randint(0, 2000), vaccinated=rng.random() < 0.5, city=rng.choice(CITIES), owner=owners[0],
+            )
+            for i in range(pets)
+        ])
+        return list(SavedSearch.objects.order_by('?').values_list('params', flat=True)[:1000])
+
+    def run(self, sample_params, naive_sample):
+        pets = list(Pet.objects.filter(owner__username='bench-user-0').values(*MATCH_FIELDS))
+        matching_searches(pets[0])  # warm up
+
+        timings, matches = [], 0
+        for pet in pets:
+            start = time.perf_counter()
+            matches += len(matching_searches(pet))
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'shape-key index   mean {statistics.mean(timings):7.2f} ms  p50 {timings[len(timings) // 2]:7.2f} ms  '
+            f'p95 {timings[int(len(timings) * 0.95)]:7.2f} ms  ({matches / len(pets):.1f} matches/pet)'
+        )
+
+        # The naive matcher: run each saved search as a query restricted to the new pet.
+        pet_id = pets[0]['id']
+        sample = sample_params[:naive_sample]
+        start = time.perf_counter()
+        for params in sample:
+            PetFilter(params, queryset=Pet.objects.filter(pk=pet_id)).qs.exists()
+        per_search = (time.perf_counter() - start) * 1000 / len(sample)
+        total = SavedSearch.objects.count()
+        self.stdout.write(
+            f'query per search  {per_search:7.3f} ms/search -> ~{per_search * total:,.0f} ms/pet for {total} searches'
+        )
+        self.stdout.write(self.style.SUCCESS(f'speedup: {per_search * total / statistics.mean(timings):,.0f}x'))
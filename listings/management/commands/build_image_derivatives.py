@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from listings.images import (
+    DERIVATIVE_FORMATS, DERIVATIVE_SIZES, DERIVATIVE_STORAGE, IMAGE_STORAGE, generate_derivatives,
+)
+from listings.models import Pet
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the thumb/card/full WebP and JPEG derivatives of pet images that do not have them yet '
+        '(uploads made before the pipeline existed, or after a size was added), and report the savings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--force', action='store_true', help='Rebuild derivatives that already exist.')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        pets = Pet.objects.using(using).exclude(image='').exclude(image__isnull=True).order_by('pk')
+        force = options['force']
+
+        def build(pet_id):
+            try:
+                return generate_derivatives(pet_id, using, force)
+            finally:
+                connections.close_all()
+
+        last_pk, built, failed = 0, 0, 0
+        original_bytes, derivative_bytes = 0, {(size, ext): 0 for size in DERIVATIVE_SIZES for ext in DERIVATIVE_FORMATS}
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                batch = list(pets.filter(pk__gt=last_pk).values_list('pk', 'image', 'image_derivatives')[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                todo = [pk for pk, image, derivatives in batch if force or derivatives.get('source') != image]
+                for pk, derivatives in zip(todo, executor.map(build, todo)):
+                    if not derivatives or derivatives.get('failed'):
+                        failed += 1
+                        self.stderr.write(f'Pet {pk}: could not build derivatives')
+                        continue
+                    built += 1
+                    original_bytes += IMAGE_STORAGE.size(derivatives['source'])
+                    for size, entry in derivatives['sizes'].items():
+                        for extension in DERIVATIVE_FORMATS:
+                            derivative_bytes[size, extension] += DERIVATIVE_STORAGE.size(entry[extension])
+
+        self.stdout.write(self.style.SUCCESS(f'Built derivatives for {built} pets ({failed} failed).'))
+        if built:
+            self.stdout.write(f'originals        {original_bytes / built / 1024:8.1f} KB/pet')
+            for (size, extension), total in derivative_bytes.items():
+                self.stdout.write(
+                    f'{size:<6} {extension:<5}     {total / built / 1024:8.1f} KB/pet  '
+                    f'({original_bytes / max(total, 1):.1f}x smaller)'
+                )
@@ -0,0 +1,160 @@
+import decimal
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from listings.filters import PetFilter
+from listings.models import Pet, PetSearchDocument
+from listings.pagination import PetCursorPagination
+from listings.search import get_search_backend
+
+# The filter combinations the browse pages actually send, paired with the
+# keyset ordering the paginator applies on top of them.
+CANONICAL_QUERIES = [
+    ({}, '-created_at'),
+    ({}, 'price'),
+    ({}, '-price'),
+    ({}, 'age'),
+    ({}, 'name'),
+    ({}, '-favorites_count'),
+    ({'status': 'adopting'}, '-created_at'),
+    ({'type': 'dog'}, '-created_at'),
+    ({'status': 'selling', 'type': 'cat'}, '-created_at'),
+    ({'city': 'Baku'}, '-created_at'),
+    ({'type': 'dog', 'city': 'Baku'}, '-created_at'),
+    ({'type': 'dog', 'gender': 'male'}, '-created_at'),
+    ({'type': 'cat', 'vaccinated': 'true'}, '-created_at'),
+    ({'is_urgent': 'true'}, '-created_at'),
+    ({'min_price': '100', 'max_price': '500'}, 'price'),
+    ({'min_age': '6', 'max_age': '24'}, 'age'),
+]
+
+# Free-text searches: a word the full-text index finds, and a typo only the
+# trigram indexes do. Ranked results are always sorted, so only scans count.
+SEARCH_QUERIES = ['labrador', 'labradr']
+
+# A cursor position per ordering field, for the seek (second and later) pages.
+SEEK_POSITIONS = {
+    'created_at': lambda: timezone.now(),
+    'price': lambda: decimal.Decimal('100'),
+    'age': lambda: 12,
+    'name': lambda: 'M',
+    'favorites_count': lambda: 5,
+}
+
+TABLE = Pet._meta.db_table
+SEARCH_TABLE = PetSearchDocument._meta.db_table
+# A partial index is bounded by its condition even when scanned end to end.
+PARTIAL_INDEXES = {index.name for index in Pet._meta.indexes if index.condition is not None}
+
+SQLITE_SEQ_SCAN = re.compile(r'\bSCAN %s\b(?! USING)' % TABLE)
+SQLITE_SORT = re.compile(r'\bUSE TEMP B-TREE FOR (?:\w+ )*ORDER BY\b')
+SQLITE_INDEX_SCAN = re.compile(r'\bSCAN %s USING (?:COVERING )?INDEX (\w+)' % TABLE)
+
+
+def sqlite_problems(plan, bounded):
+    problems = []
+    if SQLITE_SEQ_SCAN.search(plan):
+        problems.append('SEQ SCAN')
+    if SQLITE_SORT.search(plan):
+        problems.append('SORT')
+    # SEARCH lines always carry their index condition; SCAN ... USING INDEX reads all of it.
+    if bounded and any(name not in PARTIAL_INDEXES for name in SQLITE_INDEX_SCAN.findall(plan)):
+        problems.append('FULL INDEX SCAN')
+    return problems
+
+
+def postgresql_problems(plan, bounded):
+    problems = []
+
+    def walk(node):
+        kind = node['Node Type']
+        if kind == 'Seq Scan' and node.get('Relation Name') in (TABLE, SEARCH_TABLE):
+            problems.append('SEQ SCAN')
+        elif kind in ('Sort', 'Incremental Sort'):
+            problems.append('SORT')
+        elif (
+            bounded and kind in ('Index Scan', 'Index Only Scan') and node.get('Relation Name') == TABLE
+            and 'Index Cond' not in node and node.get('Index Name') not in PARTIAL_INDEXES
+        ):
+            problems.append('FULL INDEX SCAN')
+        for child in node.get('Plans', ()):
+            walk(child)
+
+    walk(json.loads(plan)[0]['Plan'])
+    return problems
+
+
+PLAN_CHECKS = {
+    'postgresql': (postgresql_problems, {'format': 'json'}),
+    'sqlite': (sqlite_problems, {}),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the canonical PetFilter queries, first page and keyset seek, and fail if any falls back '
+        'to a sequential scan, sorts its rows, or reads an index end to end where it should seek into it. '
+        'Free-text searches are checked for scans too.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan.')
+
+    def handle(self, *args, **options):
+        check = PLAN_CHECKS.get(connection.vendor)
+        if check is None:
+            raise CommandError(f'Index checks are not supported on {connection.vendor}.')
+        problems_in, explain_options = check
+
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Small or freshly loaded tables make the planner prefer a seq
+                # scan even when a usable index exists; we only care whether
+                # one *can* be used.
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for params, ordering in CANONICAL_QUERIES:
+                for seek in (False, True):
+                    plan = self.build_queryset(params, ordering, seek).explain(**explain_options)
+                    label = f'{params or "(no filters)"} ordering={ordering}{" seek" if seek else ""}'
+                    if options['verbose_plans']:
+                        self.stdout.write(f'{label}\n{plan}\n')
+                    # Only the unfiltered first page may read an index from its start: LIMIT stops it.
+                    problems = problems_in(plan, bounded=bool(params) or seek)
+                    if problems:
+                        failures.append(label)
+                        self.stdout.write(self.style.ERROR(f'{", ".join(problems):<15} {label}'))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(f'{"ok":<15} {label}'))
+
+            for text in SEARCH_QUERIES:
+                queryset = get_search_backend().search(Pet.objects.all(), text).order_by('-search_rank')
+                plan = queryset[:PetCursorPagination.page_size + 1].explain(**explain_options)
+                label = f'search={text!r}'
+                if options['verbose_plans']:
+                    self.stdout.write(f'{label}\n{plan}\n')
+                problems = [problem for problem in problems_in(plan, bounded=True) if problem != 'SORT']
+                if problems:
+                    failures.append(label)
+                    self.stdout.write(self.style.ERROR(f'{", ".join(problems):<15} {label}'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{"ok":<15} {label}'))
+
+        if failures:
+            raise CommandError(f'{len(failures)} canonical pet queries are not served by an index.')
+
+    def build_queryset(self, params, ordering, seek=False):
+        queryset = PetFilter(params, queryset=Pet.objects.all()).qs
+        paginator = PetCursorPagination()
+        paginator.field_name = ordering.lstrip('-')
+        paginator.descending = ordering.startswith('-')
+        queryset = queryset.order_by(*paginator.get_order_by(Pet))
+        if seek:
+            queryset = queryset.filter(paginator.get_seek_filter(Pet, SEEK_POSITIONS[paginator.field_name](), 1000))
+        return queryset[:paginator.page_size + 1]
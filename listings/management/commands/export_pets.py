@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from listings.export import EXPORT_FORMATS, UPDATED_SINCE_PARAM, export_lines, export_queryset, next_updated_since
+
+
+class Command(BaseCommand):
+    help = 'Stream pets as NDJSON or CSV, with the same filters as the export endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--output', help='File to write to (default: stdout).')
+        parser.add_argument('--updated-since', help='Only pets changed at or after this ISO 8601 datetime.')
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='NAME=VALUE',
+            help='A list filter parameter, e.g. --filter type=dog or --filter hide_duplicates=true. Repeatable.',
+        )
+
+    def handle(self, *args, **options):
+        params = QueryDict(mutable=True)
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Expected NAME=VALUE, got {item!r}.')
+            params.appendlist(name, value)
+        if options['updated_since']:
+            params[UPDATED_SINCE_PARAM] = options['updated_since']
+        started = timezone.now()
+        try:
+            queryset = export_queryset(params)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        lines = export_lines(options['export_format'], queryset)
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        rows = count - 1 if options['export_format'] == 'csv' else count
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {rows} pets to {options["output"]}. '
+            f'Next incremental export: --updated-since {next_updated_since(started).isoformat()}'
+        ))
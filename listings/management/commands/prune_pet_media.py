@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from listings.cache import invalidate_on_commit
+from listings.images import DERIVATIVE_DIR, DERIVATIVE_STORAGE, IMAGE_STORAGE, delete_derivative_files
+from listings.models import Pet
+from listings.storage import is_blob_name
+
+
+def walk(storage, directory):
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}'
+    for name in directories:
+        yield from walk(storage, f'{directory}/{name}')
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete pet images (and their derivatives) that no pet references. With --migrate-legacy, first move '
+        'images saved before content-addressed storage into blobs, so byte-identical copies collapse into one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--migrate-legacy', action='store_true')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it.')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        dry_run = options['dry_run']
+        pets = Pet.objects.using(using)
+        copied = 0
+
+        if options['migrate_legacy']:
+            legacy = sorted(
+                name for name in pets.exclude(image='').exclude(image__isnull=True)
+                .values_list('image', flat=True).distinct() if not is_blob_name(name)
+            )
+            for name in legacy:
+                if not IMAGE_STORAGE.exists(name):
+                    self.stderr.write(f'{name}: missing, left as is')
+                    continue
+                if dry_run:
+                    self.stdout.write(f'{name}: would move into a blob')
+                    continue
+                with IMAGE_STORAGE.open(name, 'rb') as file:
+                    blob = IMAGE_STORAGE.blob_name(name, file)
+                    if not IMAGE_STORAGE.exists(blob):
+                        copied += IMAGE_STORAGE.size(name)
+                    blob = IMAGE_STORAGE.save(name, file)
+                with transaction.atomic(using=using):
+                    # Derivatives are keyed by the blob now; build_image_derivatives rebuilds them.
+                    # Same bytes under a new name: not an edit, so updated_at (the If-Match version) stays.
+                    pets.filter(image=name).update(image=blob, image_derivatives={})
+                    invalidate_on_commit(using)
+                self.stdout.write(f'{name} -> {blob}')
+
+        referenced = set(pets.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True).distinct())
+        freed, deleted = 0, 0
+        for name in walk(IMAGE_STORAGE, Pet._meta.get_field('image').upload_to.rstrip('/')):
+            if name.startswith(DERIVATIVE_DIR + '/') or name in referenced:
+                continue
+            if is_blob_name(name) and IMAGE_STORAGE.is_fresh(name):
+                continue
+            freed += IMAGE_STORAGE.size(name)
+            deleted += 1
+            self.stdout.write(f'{name}: unreferenced')
+            if not dry_run:
+                IMAGE_STORAGE.delete(name)
+                delete_derivative_files(name)
+
+        # Derivatives whose source went some other way (or was moved into a blob above).
+        sources = {name.rsplit('/', 1)[-1] for name in referenced}
+        if DERIVATIVE_STORAGE.exists(DERIVATIVE_DIR):
+            for directory in DERIVATIVE_STORAGE.listdir(DERIVATIVE_DIR)[0]:
+                if directory in sources:
+                    continue
+                for name in walk(DERIVATIVE_STORAGE, f'{DERIVATIVE_DIR}/{directory}'):
+                    freed += DERIVATIVE_STORAGE.size(name)
+                    deleted += 1
+                    if not dry_run:
+                        DERIVATIVE_STORAGE.delete(name)
+
+        verb = 'Would free' if dry_run else 'Freed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {(freed - copied) / 1024:.1f} KB net: deleted {deleted} files, copied {copied / 1024:.1f} KB into blobs.'
+        ))
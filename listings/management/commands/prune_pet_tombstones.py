@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from listings.changes import tombstone_retention
+from listings.models import PetTombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete changes-feed tombstones older than LISTINGS_TOMBSTONE_RETENTION_DAYS, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        # Cursors this old are already refused with 410, so nothing can still need these rows.
+        cutoff = timezone.now() - tombstone_retention()
+        tombstones = PetTombstone.objects.using(options['database'])
+        deleted = 0
+        while True:
+            batch = list(tombstones.filter(deleted_at__lt=cutoff).order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += tombstones.filter(id__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} tombstones older than {cutoff:%Y-%m-%d %H:%M}.'))
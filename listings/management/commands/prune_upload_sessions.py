@@ -0,0 +1,35 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from listings.models import UploadSession
+from listings.uploads import abort_upload, upload_dir, upload_expiry
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable upload sessions older than LISTINGS_UPLOAD_EXPIRY_HOURS, and their part files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - upload_expiry()
+        sessions = UploadSession.objects.using(options['database']).filter(created_at__lt=cutoff)
+        deleted = 0
+        for session in sessions.iterator():
+            abort_upload(session)
+            deleted += 1
+
+        # Part files left behind by a crash between the row and the file going.
+        known = {str(pk) for pk in UploadSession.objects.using(options['database']).values_list('pk', flat=True)}
+        orphans = 0
+        if os.path.isdir(upload_dir()):
+            for entry in os.scandir(upload_dir()):
+                pk = entry.name.removesuffix('.part')
+                if pk not in known and entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+                    orphans += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} upload sessions older than {cutoff:%Y-%m-%d %H:%M} and {orphans} orphaned part files.'
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from listings.models import Pet
+from listings.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents for every pet, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        batch_size = options['batch_size']
+        pets = Pet.objects.using(options['database']).order_by('pk').values_list('pk', flat=True)
+
+        last_pk, indexed = 0, 0
+        while True:
+            batch = list(pets.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            backend.index(batch)
+            last_pk = batch[-1]
+            indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} pets with {type(backend).__name__}.'))
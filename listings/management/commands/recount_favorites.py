@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from listings.cache import invalidate_on_commit
+from listings.favorites import favorites_count_subquery
+from listings.models import Pet
+
+
+class Command(BaseCommand):
+    help = 'Recount Pet.favorites_count from the Favorite table in batches and repair any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted pets without fixing them.')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        batch_size = options['batch_size']
+        pets = Pet.objects.using(using).order_by('pk')
+
+        last_pk, checked, drifted = 0, 0, 0
+        while True:
+            batch = list(pets.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic(using=using):
+                # Only rows whose counter disagrees with the table are rewritten.
+                stale = list(
+                    pets.filter(pk__in=batch).annotate(actual=favorites_count_subquery())
+                    .exclude(favorites_count=F('actual')).values_list('pk', 'favorites_count', 'actual')
+                )
+                for pk, stored, actual in stale:
+                    self.stdout.write(f'Pet {pk}: favorites_count {stored} -> {actual}')
+                if stale and not options['dry_run']:
+                    pets.filter(pk__in=[pk for pk, _, _ in stale]).update(favorites_count=favorites_count_subquery())
+                    invalidate_on_commit(using)
+            last_pk = batch[-1]
+            checked += len(batch)
+            drifted += len(stale)
+
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} pets. {verb} {drifted} drifted counters.'))
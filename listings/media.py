@@ -0,0 +1,175 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from .images import IMAGE_STORAGE, delete_derivative_files
+from .models import Pet
+from .storage import is_blob_name
+
+# Only these MEDIA_ROOT directories are served.
+MEDIA_DIRECTORIES = ('pets/',)
+# Blob names change with their content, so a cached copy never goes stale.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Legacy names and derivatives can be rewritten in place; revalidate with the ETag.
+MEDIA_CACHE_CONTROL = 'public, max-age=3600'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def release_blobs(names, using='default'):
+    """
+    Delete the image files among `names` that no Pet references any more,
+    with their derivatives, and return them. Files still in their grace
+    period (see listings/storage.py) are left to prune_pet_media.
+    """
+    names = {name for name in names if name}
+    if not names:
+        return []
+    referenced = set(Pet.objects.using(using).filter(image__in=names).values_list('image', flat=True))
+    released = []
+    for name in sorted(names - referenced):
+        if IMAGE_STORAGE.is_fresh(name):
+            continue
+        IMAGE_STORAGE.delete(name)
+        delete_derivative_files(name)
+        released.append(name)
+    return released
+
+
+def release_on_commit(names, using='default'):
+    names = [name for name in names if name]
+    if names:
+        transaction.on_commit(lambda: release_blobs(names, using), using=using, robust=True)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def media_path(name):
+    """Filesystem path of a servable media file, or None: only existing, non-hidden files under MEDIA_DIRECTORIES."""
+    parts = name.split('/')
+    if any(not part or part.startswith('.') for part in parts) or not name.startswith(MEDIA_DIRECTORIES):
+        return None
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def media_etag(name, stat):
+    if is_blob_name(name):
+        # The name is the content hash.
+        return '"%s"' % posixpath.splitext(posixpath.basename(name))[0]
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Inclusive (start, end) of a single `bytes=` range, or None to send the
+    whole file (no header, a syntax error or several ranges). Raises
+    RangeNotSatisfiable when no byte of the range exists.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if not length or not size:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def range_applies(request, etag, last_modified):
+    """If-Range: the range is only served if the client's copy is still current."""
+    condition = request.META.get('HTTP_IF_RANGE')
+    if not condition:
+        return True
+    if condition.startswith(('"', 'W/')):
+        return condition == etag
+    return parse_http_date_safe(condition) == last_modified
+
+
+def file_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def media_response(request, name):
+    """
+    Answer a request for a media file. The name is validated against
+    MEDIA_DIRECTORIES (no hidden files, no escaping MEDIA_ROOT) and
+    conditional requests are resolved here; there is no per-user permission
+    check, every served image is public. The transfer is then handed to the
+    front proxy (LISTINGS_MEDIA_SENDFILE), or streamed with Range support.
+    """
+    path = media_path(name)
+    if path is None:
+        raise Http404('No such media file')
+    stat = os.stat(path)
+    etag, last_modified = media_etag(name, stat), int(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_blob_name(name) else MEDIA_CACHE_CONTROL,
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        sendfile = getattr(settings, 'LISTINGS_MEDIA_SENDFILE', None)
+        if sendfile == 'nginx':
+            # nginx serves the bytes (and any Range) from its internal location.
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = quote(getattr(settings, 'LISTINGS_MEDIA_ACCEL_PREFIX', '/protected-media/') + name)
+        elif sendfile == 'sendfile':
+            # Apache mod_xsendfile, lighttpd.
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        else:
+            response = range_response(request, path, stat.st_size, content_type, etag, last_modified)
+        headers['Accept-Ranges'] = 'bytes'
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def range_response(request, path, size, content_type, etag, last_modified):
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None or not range_applies(request, etag, last_modified):
+        # wsgi.file_wrapper lets the server use sendfile(2) for the whole file.
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+    start, end = byte_range
+    response = StreamingHttpResponse(file_range(path, start, end - start + 1), status=206, content_type=content_type)
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
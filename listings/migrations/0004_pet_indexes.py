@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0003_contactmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['-created_at', '-id'], name='pet_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['status', 'type', '-created_at', '-id'], name='pet_status_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['type', '-created_at', '-id'], name='pet_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['city', '-created_at', '-id'], name='pet_city_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['price', 'id'], name='pet_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['age', 'id'], name='pet_age_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['name', 'id'], name='pet_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(condition=models.Q(('is_urgent', True)), fields=['-created_at', '-id'], name='pet_urgent_created_idx'),
+        ),
+    ]
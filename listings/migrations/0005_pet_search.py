@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:39
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Weighted document: name (A) > breed (B) > city (C) > description (D).
+POSTGRES_WEIGHTS = [('name', 'A'), ('breed', 'B'), ('city', 'C'), ('description', 'D')]
+POSTGRES_DOCUMENT = " || ".join(
+    f"setweight(to_tsvector(%s::regconfig, coalesce({field}, '')), '{weight}')"
+    for field, weight in POSTGRES_WEIGHTS
+)
+
+
+def create_search_structures(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS pet_search_document_gin '
+            'ON listings_petsearchdocument USING gin (document)'
+        )
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS pet_name_trgm ON listings_pet USING gin (name gin_trgm_ops)')
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS pet_breed_trgm ON listings_pet USING gin (breed gin_trgm_ops)')
+        # The same text search configuration PostgresSearchBackend indexes and queries with.
+        config = getattr(settings, 'LISTINGS_SEARCH_CONFIG', 'simple')
+        schema_editor.execute(
+            f'INSERT INTO listings_petsearchdocument (pet_id, document) '
+            f'SELECT id, {POSTGRES_DOCUMENT} FROM listings_pet',
+            [config] * len(POSTGRES_WEIGHTS),
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS listings_pet_fts USING fts5('
+            "name, breed, city, description, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            'INSERT INTO listings_pet_fts (rowid, name, breed, city, description) '
+            'SELECT id, name, breed, city, description FROM listings_pet'
+        )
+
+
+def drop_search_structures(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS pet_breed_trgm')
+        schema_editor.execute('DROP INDEX IF EXISTS pet_name_trgm')
+        schema_editor.execute('DROP INDEX IF EXISTS pet_search_document_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS listings_pet_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_pet_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PetSearchDocument',
+            fields=[
+                ('pet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='listings.pet')),
+                ('document', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_structures, drop_search_structures),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_favorites_count(apps, schema_editor):
+    Pet = apps.get_model('listings', 'Pet')
+    Favorite = apps.get_model('listings', 'Favorite')
+    counts = (
+        Favorite.objects.filter(pet=OuterRef('pk')).order_by()
+        .values('pet').annotate(count=Count('id')).values('count')
+    )
+    Pet.objects.using(schema_editor.connection.alias).update(
+        favorites_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_pet_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['favorites_count', 'id'], name='pet_popularity_idx'),
+        ),
+        migrations.RunPython(backfill_favorites_count, migrations.RunPython.noop),
+    ]
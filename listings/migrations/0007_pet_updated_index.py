@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_pet_favorites_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['updated_at', 'id'], name='pet_updated_idx'),
+        ),
+    ]
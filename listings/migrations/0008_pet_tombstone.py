@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_pet_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PetTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pet_id', models.PositiveIntegerField()),
+                ('deleted_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_pet_tombstone'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedSearch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('params', models.JSONField()),
+                ('shape_key', models.BigIntegerField(db_index=True)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('min_age', models.PositiveIntegerField(null=True)),
+                ('max_age', models.PositiveIntegerField(null=True)),
+                ('breed_contains', models.CharField(blank=True, max_length=100)),
+                ('city_contains', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saved_searches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('pet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_notifications', to='listings.pet')),
+                ('saved_search', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='listings.savedsearch')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-id'], name='notification_user_idx')],
+                'unique_together': {('saved_search', 'pet')},
+            },
+        ),
+    ]
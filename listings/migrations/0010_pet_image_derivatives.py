@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_saved_searches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:16
+
+import listings.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0010_pet_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pet',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=listings.storage.get_pet_image_storage, upload_to='pets/'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0012_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PetFingerprint',
+            fields=[
+                ('pet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fingerprint', serialize=False, to='listings.pet')),
+                ('image_hash', models.BigIntegerField(null=True)),
+                ('text_signature', models.BinaryField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PetDuplicate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('same_owner', models.BooleanField()),
+                ('image_distance', models.PositiveSmallIntegerField(null=True)),
+                ('text_similarity', models.FloatField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('original', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicates', to='listings.pet')),
+                ('pet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_of', to='listings.pet')),
+            ],
+            options={
+                'unique_together': {('pet', 'original')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PetFingerprintBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('pet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint_buckets', to='listings.pet')),
+            ],
+            options={
+                'unique_together': {('key', 'pet')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0013_pet_duplicates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='pet_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0014_pet_status_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pettombstone',
+            name='pet_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
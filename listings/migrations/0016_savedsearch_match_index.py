@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0015_pet_tombstone_big_pet_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='savedsearch',
+            name='shape_key',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='savedsearch',
+            index=models.Index(fields=['shape_key', 'min_price', 'max_price', 'min_age', 'max_age', 'user', 'breed_contains', 'city_contains'], name='savedsearch_match_idx'),
+        ),
+    ]
@@ -1,5 +1,11 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
+
+from .storage import get_pet_image_storage
 User = get_user_model()
 
 class Pet(models.Model):
@@ -47,13 +53,122 @@ class Pet(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     # Images
-    image = models.ImageField(upload_to='pets/', null=True, blank=True)
+    # Content-addressed: pets posting the same photo share one file (see listings/storage.py).
+    image = models.ImageField(upload_to='pets/', storage=get_pet_image_storage, null=True, blank=True)
+    # Resized WebP/JPEG copies of `image`, built off the request thread by
+    # listings.images: {'source': <image name>, 'sizes': {size: {...}},
+    # 'dhash': <perceptual hash, hex>}. Reset to {} whenever the image changes.
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Popularity: a denormalized COUNT of Favorite rows, kept in step by the
+    # Favorite signals with F() updates. `manage.py recount_favorites` repairs drift.
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Maintained by atomic F() updates only; see save().
+    COUNTER_FIELDS = ('favorites_count',)
 
     def __str__(self):
         return f"{self.name} - {self.breed} ({self.type})"
 
+    def save(self, *args, **kwargs):
+        # A full save would write back the counter as it was when this
+        # instance was loaded, undoing every favorite made since.
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['-created_at']
+        # Shaped after PetFilter / filterset_fields combined with the keyset
+        # ordering in pagination.py; `manage.py check_pet_indexes` verifies them.
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='pet_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='pet_status_created_idx'),
+            models.Index(fields=['status', 'type', '-created_at', '-id'], name='pet_status_type_created_idx'),
+            models.Index(fields=['type', '-created_at', '-id'], name='pet_type_created_idx'),
+            models.Index(fields=['city', '-created_at', '-id'], name='pet_city_created_idx'),
+            models.Index(fields=['price', 'id'], name='pet_price_idx'),
+            models.Index(fields=['age', 'id'], name='pet_age_idx'),
+            models.Index(fields=['name', 'id'], name='pet_name_idx'),
+            models.Index(fields=['favorites_count', 'id'], name='pet_popularity_idx'),
+            models.Index(fields=['updated_at', 'id'], name='pet_updated_idx'),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_urgent=True),
+                name='pet_urgent_created_idx',
+            ),
+        ]
+
+class PetSearchDocument(models.Model):
+    """
+    Weighted full-text document for a Pet (name > breed > city > description).
+
+    Kept out of the Pet row so the tsvector never shows up in serializers.
+    Only used on PostgreSQL; SQLite keeps its documents in an FTS5 table.
+    See listings/search.py.
+    """
+    pet = models.OneToOneField(Pet, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    document = SearchVectorField(null=True)
+
+    def __str__(self):
+        return f"Search document for pet {self.pet_id}"
+
+class PetTombstone(models.Model):
+    """
+    A deleted pet, kept so the changes feed can tell clients to drop it.
+    Written by the Pet post_delete signal and by bulk deletes; ids only grow,
+    so the feed pages through tombstones by id.
+    """
+    # Pet ids are BigAutoField values.
+    pet_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Pet {self.pet_id} deleted at {self.deleted_at}"
+
+class PetFingerprint(models.Model):
+    """
+    What duplicate detection compares: a 64-bit dHash of the pet's image and
+    a MinHash signature of its description (either may be missing). The
+    buckets they fall into are PetFingerprintBucket rows. See listings/duplicates.py.
+    """
+    pet = models.OneToOneField(Pet, on_delete=models.CASCADE, primary_key=True, related_name='fingerprint')
+    image_hash = models.BigIntegerField(null=True)
+    text_signature = models.BinaryField(null=True)
+
+    def __str__(self):
+        return f"Fingerprint for pet {self.pet_id}"
+
+class PetFingerprintBucket(models.Model):
+    """An LSH band or dHash segment a pet falls into; pets sharing a key are duplicate candidates."""
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='fingerprint_buckets')
+    key = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('key', 'pet')
+
+    def __str__(self):
+        return f"Pet {self.pet_id} in bucket {self.key}"
+
+class PetDuplicate(models.Model):
+    """`pet` looks like a re-post of the older listing `original`."""
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='duplicate_of')
+    original = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='duplicates')
+    same_owner = models.BooleanField()
+    # Whichever signals both listings have: differing dHash bits, estimated Jaccard similarity.
+    image_distance = models.PositiveSmallIntegerField(null=True)
+    text_similarity = models.FloatField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('pet', 'original')
+
+    def __str__(self):
+        return f"{self.pet_id} duplicates {self.original_id}"
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="favorites")
@@ -65,6 +180,76 @@ class Favorite(models.Model):
     def __str__(self):
         return f"{self.user.username} ❤️ {self.pet.name}"
     
+class SavedSearch(models.Model):
+    """
+    A user's saved PetFilter query. The equality filters are hashed into
+    `shape_key` and the ranges and substrings are copied into columns, so new
+    pets are matched with an index lookup instead of running every search.
+    See listings/saved_searches.py.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_searches')
+    name = models.CharField(max_length=100, blank=True)
+    params = models.JSONField()
+    shape_key = models.BigIntegerField()
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    min_age = models.PositiveIntegerField(null=True)
+    max_age = models.PositiveIntegerField(null=True)
+    breed_contains = models.CharField(max_length=100, blank=True)
+    city_contains = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Everything matching_searches() reads, so candidates outside the
+            # ranges are rejected from the index alone.
+            models.Index(
+                fields=[
+                    'shape_key', 'min_price', 'max_price', 'min_age', 'max_age',
+                    'user', 'breed_contains', 'city_contains',
+                ],
+                name='savedsearch_match_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.name or self.params}"
+
+class SearchNotification(models.Model):
+    """A new or updated pet that satisfied one of the user's saved searches."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_notifications')
+    saved_search = models.ForeignKey(SavedSearch, on_delete=models.CASCADE, related_name='notifications')
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='search_notifications')
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('saved_search', 'pet')
+        indexes = [
+            models.Index(fields=['user', '-id'], name='notification_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.pet} matched {self.saved_search}"
+
+class UploadSession(models.Model):
+    """
+    A resumable image upload: the client PUTs chunks at `offset` until it
+    reaches `size`, then finalizes it onto one of its pets. The bytes live in
+    a part file on disk (see listings/uploads.py), never in this row.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
 class ContactMessage(models.Model):
     full_name = models.CharField(max_length=200)
     email = models.EmailField()
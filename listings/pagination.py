@@ -0,0 +1,236 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (ordering field, pk).
+
+    Each page is a `WHERE (field, pk) > (last value, last pk)` seek against the
+    ordering index, so page 1000 costs the same as page one: no OFFSET scan and
+    no COUNT(*). The ordering comes from the queryset (i.e. OrderingFilter) when
+    it is one of `ordering_fields`, otherwise `ordering` is used; annotations such
+    as the search backend's `search_rank` work the same way. The pk breaks
+    ties so rows sharing a price or a name are never skipped or repeated.
+    NULLs sort as the largest value, matching PostgreSQL's default.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = '-created_at'
+    ordering_fields = ()
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.next_position = None
+
+        model = queryset.model
+        self.field_name, self.descending = self.get_ordering(queryset)
+        ordered = queryset.order_by(*self.get_order_by(model))
+
+        position = self.decode_cursor(request)
+        tail = None
+        if position is not None:
+            position = self.clean_position(model, *position)
+            queryset = ordered.filter(self.get_seek_filter(model, *position))
+            tail = self.get_seek_tail(model, position[0])
+        else:
+            queryset = ordered
+
+        results = list(queryset[:self.page_size + 1])
+        if tail is not None and len(results) <= self.page_size:
+            # The seek ran out of its run of NULL / non-NULL values: carry on with the other one.
+            results += list(ordered.filter(tail)[:self.page_size + 1 - len(results)])
+        if len(results) > self.page_size:
+            results = results[:self.page_size]
+            last = results[-1]
+            self.next_position = (self._row_value(last, self.field_name), self._row_value(last, 'pk'))
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """Return (field name, descending) for the single keyset ordering column."""
+        ordering = [term for term in queryset.query.order_by if isinstance(term, str)]
+        term = ordering[0] if ordering else self.ordering
+        name = term.lstrip('-')
+        if name not in self.ordering_fields and name not in ('pk', 'id'):
+            term = self.ordering
+            name = term.lstrip('-')
+        if name == 'id':
+            name = 'pk'
+        return name, term.startswith('-')
+
+    def get_order_by(self, model):
+        if self.field_name == 'pk':
+            return [F('pk').desc() if self.descending else F('pk').asc()]
+        if self._nullable(model):
+            column = F(self.field_name).desc(nulls_first=True) if self.descending else F(self.field_name).asc(nulls_last=True)
+        else:
+            column = F(self.field_name).desc() if self.descending else F(self.field_name).asc()
+        return [column, F('pk').desc() if self.descending else F('pk').asc()]
+
+    def get_seek_filter(self, model, value, pk):
+        """
+        Rows strictly after (value, pk) in the current ordering, up to the end
+        of the run of NULL or non-NULL values (value, pk) is in; see get_seek_tail().
+
+        The leading `field <= value` (`>=` ascending) term is redundant with the
+        OR after it, but it is the one the planner can turn into an index range
+        start; without it a deep page walks the index from its first entry.
+        """
+        after = 'lt' if self.descending else 'gt'
+        tie = Q(**{'pk__' + after: pk})
+        if self.field_name == 'pk':
+            return tie
+
+        field = self.field_name
+        if value is None:
+            return Q(**{field + '__isnull': True}) & tie
+        bound = 'lte' if self.descending else 'gte'
+        return Q(**{field + '__' + bound: value}) & (Q(**{field + '__' + after: value}) | Q(**{field: value}) & tie)
+
+    def get_seek_tail(self, model, value):
+        """
+        The rows that sort after every row get_seek_filter() reaches, or None.
+        NULLs come first descending and last ascending; ORing them onto the
+        seek would cost it its index range, so they are a second seek made
+        only on the page where the first one runs out.
+        """
+        if not self._nullable(model):
+            return None
+        if value is None:
+            return Q(**{self.field_name + '__isnull': False}) if self.descending else None
+        return None if self.descending else Q(**{self.field_name + '__isnull': True})
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(*self.next_position))
+
+    def get_first_link(self):
+        return remove_query_param(self.base_url, self.cursor_query_param)
+
+    def encode_cursor(self, value, pk):
+        payload = {'o': self._ordering_term(), 'v': self._dump(value), 'pk': pk}
+        raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            payload = json.loads(raw.decode('utf-8'))
+            if payload['o'] != self._ordering_term():
+                raise ValueError('cursor ordering does not match the request')
+            pk = payload['pk']
+            value = payload['v']
+        except (TypeError, KeyError, ValueError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def clean_position(self, model, value, pk):
+        """
+        Coerce a decoded cursor position to the ordering field's type. A
+        tampered value would otherwise only fail inside the query, as a 500.
+        """
+        try:
+            pk = model._meta.pk.to_python(pk)
+            if value is not None:
+                try:
+                    field = model._meta.pk if self.field_name == 'pk' else model._meta.get_field(self.field_name)
+                except FieldDoesNotExist:
+                    # An annotation such as search_rank: always a number.
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        raise ValueError('cursor value is not a number')
+                else:
+                    value = field.to_python(value)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if pk is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def _ordering_term(self):
+        return ('-' if self.descending else '') + self.field_name
+
+    def _nullable(self, model):
+        if self.field_name == 'pk':
+            return False
+        try:
+            return model._meta.get_field(self.field_name).null
+        except FieldDoesNotExist:
+            return False
+
+    @staticmethod
+    def _row_value(row, name):
+        if isinstance(row, dict):
+            if name == 'pk':
+                return row['pk'] if 'pk' in row else row['id']
+            return row[name]
+        return getattr(row, name)
+
+    @staticmethod
+    def _dump(value):
+        # Cursor values go back into a filter, where the ORM coerces strings.
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        return value
+
+
+class PetCursorPagination(KeysetPagination):
+    ordering = '-created_at'
+    ordering_fields = ('created_at', 'price', 'age', 'name', 'favorites_count', 'search_rank')
+
+
+class FavoriteCursorPagination(KeysetPagination):
+    ordering = '-id'
+
+
+class NotificationCursorPagination(KeysetPagination):
+    ordering = '-id'
+
+
+class DuplicateCursorPagination(KeysetPagination):
+    ordering = '-id'
@@ -0,0 +1,148 @@
+import hashlib
+import math
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import CharField, F, Q, Value
+from django.db.models.functions import StrIndex
+from django.db.models.lookups import GreaterThan
+from rest_framework.exceptions import ValidationError
+
+from .filters import PetFilter
+from .models import Pet, SavedSearch, SearchNotification
+
+MAX_SAVED_SEARCHES_PER_USER = 100
+
+# Filters that pin a field to one value. Their (field, value) pairs make up a
+# saved search's shape; a pet can only match searches whose shape is one of
+# the 2**7 subsets of its own pairs, which is what the index lookup enumerates.
+EQUALITY_FIELDS = ('type', 'status', 'gender', 'city', 'breed', 'vaccinated', 'is_urgent')
+RANGE_FILTERS = {
+    'min_price': ('price', 'gte'),
+    'max_price': ('price', 'lte'),
+    'min_age': ('age', 'gte'),
+    'max_age': ('age', 'lte'),
+}
+CONTAINS_FILTERS = {
+    'breed__icontains': ('breed', 'breed_contains'),
+    'city__icontains': ('city', 'city_contains'),
+}
+# The list views' filterset_fields spell the ranges differently.
+PARAM_ALIASES = {
+    'price__gte': 'min_price',
+    'price__lte': 'max_price',
+    'age__gte': 'min_age',
+    'age__lte': 'max_age',
+}
+MATCH_FIELDS = ('id', 'owner_id', 'price', 'age') + EQUALITY_FIELDS
+
+# Every subset of the equality fields, largest first.
+SHAPES = [shape for size in range(len(EQUALITY_FIELDS), -1, -1) for shape in combinations(EQUALITY_FIELDS, size)]
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def shape_key(pairs):
+    """Signed 64-bit hash of sorted (field, value) pairs."""
+    source = '&'.join(f'{field}={_value(value)}' for field, value in sorted(pairs))
+    return int.from_bytes(hashlib.sha1(source.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+def normalize_params(params):
+    """
+    Validate saved-search params with PetFilter and return the ones that
+    constrain anything, as JSON-friendly values. Unknown parameters are a 400.
+    """
+    if not isinstance(params, dict):
+        raise ValidationError('Expected an object of filter parameters.')
+    data = {PARAM_ALIASES.get(name, name): value for name, value in params.items()}
+    unknown = sorted(set(data) - set(PetFilter.base_filters))
+    if unknown:
+        raise ValidationError(f"Unknown filter(s): {', '.join(unknown)}.")
+    filterset = PetFilter({name: _value(value) for name, value in data.items()}, queryset=Pet.objects.none())
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    cleaned = {}
+    for name, value in filterset.form.cleaned_data.items():
+        if value is None or value == '':
+            continue
+        cleaned[name] = str(value) if name in RANGE_FILTERS else value
+    if not cleaned:
+        raise ValidationError('A saved search needs at least one filter.')
+    return cleaned
+
+
+def index_fields(params):
+    """The SavedSearch columns the matcher reads, derived from normalized params."""
+    fields = {'shape_key': shape_key((name, params[name]) for name in EQUALITY_FIELDS if name in params)}
+    for name in RANGE_FILTERS:
+        fields[name] = params.get(name)
+    # Ages are whole months, so `age >= 6.5` is `age >= 7`.
+    if fields['min_age'] is not None:
+        fields['min_age'] = math.ceil(float(fields['min_age']))
+    if fields['max_age'] is not None:
+        fields['max_age'] = math.floor(float(fields['max_age']))
+    for name, (_, column) in CONTAINS_FILTERS.items():
+        fields[column] = params.get(name, '').lower()
+    return fields
+
+
+def _range_filter(pet):
+    condition = Q()
+    for name, (field, lookup) in RANGE_FILTERS.items():
+        value = pet[field]
+        if value is None:
+            condition &= Q(**{name + '__isnull': True})
+        else:
+            # A search's minimum must be <= the pet's value, its maximum >=.
+            bound = 'lte' if lookup == 'gte' else 'gte'
+            condition &= Q(**{name + '__isnull': True}) | Q(**{f'{name}__{bound}': value})
+    return condition
+
+
+def _contains_filter(pet):
+    condition = Q()
+    for name, (field, column) in CONTAINS_FILTERS.items():
+        # The pet's value is the haystack and the column the needle, so the
+        # position is computed per candidate in SQL.
+        haystack = Value((pet[field] or '').lower(), output_field=CharField())
+        condition &= Q(**{column: ''}) | Q(GreaterThan(StrIndex(haystack, F(column)), 0))
+    return condition
+
+
+def matching_searches(pet, using='default'):
+    """
+    (id, user_id) of the saved searches (of other users) that `pet`
+    satisfies, from one `shape_key IN (...)` lookup with the ranges and
+    substrings checked in the same query. The match index covers every
+    column it reads, so rejected candidates never touch the table.
+    """
+    keys = [shape_key((field, pet[field]) for field in shape) for shape in SHAPES]
+    return list(
+        SavedSearch.objects.using(using)
+        .filter(shape_key__in=keys).filter(_range_filter(pet)).filter(_contains_filter(pet))
+        .exclude(user_id=pet['owner_id'])
+        .order_by().values_list('id', 'user_id')
+    )
+
+
+def match_pets(pet_ids, using='default'):
+    """Record a notification for every saved search each pet now satisfies."""
+    notifications = []
+    for pet in Pet.objects.using(using).filter(id__in=pet_ids).values(*MATCH_FIELDS):
+        notifications += [
+            SearchNotification(user_id=user_id, saved_search_id=search_id, pet_id=pet['id'])
+            for search_id, user_id in matching_searches(pet, using)
+        ]
+    # A pet that already matched a search (e.g. before an edit) is not notified twice.
+    SearchNotification.objects.using(using).bulk_create(notifications, ignore_conflicts=True)
+    return notifications
+
+
+def match_on_commit(pet_ids, using='default'):
+    pet_ids = list(pet_ids)
+    transaction.on_commit(lambda: match_pets(pet_ids, using), using=using)
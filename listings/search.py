@@ -0,0 +1,176 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from rest_framework import filters
+
+from .models import Pet, PetSearchDocument
+
+PET_TABLE = Pet._meta.db_table
+FTS_TABLE = PET_TABLE + '_fts'
+
+# Field -> weight. PostgreSQL uses the letters, SQLite's bm25() the numbers.
+SEARCH_WEIGHTS = [
+    ('name', 'A', 10.0),
+    ('breed', 'B', 5.0),
+    ('city', 'C', 2.0),
+    ('description', 'D', 1.0),
+]
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(text):
+    return WORD_RE.findall(text or '')
+
+
+class PostgresSearchBackend:
+    """GIN-indexed tsvector documents plus pg_trgm similarity for typos."""
+    trigram_threshold = 0.3
+
+    def __init__(self, using):
+        self.using = using
+        self.config = getattr(settings, 'LISTINGS_SEARCH_CONFIG', 'simple')
+
+    def search(self, queryset, text):
+        query = SearchQuery(text, config=self.config, search_type='websearch')
+        name_similarity = TrigramWordSimilarity(text, 'name')
+        breed_similarity = TrigramWordSimilarity(text, 'breed')
+        # Each arm is read from its own GIN index; OR-ing the joined document
+        # match with the trigram predicates in one WHERE leaves only a scan.
+        matches = (
+            PetSearchDocument.objects.using(self.using).filter(document=query).values('pet_id')
+            .union(
+                Pet.objects.using(self.using)
+                .filter(Q(name__trigram_word_similar=text) | Q(breed__trigram_word_similar=text))
+                .order_by().values('id'),
+            )
+        )
+        return queryset.annotate(
+            search_rank=Greatest(
+                SearchRank(F('search_document__document'), query),
+                name_similarity,
+                breed_similarity * 0.5,
+                output_field=FloatField(),
+            ),
+        ).filter(pk__in=matches)
+
+    def index(self, pks):
+        if not pks:
+            return
+        vector = ' || '.join(
+            f"setweight(to_tsvector(%s::regconfig, coalesce({field}, '')), '{weight}')"
+            for field, weight, _ in SEARCH_WEIGHTS
+        )
+        sql = (
+            f'INSERT INTO {PetSearchDocument._meta.db_table} (pet_id, document) '
+            f'SELECT id, {vector} FROM {PET_TABLE} WHERE id = ANY(%s) '
+            f'ON CONFLICT (pet_id) DO UPDATE SET document = EXCLUDED.document'
+        )
+        params = [self.config] * len(SEARCH_WEIGHTS) + [list(pks)]
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def remove(self, pks):
+        # on_delete=CASCADE is applied by Django's delete collector, not by the
+        # database, so raw deletes would leave the document behind.
+        if pks:
+            PetSearchDocument.objects.using(self.using).filter(pet_id__in=pks).delete()
+
+
+class SQLiteSearchBackend:
+    """FTS5 fallback so tests and local benchmarks run without PostgreSQL."""
+
+    def __init__(self, using):
+        self.using = using
+
+    def search(self, queryset, text):
+        terms = search_terms(text)
+        if not terms:
+            # Still annotated: PetSearchFilter orders by search_rank.
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+        # Quote every term so user input is never parsed as FTS5 syntax, and
+        # prefix-match it so partially typed words still find results.
+        match = ' '.join('"%s"*' % term.replace('"', '""') for term in terms)
+        weights = ', '.join(str(weight) for _, _, weight in SEARCH_WEIGHTS)
+        return queryset.annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {PET_TABLE}.id',
+                (match,),
+                output_field=FloatField(),
+            ),
+        ).filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,)))
+
+    def index(self, pks):
+        if not pks:
+            return
+        columns = ', '.join(field for field, _, _ in SEARCH_WEIGHTS)
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', list(pks))
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, {columns}) '
+                f'SELECT id, {columns} FROM {PET_TABLE} WHERE id IN ({placeholders})',
+                list(pks),
+            )
+
+    def remove(self, pks):
+        if not pks:
+            return
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', list(pks))
+
+
+class LikeSearchBackend:
+    """Unindexed icontains search, kept for databases without a full-text engine."""
+
+    def __init__(self, using):
+        self.using = using
+
+    def search(self, queryset, text):
+        for term in search_terms(text):
+            condition = Q()
+            for field, _, _ in SEARCH_WEIGHTS:
+                condition |= Q(**{field + '__icontains': term})
+            queryset = queryset.filter(condition)
+        # Unranked, but PetSearchFilter orders by search_rank all the same.
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    def index(self, pks):
+        pass
+
+    def remove(self, pks):
+        pass
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    vendor = connections[using].vendor
+    return SEARCH_BACKENDS.get(vendor, LikeSearchBackend)(using)
+
+
+class PetSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter that queries the search backend and
+    ranks results by relevance unless the client asked for an explicit ordering.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '').strip()
+        if not text:
+            return queryset
+        queryset = get_search_backend(queryset.db).search(queryset, text)
+        if not request.query_params.get(filters.OrderingFilter.ordering_param):
+            queryset = queryset.order_by('-search_rank')
+        return queryset
@@ -1,23 +1,130 @@
 from rest_framework import serializers
-from .models import Pet,Favorite
+from .models import Pet,Favorite,SavedSearch,SearchNotification,UploadSession,PetDuplicate
 from .models import ContactMessage
+from .images import derivative_urls
+from .saved_searches import index_fields, normalize_params
 
-class PetSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """Accepts a `fieldset` kwarg (see listings/fieldsets.py) and drops every other field."""
+
+    def __init__(self, *args, **kwargs):
+        fieldset = kwargs.pop('fieldset', None)
+        super().__init__(*args, **kwargs)
+        if fieldset is not None:
+            for name in set(self.fields) - set(fieldset):
+                self.fields.pop(name)
+
+
+class ImageDerivativesField(serializers.ReadOnlyField):
+    """Pet.image_derivatives with storage names turned into URLs; null until they are built."""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return derivative_urls(value, request.build_absolute_uri if request is not None else None)
+
+
+class PetSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
+    # Annotated by listings.favorites.annotate_favorited(); left out where it is not.
+    is_favorited = serializers.BooleanField(read_only=True)
+    image_derivatives = ImageDerivativesField()
 
     class Meta:
         model = Pet
         fields = '__all__'
 
+class PetBulkSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+
+
+class PetBulkUpdateSerializer(PetBulkSerializer):
+    BULK_FIELDS = ('status', 'is_urgent', 'price')
+
+    status = serializers.ChoiceField(choices=Pet.PET_STATUS, required=False)
+    is_urgent = serializers.BooleanField(required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True, required=False)
+
+    def validate(self, attrs):
+        if not any(name in attrs for name in self.BULK_FIELDS):
+            raise serializers.ValidationError(f'Provide at least one of: {", ".join(self.BULK_FIELDS)}.')
+        return attrs
+
+    @property
+    def changes(self):
+        return {name: self.validated_data[name] for name in self.BULK_FIELDS if name in self.validated_data}
+
+class FavoriteBatchSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=1000)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=1000)
+
+    def validate(self, attrs):
+        add, remove = attrs.get('add', []), attrs.get('remove', [])
+        if not add and not remove:
+            raise serializers.ValidationError('Provide pet ids to add and/or remove.')
+        if set(add) & set(remove):
+            raise serializers.ValidationError('A pet cannot be both added and removed.')
+        return attrs
+
 class FavoriteSerializer(serializers.ModelSerializer):
     pet = PetSerializer(read_only=True)
 
+    def __init__(self, *args, **kwargs):
+        # A fieldset applies to the nested pet.
+        fieldset = kwargs.pop('fieldset', None)
+        super().__init__(*args, **kwargs)
+        if fieldset is not None:
+            self.fields['pet'] = PetSerializer(read_only=True, fieldset=fieldset)
+
+    def to_representation(self, instance):
+        # Favorites are only ever listed for their own user.
+        instance.pet.is_favorited = True
+        return super().to_representation(instance)
+
     class Meta:
         model = Favorite
         fields = ['id', 'pet']
 
 
 
+class SavedSearchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SavedSearch
+        fields = ['id', 'name', 'params', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def validate_params(self, value):
+        return normalize_params(value)
+
+    def save(self, **kwargs):
+        if 'params' in self.validated_data:
+            kwargs.update(index_fields(self.validated_data['params']))
+        return super().save(**kwargs)
+
+
+class SearchNotificationSerializer(serializers.ModelSerializer):
+    saved_search_name = serializers.ReadOnlyField(source='saved_search.name')
+    pet = PetSerializer(read_only=True)
+
+    class Meta:
+        model = SearchNotification
+        fields = ['id', 'saved_search', 'saved_search_name', 'pet', 'created_at', 'read_at']
+
+
+class PetDuplicateSerializer(serializers.ModelSerializer):
+    pet = PetSerializer(read_only=True)
+    original = PetSerializer(read_only=True)
+
+    class Meta:
+        model = PetDuplicate
+        fields = ['id', 'pet', 'original', 'same_owner', 'image_distance', 'text_similarity', 'created_at']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'offset', 'created_at']
+        read_only_fields = ['id', 'offset', 'created_at']
+
 
 class ContactMessageSerializer(serializers.ModelSerializer):
     class Meta:
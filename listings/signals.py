@@ -0,0 +1,149 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import invalidate_on_commit
+from .duplicates import fingerprint_on_commit
+from .events import publish_on_commit
+from .favorites import adjust_favorites_count
+from .images import derivatives_on_commit
+from .media import release_on_commit
+from .models import Favorite, Pet, PetTombstone
+from .saved_searches import match_on_commit
+from .search import get_search_backend
+from .stats import bump_stats, invalidate_stats, stats_contribution
+
+
+def _stats_snapshot(instance):
+    # Read straight from __dict__ so deferred fields never trigger a query.
+    values = instance.__dict__
+    if 'status' not in values or 'is_urgent' not in values:
+        return None
+    return values['status'], values['is_urgent']
+
+
+@receiver(post_init, sender=Pet)
+def remember_pet_stats(sender, instance, **kwargs):
+    instance._stats_snapshot = _stats_snapshot(instance)
+
+
+# The counters move when the row change commits: bumped earlier, a rollback
+# would leave them off, and a rebuild racing the transaction would count it twice.
+
+@receiver(post_save, sender=Pet)
+def update_pet_stats(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    current = _stats_snapshot(instance)
+    previous = None if created else instance._stats_snapshot
+    if current is None or (previous is None and not created):
+        transaction.on_commit(invalidate_stats, using=using)
+    else:
+        deltas = stats_contribution(*current)
+        if previous is not None:
+            for name, value in stats_contribution(*previous).items():
+                deltas[name] = deltas.get(name, 0) - value
+        transaction.on_commit(lambda: bump_stats(deltas), using=using)
+    instance._stats_snapshot = current
+
+
+@receiver(post_delete, sender=Pet)
+def remove_pet_stats(sender, instance, using='default', **kwargs):
+    snapshot = instance._stats_snapshot
+    if snapshot is None:
+        transaction.on_commit(invalidate_stats, using=using)
+        return
+    deltas = {name: -value for name, value in stats_contribution(*snapshot).items()}
+    transaction.on_commit(lambda: bump_stats(deltas), using=using)
+
+
+def _image_name(instance):
+    value = instance.__dict__.get('image')
+    return getattr(value, 'name', value) or None
+
+
+@receiver(post_init, sender=Pet)
+def remember_pet_image(sender, instance, **kwargs):
+    instance._image_snapshot = _image_name(instance) if 'image' in instance.__dict__ else None
+
+
+@receiver(pre_save, sender=Pet)
+def reset_image_derivatives(sender, instance, raw=False, **kwargs):
+    # A new (or removed) image makes the old derivatives stale.
+    if not raw and 'image' in instance.__dict__ and _image_name(instance) != instance._image_snapshot:
+        instance.image_derivatives = {}
+
+
+@receiver(post_save, sender=Pet)
+def schedule_image_derivatives(sender, instance, raw=False, using='default', **kwargs):
+    if raw or 'image' not in instance.__dict__:
+        return
+    previous, instance._image_snapshot = instance._image_snapshot, _image_name(instance)
+    if previous and previous != instance._image_snapshot:
+        # The replaced file goes once no other pet shares it.
+        release_on_commit([previous], using)
+    if instance._image_snapshot and not instance.__dict__.get('image_derivatives'):
+        derivatives_on_commit([instance.pk], using)
+
+
+@receiver(post_delete, sender=Pet)
+def release_pet_image(sender, instance, using='default', **kwargs):
+    release_on_commit([_image_name(instance)], using)
+
+
+@receiver(post_save, sender=Pet)
+def index_pet_search_document(sender, instance, using='default', **kwargs):
+    get_search_backend(using).index([instance.pk])
+
+
+@receiver(post_save, sender=Pet)
+def match_pet_saved_searches(sender, instance, raw=False, using='default', **kwargs):
+    if not raw:
+        match_on_commit([instance.pk], using)
+
+
+# Only these feed the fingerprint (the image through its derivatives' dHash).
+FINGERPRINT_FIELDS = frozenset({'description', 'image', 'image_derivatives'})
+
+
+@receiver(post_save, sender=Pet)
+def fingerprint_pet(sender, instance, raw=False, using='default', update_fields=None, **kwargs):
+    if not raw and (update_fields is None or FINGERPRINT_FIELDS & update_fields):
+        fingerprint_on_commit([instance.pk], using)
+
+
+@receiver(post_save, sender=Pet)
+def publish_pet_event(sender, instance, created, raw=False, using='default', **kwargs):
+    if not raw:
+        publish_on_commit([instance.pk], 'created' if created else 'updated', using)
+
+
+@receiver(post_delete, sender=Pet)
+def remove_pet_search_document(sender, instance, using='default', **kwargs):
+    get_search_backend(using).remove([instance.pk])
+
+
+@receiver(post_delete, sender=Pet)
+def record_pet_tombstone(sender, instance, using='default', **kwargs):
+    # Every delete path, including cascades from a deleted owner, ends up here.
+    PetTombstone.objects.using(using).create(pet_id=instance.pk)
+
+
+@receiver(post_save, sender=Favorite)
+def count_favorite(sender, instance, created, raw=False, using='default', **kwargs):
+    if created and not raw:
+        adjust_favorites_count(instance.pet_id, 1, using)
+
+
+@receiver(post_delete, sender=Favorite)
+def uncount_favorite(sender, instance, using='default', **kwargs):
+    # Also runs for favorites cascaded from a deleted user or pet.
+    adjust_favorites_count(instance.pet_id, -1, using)
+
+
+@receiver(post_save, sender=Pet)
+@receiver(post_delete, sender=Pet)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def invalidate_response_cache(sender, using='default', **kwargs):
+    invalidate_on_commit(using)
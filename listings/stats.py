@@ -0,0 +1,74 @@
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Pet
+
+# Counter cache for the unfiltered browse banner. Each counter lives under its
+# own key so the Pet signals can bump them with atomic incr/decr calls.
+STATS_CACHE_PREFIX = 'listings:pet-stats:'
+STATS_CACHE_TIMEOUT = 60 * 60
+STATUS_KEYS = [value for value, _ in Pet.PET_STATUS]
+STATS_KEYS = ['total'] + STATUS_KEYS + ['urgent']
+
+
+def _cache_key(name):
+    return STATS_CACHE_PREFIX + name
+
+
+def aggregate_stats(queryset):
+    """Compute every banner counter in a single conditional-aggregate query."""
+    aggregates = {'total': Count('id')}
+    for value in STATUS_KEYS:
+        aggregates[value] = Count('id', filter=Q(status=value))
+    aggregates['urgent'] = Count('id', filter=Q(is_urgent=True))
+    return queryset.order_by().aggregate(**aggregates)
+
+
+def cached_stats():
+    """Return the unfiltered stats from the counter cache, rebuilding on a miss."""
+    keys = [_cache_key(name) for name in STATS_KEYS]
+    cached = cache.get_many(keys)
+    if len(cached) == len(keys):
+        return {name: cached[_cache_key(name)] for name in STATS_KEYS}
+
+    stats = aggregate_stats(Pet.objects.all())
+    cache.set_many({_cache_key(name): value for name, value in stats.items()}, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def get_pet_stats(queryset):
+    """
+    Stats for a (possibly filtered) Pet queryset.
+
+    An unfiltered queryset is answered from the counter cache; anything with a
+    WHERE clause gets one aggregate pass so the numbers match the filters.
+    """
+    if not queryset.query.where:
+        return cached_stats()
+    return aggregate_stats(queryset)
+
+
+def bump_stats(deltas):
+    """Apply counter deltas; drop the whole cache if any counter is missing."""
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(_cache_key(name), delta)
+        except ValueError:
+            # A counter expired or was evicted: the set is no longer
+            # consistent, so let the next read rebuild all of them.
+            invalidate_stats()
+            return
+
+
+def invalidate_stats():
+    cache.delete_many([_cache_key(name) for name in STATS_KEYS])
+
+
+def stats_contribution(status, is_urgent):
+    """The counters a single pet with the given values contributes to."""
+    contribution = {'total': 1, 'urgent': 1 if is_urgent else 0}
+    if status in STATUS_KEYS:
+        contribution[status] = 1
+    return contribution
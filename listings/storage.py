@@ -0,0 +1,74 @@
+import hashlib
+import os
+import posixpath
+import re
+import time
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+BLOB_HASH = 'sha256'
+# A blob whose last save (or re-use) is younger than this is never deleted
+# by a release: an upload of the same bytes may have found it on disk but
+# not committed its row yet. prune_pet_media collects it later.
+BLOB_GRACE_SECONDS = 3600
+BLOB_NAME_RE = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}(\.\w+)?$')
+
+
+def is_blob_name(name):
+    return bool(BLOB_NAME_RE.search(name))
+
+
+def content_hash(content):
+    """Hex digest of `content`, taken from the upload handler when it already hashed the stream."""
+    digest = getattr(content, 'content_hash', None)
+    if digest:
+        return digest
+    hasher = hashlib.new(BLOB_HASH)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return hasher.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct file once, as `<upload_to>/<h[:2]>/<hash><.ext>`.
+
+    Saving bytes that are already on disk returns the existing name without
+    writing anything. Blobs are shared between pets, so deleting one is left
+    to release_blobs(), which checks that no Pet still references it.
+    """
+
+    def blob_name(self, name, content):
+        digest = content_hash(content)
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.blob_name(name, content)
+        if self.exists(name):
+            # Re-used: restart the grace period so a concurrent release leaves it alone.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+    def is_fresh(self, name):
+        try:
+            return time.time() - os.path.getmtime(self.path(name)) < BLOB_GRACE_SECONDS
+        except FileNotFoundError:
+            return False
+
+
+pet_image_storage = ContentAddressedStorage()
+
+
+def get_pet_image_storage():
+    return pet_image_storage
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import weakref
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from .cache import BOOLEAN_VALUES
+from .events import get_event_broker, subscription_key
+from .models import Pet
+
+PET_STREAM_PATH = '/pets/stream/'
+HEARTBEAT_SECONDS = 15
+RETRY_MILLISECONDS = 3000
+PET_TYPES = {value for value, _ in Pet.PET_TYPE}
+# An SSE comment keeps proxies from timing out an idle connection.
+PING = b': ping\n\n'
+
+_heartbeats = weakref.WeakKeyDictionary()
+
+
+def stream_filters(query_string):
+    """The (type, city, is_urgent) filter from the query string, or a dict of errors."""
+    params = {name: values[-1] for name, values in parse_qs(query_string.decode('latin-1')).items()}
+    errors = {}
+    pet_type = params.get('type') or None
+    if pet_type is not None and pet_type not in PET_TYPES:
+        errors['type'] = [f'Select a valid choice. {pet_type} is not one of the available choices.']
+    urgent = params.get('is_urgent', params.get('urgent')) or None
+    if urgent is not None:
+        urgent = BOOLEAN_VALUES.get(urgent.lower())
+        if urgent is None:
+            errors['is_urgent'] = ['Enter a valid boolean.']
+        else:
+            urgent = urgent == 'true'
+    if errors:
+        return None, errors
+    return subscription_key(pet_type, params.get('city') or None, urgent), None
+
+
+def cors_headers(scope):
+    # The stream bypasses Django's middleware, so CORS is answered here.
+    origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+    if origin and origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', ()):
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    return []
+
+
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def close_on_disconnect(receive, subscription):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscription.close()
+
+
+async def heartbeat(broker):
+    # One timer per event loop pings every stream on it, rather than one per client.
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        if not broker.broadcast(PING, loop):
+            return
+
+
+def ensure_heartbeat(broker):
+    loop = asyncio.get_running_loop()
+    task = _heartbeats.get(loop)
+    if task is None or task.done():
+        _heartbeats[loop] = loop.create_task(heartbeat(broker))
+
+
+async def pet_stream(scope, receive, send):
+    """
+    GET /pets/stream/ - server-sent events for created and updated pets,
+    optionally narrowed to `type`, `city` and `is_urgent`.
+
+    A raw ASGI app routed in backend/asgi.py ahead of Django: an idle client
+    holds a queue and two parked coroutines, with no thread, timer,
+    middleware stack or database connection behind it.
+    """
+    if scope['method'] != 'GET':
+        await send_json(send, 405, {'detail': f"Method \"{scope['method']}\" not allowed."}, [(b'allow', b'GET')])
+        return
+    key, errors = stream_filters(scope['query_string'])
+    if errors:
+        await send_json(send, 400, errors, cors_headers(scope))
+        return
+
+    broker = get_event_broker()
+    subscription = broker.subscribe(key)
+    ensure_heartbeat(broker)
+    watcher = asyncio.ensure_future(close_on_disconnect(receive, subscription))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                # Stop nginx from buffering the stream.
+                (b'x-accel-buffering', b'no'),
+            ] + cors_headers(scope),
+        })
+        await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MILLISECONDS}\n\n'.encode(), 'more_body': True})
+        while True:
+            body = await subscription.queue.get()
+            if body is None:
+                return
+            if subscription.overflowed:
+                # Too far behind (or gone): end the stream and let the client reconnect.
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broker.unsubscribe(subscription)
+        watcher.cancel()
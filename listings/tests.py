@@ -1,3 +1,1331 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import io
+import json
+import os
+import random
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files import locks
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from .cards import CARD_FIELDS
+from .events import LocalBroker
+from .fieldsets import pet_field_names
+from .images import generate_derivatives
+from .models import (
+    Favorite, Pet, PetDuplicate, PetFingerprint, PetFingerprintBucket, SavedSearch, SearchNotification, UploadSession,
+)
+from .saved_searches import index_fields, normalize_params
+from .search import FTS_TABLE
+from .storage import content_hash
+from .stream import pet_stream
+from .uploads import UploadConflict, part_path, start_upload, write_chunk
+
+User = get_user_model()
+
+
+def make_pet(owner, **fields):
+    values = {
+        'name': 'Rex',
+        'type': 'dog',
+        'breed': 'Labrador',
+        'age': 12,
+        'gender': 'male',
+        'description': 'Friendly and house trained.',
+        'status': 'adopting',
+        'price': 100,
+        'city': 'Baku',
+        'owner': owner,
+    }
+    values.update(fields)
+    return Pet.objects.create(**values)
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class PetQueryCountTests(APITestCase):
+    """Every read path must cost a constant number of queries, however many pets it returns."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owners = [
+            User.objects.create_user(username=f'owner{i}', email=f'owner{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+        cls.user = cls.owners[0]
+        cls.pets = [make_pet(cls.owners[i % 3], name=f'Pet {i}', status='available' if i % 2 else 'selling') for i in range(9)]
+        for pet in cls.pets:
+            Favorite.objects.create(user=cls.user, pet=pet)
+
+    def setUp(self):
+        cache.clear()
+
+    def add_pets(self, count=6):
+        for i in range(count):
+            pet = make_pet(self.owners[i % 3], name=f'Extra {i}', status='available')
+            Favorite.objects.create(user=self.user, pet=pet)
+
+    def assertConstantQueries(self, num, url):
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.add_pets()
+        with self.assertNumQueries(num):
+            self.client.get(url)
+
+    # Public lists and details add one query for their ETag / Last-Modified validators.
+
+    def test_pet_list(self):
+        # validators + page + filtered stats aggregate
+        self.assertConstantQueries(3, reverse('pet-list') + '?type=dog')
+
+    def test_pet_list_cached_stats(self):
+        self.client.get(reverse('pet-list'))
+        self.assertConstantQueries(2, reverse('pet-list'))
+
+    def test_pet_list_fbv(self):
+        self.assertConstantQueries(2, reverse('pet-list-fbv'))
+
+    def test_pet_detail(self):
+        self.assertConstantQueries(2, reverse('pet-detail', args=[self.pets[0].pk]))
+
+    def test_pet_manage_detail(self):
+        self.assertConstantQueries(2, reverse('pet-manage', args=[self.pets[0].pk]))
+
+    def test_pet_detail_fbv(self):
+        self.assertConstantQueries(2, reverse('pet-detail-fbv', args=[self.pets[0].pk]))
+
+    def test_my_pets(self):
+        self.client.force_authenticate(self.user)
+        self.assertConstantQueries(1, reverse('pet-utils-my-pets'))
+
+    def test_available_pets(self):
+        self.assertConstantQueries(1, reverse('pet-utils-available-pets'))
+
+    def test_owner_viewset_list(self):
+        self.client.force_authenticate(self.user)
+        self.assertConstantQueries(1, reverse('pet-owner-list'))
+
+    def test_favorite_list(self):
+        self.client.force_authenticate(self.user)
+        self.assertConstantQueries(1, reverse('favorite-list'))
+
+
+class PetCardTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        make_pet(owner, name='Ləzzət "Bella"', price=None, image='pets/bella photo.jpg')
+        make_pet(owner, name='Tom', type='cat', price='12.5')
+
+    def test_bench_pet_list(self):
+        out = io.StringIO()
+        call_command('bench_pet_list', pets=5, page_size=2, repeat=1, stdout=out)
+        self.assertIn('speedup:', out.getvalue())
+        self.assertEqual(Pet.objects.count(), 2)
+
+    def test_cards_match_serializer(self):
+        full = self.client.get(reverse('pet-list'), {'include': ''}).json()['pets']
+        cards = self.client.get(reverse('pet-list'), {'include': '', 'view': 'card'}).json()['pets']
+        for pet in full:
+            del pet['description']
+        self.assertEqual([list(card.items()) for card in cards], [list(pet.items()) for pet in full])
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class PetPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        prices = [None, 50, 100, None, 50, 100, 75, None, 50]
+        pets = [make_pet(owner, name=f'Pet {i}', price=price) for i, price in enumerate(prices)]
+        # Pets listed in the same transaction share a created_at.
+        same = timezone.now() - datetime.timedelta(days=1)
+        Pet.objects.filter(pk__in=[pet.pk for pet in pets[2:6]]).update(created_at=same)
+
+    def walk(self, **params):
+        response = self.client.get(reverse('pet-list'), {'include': '', 'page_size': 2, **params})
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [pet['id'] for pet in data['pets']]
+            if not data['next']:
+                return ids
+            response = self.client.get(data['next'])
+
+    def test_pages_cover_every_row_once_in_order(self):
+        for ordering, order_by in [
+            ('-created_at', ['-created_at', '-id']),
+            ('created_at', ['created_at', 'id']),
+            ('-price', [F('price').desc(nulls_first=True), '-id']),
+            ('price', [F('price').asc(nulls_last=True), 'id']),
+        ]:
+            with self.subTest(ordering=ordering):
+                expected = list(Pet.objects.order_by(*order_by).values_list('id', flat=True))
+                self.assertEqual(self.walk(ordering=ordering), expected)
+
+    def test_seek_has_a_leading_range_bound(self):
+        first = self.client.get(reverse('pet-list'), {'include': '', 'page_size': 2, 'ordering': 'price'}).json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first['next'])
+        page = next(query['sql'] for query in queries if 'ORDER BY' in query['sql'])
+        self.assertIn('"listings_pet"."price" >=', page)
+
+    def test_bad_and_tampered_cursors(self):
+        def cursor(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+        for value in [
+            'nope',
+            cursor({'o': '-created_at', 'v': 'yesterday', 'pk': 1}),
+            cursor({'o': '-created_at', 'v': '2024-01-01T00:00:00+00:00', 'pk': 'one'}),
+            cursor({'o': '-created_at', 'v': '2024-01-01T00:00:00+00:00', 'pk': None}),
+            cursor({'o': 'price', 'v': '100', 'pk': 1}),
+            cursor({'o': '-price', 'v': {'a': 1}, 'pk': 1}),
+        ]:
+            with self.subTest(cursor=value):
+                response = self.client.get(reverse('pet-list'), {'cursor': value})
+                self.assertEqual(response.status_code, 404)
+
+
+class PetIndexCheckTests(APITestCase):
+
+    def test_canonical_queries_are_served_by_indexes(self):
+        out = io.StringIO()
+        call_command('check_pet_indexes', stdout=out)
+        self.assertIn('seek', out.getvalue())
+        self.assertRegex(out.getvalue(), r"ok +search='labradr'")
+
+    def test_sorts_and_full_index_scans_fail(self):
+        queries = [({'status': 'adopting'}, 'age'), ({'gender': 'female'}, '-created_at')]
+        out = io.StringIO()
+        with mock.patch('listings.management.commands.check_pet_indexes.CANONICAL_QUERIES', queries):
+            with self.assertRaisesMessage(CommandError, '3 canonical pet queries'):
+                call_command('check_pet_indexes', stdout=out)
+        self.assertRegex(out.getvalue(), r"SORT +\{'status': 'adopting'\} ordering=age seek")
+        self.assertRegex(out.getvalue(), r"FULL INDEX SCAN +\{'gender': 'female'\} ordering=-created_at\n")
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class PetStatsTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        make_pet(self.owner, status='adopting', is_urgent=True)
+        make_pet(self.owner, status='selling')
+        make_pet(self.owner, status='selling', type='cat', is_urgent=True)
+
+    def stats(self, **params):
+        return self.client.get(reverse('pet-list'), params).json()['stats']
+
+    def test_filtered_stats_match_the_filters(self):
+        self.assertEqual(self.stats(type='cat'), {'total': 1, 'adopting': 0, 'selling': 1, 'breeding': 0, 'urgent': 1})
+        self.assertEqual(self.stats(status='selling'), {'total': 2, 'adopting': 0, 'selling': 2, 'breeding': 0, 'urgent': 1})
+
+    def test_counters_follow_commits(self):
+        self.assertEqual(self.stats(), {'total': 3, 'adopting': 1, 'selling': 2, 'breeding': 0, 'urgent': 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pet = make_pet(self.owner, status='breeding', is_urgent=True)
+        self.assertEqual(self.stats(), {'total': 4, 'adopting': 1, 'selling': 2, 'breeding': 1, 'urgent': 3})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pet.status, pet.is_urgent = 'adopting', False
+            pet.save()
+        self.assertEqual(self.stats(), {'total': 4, 'adopting': 2, 'selling': 2, 'breeding': 0, 'urgent': 2})
+
+        # Until the delete commits the counters still count the pet.
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            pet.delete()
+        self.assertTrue(callbacks)
+        self.assertEqual(self.stats()['total'], 4)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.stats(), {'total': 3, 'adopting': 1, 'selling': 2, 'breeding': 0, 'urgent': 2})
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class PetSearchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.bella = make_pet(cls.owner, name='Bella', type='cat', breed='Siamese')
+        cls.rex = make_pet(cls.owner, name='Rex', description='Gets on with Bella, the neighbour cat.')
+        cls.max = make_pet(cls.owner, name='Max', breed='Beagle', city='Ganja')
+
+    def search(self, text, **params):
+        pets = self.client.get(reverse('pet-list'), {'search': text, 'include': '', **params}).json()['pets']
+        return [pet['name'] for pet in pets]
+
+    def test_ranks_name_matches_above_description_matches(self):
+        self.assertEqual(self.search('bella'), ['Bella', 'Rex'])
+
+    def test_prefixes_match(self):
+        self.assertEqual(self.search('bea'), ['Max'])
+        self.assertEqual(self.search('siam bel'), ['Bella'])
+
+    def test_search_combines_with_filters_and_ordering(self):
+        self.assertEqual(self.search('bella', type='dog'), ['Rex'])
+        self.assertEqual(self.search('bella', ordering='-name'), ['Rex', 'Bella'])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_updates_and_deletes_are_reindexed(self):
+        self.max.name = 'Buddy'
+        self.max.save()
+        self.assertEqual(self.search('max'), [])
+        self.assertEqual(self.search('buddy'), ['Buddy'])
+
+        self.bella.delete()
+        self.assertEqual(self.search('siamese'), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE rowid = %s', [self.bella.pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class SparseFieldsetTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.pet = make_pet(cls.owner, name='Bella')
+        Favorite.objects.create(user=cls.owner, pet=cls.pet)
+
+    def pets(self, **params):
+        response = self.client.get(reverse('pet-list'), {'include': '', **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['pets']
+
+    def test_fields_and_exclude(self):
+        self.assertEqual(list(self.pets(fields='price,name')[0]), ['name', 'price'])
+        excluded = self.pets(exclude='description,image_derivatives')[0]
+        self.assertEqual(list(excluded), [name for name in pet_field_names() if name not in ('description', 'image_derivatives')])
+        self.assertEqual(list(self.pets(fields='id,name,city', exclude='city')[0]), ['id', 'name'])
+        detail = self.client.get(reverse('pet-detail', args=[self.pet.pk]), {'fields': 'name,owner'}).json()
+        self.assertEqual(detail, {'owner': 'owner', 'name': 'Bella'})
+
+        self.client.force_authenticate(self.owner)
+        favorites = self.client.get(reverse('favorite-list'), {'fields': 'name'}).json()['results']
+        self.assertEqual(favorites[0]['pet'], {'name': 'Bella'})
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(reverse('pet-list'), {'fields': 'name,colour', 'exclude': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('colour', response.json()['fields'][0])
+        self.assertIn('bogus', response.json()['exclude'][0])
+        self.assertEqual(self.client.get(reverse('pet-detail', args=[self.pet.pk]), {'fields': 'colour'}).status_code, 400)
+
+    def test_fieldsets_are_pushed_down_to_sql(self):
+        def pet_select(url, params):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url, params)
+            return [query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'ORDER BY' in query['sql']][-1]
+
+        page = pet_select(reverse('pet-list'), {'include': '', 'fields': 'name,price'})
+        self.assertIn('"listings_pet"."name"', page)
+        self.assertNotIn('"listings_pet"."description"', page)
+        self.assertNotIn('JOIN', page)
+        page = pet_select(reverse('pet-list'), {'include': '', 'fields': 'name,owner', 'ordering': 'age'})
+        # The ordering column stays loaded for the keyset cursor; the owner comes from a join.
+        self.assertIn('"listings_pet"."age"', page)
+        self.assertIn('"accounts_user"."username"', page)
+        self.assertNotIn('"listings_pet"."description"', page)
+
+    def test_card_subsets(self):
+        self.assertEqual(list(self.pets(view='card')[0]), CARD_FIELDS)
+        self.assertEqual(list(self.pets(view='card', fields='city,name')[0]), ['name', 'city'])
+        cards = self.pets(view='card', exclude='image_derivatives,favorites_count')
+        self.assertEqual(list(cards[0]), [name for name in CARD_FIELDS if name not in ('image_derivatives', 'favorites_count')])
+        self.assertEqual(list(self.pets(view='card', fields='description')[0]), ['description'])
+
+
+class ResponseCacheTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.pet = make_pet(cls.owner)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_equivalent_queries_share_an_entry(self):
+        first = self.client.get(reverse('pet-list') + '?type=dog&city=Baku')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('pet-list') + '?city=Baku&type=dog&page_size=20&include=stats')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+
+    def test_only_spellings_the_filter_reads_alike_share_an_entry(self):
+        make_pet(self.owner, type='cat', vaccinated=True)
+        make_pet(self.owner, type='cat')
+
+        def count(query):
+            response = self.client.get(reverse('pet-list') + query)
+            return len(response.json()['pets']), response['X-Cache']
+
+        # BooleanWidget ignores `yes`, so it must not answer for `true`.
+        self.assertEqual(count('?vaccinated=yes'), (3, 'MISS'))
+        self.assertEqual(count('?vaccinated=true'), (1, 'MISS'))
+        self.assertEqual(count('?vaccinated=1'), (1, 'HIT'))
+        self.assertEqual(count('?vaccinated=TRUE'), (1, 'HIT'))
+        # The last of repeated values is the one that filters.
+        self.assertEqual(count('?type=dog&type=cat'), (2, 'MISS'))
+        self.assertEqual(count('?type=cat&type=dog'), (1, 'MISS'))
+        self.assertEqual(count('?type=cat'), (2, 'HIT'))
+
+    def test_entries_follow_the_negotiated_renderer(self):
+        url = reverse('pet-list')
+        compact = self.client.get(url, HTTP_ACCEPT='application/json')
+        indented = self.client.get(url, HTTP_ACCEPT='application/json; indent=4')
+        self.assertEqual((compact['X-Cache'], indented['X-Cache']), ('MISS', 'MISS'))
+        self.assertNotEqual(compact.content, indented.content)
+        again = self.client.get(url, HTTP_ACCEPT='application/json;indent=4')
+        self.assertEqual((again['X-Cache'], again.content), ('HIT', indented.content))
+        # Shared caches in front have to key on Accept too.
+        self.assertIn('Accept', again['Vary'])
+
+    def test_write_invalidates(self):
+        url = reverse('pet-detail', args=[self.pet.pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Pet.objects.get(pk=self.pet.pk).save()
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertFalse(self.client.get(reverse('pet-list')).has_header('X-Cache'))
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class ConditionalGetTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.pet = make_pet(cls.owner)
+
+    def test_detail_not_modified_costs_one_query(self):
+        for name in ['pet-detail', 'pet-manage', 'pet-detail-fbv']:
+            url = reverse(name, args=[self.pet.pk])
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_list_etag_changes_with_rows(self):
+        url = reverse('pet-list')
+        etag = self.client.get(url)['ETag']
+        make_pet(self.owner, name='Bella')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_validators_read_only_the_page(self):
+        for i in range(5):
+            make_pet(self.owner, name=f'Pet {i}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('pet-list'), {'include': '', 'page_size': 2})
+        validators = queries.captured_queries[0]['sql']
+        self.assertIn('LIMIT 3', validators)
+        self.assertNotRegex(validators, r'\b(COUNT|SUM|MAX)\(')
+        second = self.client.get(response.json()['next'])
+        self.assertNotEqual(second['ETag'], response['ETag'])
+
+    def test_list_etag_follows_writes_off_the_page(self):
+        make_pet(self.owner, name='Bella')
+        url = reverse('pet-list') + '?page_size=1'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # The first pet is on page two, but the stats banner on page one counts it.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pet.status = 'selling'
+            self.pet.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ConditionalUpdateTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.pet = make_pet(cls.owner)
+
+    def setUp(self):
+        self.client.force_authenticate(self.owner)
+
+    def test_stale_if_match_is_rejected(self):
+        etag = self.client.get(reverse('pet-detail', args=[self.pet.pk]))['ETag']
+        url = reverse('pet-update', args=[self.pet.pk])
+        first = self.client.patch(url, {'name': 'Max'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(first.status_code, 200)
+        second = self.client.patch(url, {'name': 'Bella'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(second.status_code, 412)
+        self.assertEqual(Pet.objects.get(pk=self.pet.pk).name, 'Max')
+        retry = self.client.patch(url, {'name': 'Bella'}, HTTP_IF_MATCH=first['ETag'])
+        self.assertEqual(retry.status_code, 200)
+
+    def test_single_fetch_and_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(reverse('pet-update', args=[self.pet.pk]), {'name': 'Max'})
+        statements = [query['sql'].split()[0] for query in queries.captured_queries if 'FROM "listings_pet"' in query['sql'] or query['sql'].startswith('UPDATE "listings_pet"')]
+        self.assertEqual(statements, ['SELECT', 'UPDATE'])
+
+    def test_change_status_validates_choices(self):
+        url = reverse('pet-utils-change-status', args=[self.pet.pk])
+        self.assertEqual(self.client.post(url, {'status': 'lost'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'status': 'selling'}).status_code, 200)
+        self.assertEqual(Pet.objects.get(pk=self.pet.pk).status, 'selling')
+
+
+class BulkCreateTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.owner)
+
+    def pet_data(self, **fields):
+        values = {'name': 'Rex', 'type': 'dog', 'age': 12, 'gender': 'male', 'description': 'Calm.', 'city': 'Baku'}
+        values.update(fields)
+        return values
+
+    def test_json_array(self):
+        stats = self.client.get(reverse('pet-list')).json()['stats']
+        items = [self.pet_data(name=f'Pet {i}', is_urgent=i % 2 == 0) for i in range(5)]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('pet-bulk-create'), items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 5)
+        self.assertEqual(Pet.objects.filter(owner=self.owner).count(), 5)
+        fresh = self.client.get(reverse('pet-list')).json()
+        self.assertEqual(fresh['stats']['total'], stats['total'] + 5)
+        self.assertEqual(fresh['stats']['urgent'], stats['urgent'] + 3)
+        self.assertEqual(len(self.client.get(reverse('pet-list'), {'search': 'Pet'}).json()['pets']), 5)
+
+    def test_ndjson_with_item_errors(self):
+        body = '\n'.join(json.dumps(item) for item in [self.pet_data(), self.pet_data(type='dragon'), self.pet_data(age=-1)])
+        response = self.client.post(reverse('pet-bulk-create'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        self.assertFalse(Pet.objects.exists())
+
+
+class BulkOwnerActionTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.other = User.objects.create_user(username='other', email='other@example.com', password='password123')
+        cls.pets = [make_pet(cls.owner, name=f'Pet {i}') for i in range(4)]
+        cls.foreign = make_pet(cls.other)
+        Favorite.objects.create(user=cls.other, pet=cls.pets[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.owner)
+
+    def test_bulk_update(self):
+        ids = [pet.pk for pet in self.pets[:3]] + [self.foreign.pk]
+        stats = self.client.get(reverse('pet-list')).json()['stats']
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(4):  # savepoint, locking SELECT, UPDATE, release
+            response = self.client.post(reverse('pet-owner-bulk-update'), {'ids': ids, 'status': 'selling', 'is_urgent': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['result'] for row in response.json()['results']], ['updated'] * 3 + ['not_found'])
+        self.assertEqual(Pet.objects.filter(status='selling', is_urgent=True).count(), 3)
+        fresh = self.client.get(reverse('pet-list')).json()['stats']
+        self.assertEqual(fresh['selling'], stats['selling'] + 3)
+        self.assertEqual(fresh['urgent'], stats['urgent'] + 3)
+
+    def test_bulk_delete(self):
+        params = normalize_params({'type': 'dog'})
+        search = SavedSearch.objects.create(user=self.other, params=params, **index_fields(params))
+        SearchNotification.objects.create(user=self.other, saved_search=search, pet=self.pets[0])
+        PetFingerprint.objects.create(pet=self.pets[0])
+        PetFingerprintBucket.objects.create(pet=self.pets[0], key=1)
+        PetDuplicate.objects.create(pet=self.pets[1], original=self.pets[0], same_owner=True)
+        ids = [self.pets[0].pk, self.foreign.pk, 999999]
+        response = self.client.post(reverse('pet-owner-bulk-delete'), {'ids': ids}, format='json')
+        self.assertEqual(response.json()['deleted'], 1)
+        # Nothing may still point at the deleted row once the transaction commits.
+        connection.check_constraints()
+        for relation in Pet._meta.related_objects:
+            references = relation.related_model.objects.filter(**{relation.field.name: self.pets[0].pk})
+            self.assertFalse(references.exists(), relation)
+        self.assertFalse(Pet.objects.filter(pk=self.pets[0].pk).exists())
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(SearchNotification.objects.exists())
+        self.assertTrue(Pet.objects.filter(pk=self.foreign.pk).exists())
+        self.assertEqual(self.client.get(reverse('pet-list')).json()['stats']['total'], 4)
+
+    def test_bulk_update_requires_a_change(self):
+        response = self.client.post(reverse('pet-owner-bulk-update'), {'ids': [self.pets[0].pk]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class FavoriteStateTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', email='user@example.com', password='password123')
+        cls.pets = [make_pet(cls.user, name=f'Pet {i}') for i in range(3)]
+        Favorite.objects.create(user=cls.user, pet=cls.pets[0])
+
+    def setUp(self):
+        cache.clear()
+
+    def favorited(self, url, **params):
+        pets = self.client.get(url, params).json()['pets']
+        return {pet['id']: pet['is_favorited'] for pet in pets}
+
+    def test_lists_and_details_are_annotated(self):
+        self.client.force_authenticate(self.user)
+        expected = {self.pets[0].pk: True, self.pets[1].pk: False, self.pets[2].pk: False}
+        self.assertEqual(self.favorited(reverse('pet-list')), expected)
+        self.assertEqual(self.favorited(reverse('pet-list'), view='card'), expected)
+        self.assertIs(self.client.get(reverse('pet-detail', args=[self.pets[0].pk])).json()['is_favorited'], True)
+        self.client.force_authenticate(None)
+        self.assertFalse(any(self.favorited(reverse('pet-list')).values()))
+
+    def test_batch_toggle_changes_list_etag(self):
+        self.client.force_authenticate(self.user)
+        etag = self.client.get(reverse('pet-list'))['ETag']
+        response = self.client.post(
+            reverse('favorite-batch'),
+            {'add': [self.pets[1].pk, self.pets[2].pk, 999999], 'remove': [self.pets[0].pk]},
+            format='json',
+        )
+        self.assertEqual(response.json()['not_found'], [999999])
+        self.assertEqual(
+            set(Favorite.objects.filter(user=self.user).values_list('pet_id', flat=True)),
+            {self.pets[1].pk, self.pets[2].pk},
+        )
+        self.assertEqual(self.client.get(reverse('pet-list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FavoritesCountTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.fans = [
+            User.objects.create_user(username=f'fan{i}', email=f'fan{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+        cls.pets = [make_pet(cls.owner, name=f'Pet {i}') for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+
+    def count(self, pet):
+        return Pet.objects.get(pk=pet.pk).favorites_count
+
+    def test_single_batch_and_cascade_paths(self):
+        for fan in self.fans:
+            self.client.force_authenticate(fan)
+            self.client.post(reverse('favorite-add', args=[self.pets[0].pk]))
+        self.assertEqual(self.count(self.pets[0]), 3)
+        self.client.post(reverse('favorite-batch'), {'add': [self.pets[0].pk, self.pets[1].pk]}, format='json')
+        self.assertEqual((self.count(self.pets[0]), self.count(self.pets[1])), (3, 1))
+        self.client.post(reverse('favorite-batch'), {'remove': [self.pets[1].pk]}, format='json')
+        self.client.delete(reverse('favorite-remove', args=[self.pets[0].pk]))
+        self.assertEqual((self.count(self.pets[0]), self.count(self.pets[1])), (2, 0))
+        self.fans[0].delete()
+        self.assertEqual(self.count(self.pets[0]), 1)
+
+    def test_saving_a_stale_instance_keeps_the_count(self):
+        stale = Pet.objects.get(pk=self.pets[0].pk)
+        self.client.force_authenticate(self.fans[0])
+        self.client.post(reverse('favorite-add', args=[self.pets[0].pk]))
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.count(self.pets[0]), 1)
+        self.assertEqual(Pet.objects.get(pk=self.pets[0].pk).name, 'Renamed')
+
+    def test_popularity_ordering(self):
+        for i, pet in enumerate(self.pets):
+            for fan in self.fans[:i]:
+                Favorite.objects.create(user=fan, pet=pet)
+        names = [pet['name'] for pet in self.client.get(reverse('pet-list'), {'ordering': '-favorites_count', 'page_size': 2}).json()['pets']]
+        self.assertEqual(names, ['Pet 2', 'Pet 1'])
+
+    def test_recount_command_repairs_drift(self):
+        Favorite.objects.create(user=self.fans[0], pet=self.pets[0])
+        Pet.objects.filter(pk=self.pets[0].pk).update(favorites_count=7)
+        call_command('recount_favorites', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(self.count(self.pets[0]), 1)
+
+
+class PetFacetTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        make_pet(owner, type='dog', city='Baku', vaccinated=True)
+        make_pet(owner, type='dog', city='Ganja')
+        make_pet(owner, type='cat', city='Baku', gender='female')
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self, facets, name):
+        return {row['value']: row['count'] for row in facets[name]}
+
+    def test_drill_down_counts(self):
+        with self.assertNumQueries(5):
+            facets = self.client.get(reverse('pet-facets'), {'type': 'dog', 'city': 'Baku'}).json()
+        # A facet ignores its own filter but applies the others.
+        self.assertEqual(self.counts(facets, 'type'), {'dog': 1, 'cat': 1, 'bird': 0, 'rabbit': 0, 'fish': 0, 'other': 0})
+        self.assertEqual(self.counts(facets, 'city'), {'Baku': 1, 'Ganja': 1})
+        self.assertEqual(self.counts(facets, 'vaccinated'), {True: 1, False: 0})
+        with self.assertNumQueries(0):
+            self.client.get(reverse('pet-facets'), {'city': 'Baku', 'type': 'dog', 'ordering': 'price'})
+
+    def test_hidden_duplicates_are_not_counted(self):
+        original = Pet.objects.get(city='Ganja')
+        repost = make_pet(original.owner, type='dog', city='Ganja')
+        PetDuplicate.objects.create(pet=repost, original=original, same_owner=True)
+        facets = self.client.get(reverse('pet-facets')).json()
+        self.assertEqual(self.counts(facets, 'city'), {'Baku': 2, 'Ganja': 2})
+        facets = self.client.get(reverse('pet-facets'), {'hide_duplicates': 'true'}).json()
+        self.assertEqual(self.counts(facets, 'city'), {'Baku': 2, 'Ganja': 1})
+        self.assertEqual(self.counts(facets, 'type')['dog'], 2)
+        pets = self.client.get(reverse('pet-list'), {'hide_duplicates': 'true', 'city': 'Ganja', 'include': ''}).json()['pets']
+        self.assertEqual(len(pets), 1)
+
+    def test_invalid_filter(self):
+        self.assertEqual(self.client.get(reverse('pet-facets'), {'min_price': 'cheap'}).status_code, 400)
+
+
+class DistributionTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        for price, age in [(0, 1), (10, 2), (50, 5), (100, 12), (None, 24)]:
+            make_pet(owner, price=price, age=age)
+        make_pet(owner, type='cat', price=1000, age=60)
+
+    def test_histograms_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('pet-utils-distribution'), {'type': 'dog', 'buckets': 4}).json()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual((data['price']['min'], data['price']['max']), (0.0, 100.0))
+        self.assertEqual([bucket['count'] for bucket in data['price']['buckets']], [2, 0, 1, 1])
+        self.assertEqual([bucket['count'] for bucket in data['age']['buckets']], [3, 1, 0, 1])
+
+    def test_price_ranges_follow_filters(self):
+        data = self.client.get(reverse('pet-utils-price-ranges'), {'type': 'cat'}).json()
+        self.assertEqual((data['min_price'], data['max_price']), (1000.0, 1000.0))
+
+    def test_hidden_duplicates_are_left_out(self):
+        original = Pet.objects.get(type='cat')
+        repost = make_pet(original.owner, type='cat', price=5000, age=70)
+        PetDuplicate.objects.create(pet=repost, original=original, same_owner=True)
+        params = {'type': 'cat', 'hide_duplicates': 'true'}
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('pet-utils-distribution'), params).json()
+        self.assertEqual((data['count'], data['price']['max'], data['age']['max']), (1, 1000.0, 60))
+        data = self.client.get(reverse('pet-utils-price-ranges'), params).json()
+        self.assertEqual((data['min_price'], data['max_price']), (1000.0, 1000.0))
+        self.assertEqual(self.client.get(reverse('pet-utils-distribution'), {'type': 'cat'}).json()['count'], 2)
+
+
+class ExportTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.pets = [make_pet(owner, name=f'Pet {i}', type='cat' if i == 2 else 'dog') for i in range(3)]
+
+    def test_ndjson_and_csv(self):
+        response = self.client.get(reverse('pet-export', args=['ndjson']), {'type': 'dog'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Pet 0', 'Pet 1'])
+        self.assertEqual(rows[0]['description'], 'Friendly and house trained.')
+
+        response = self.client.get(reverse('pet-export', args=['csv']))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('id,owner,image_derivatives,name,'))
+
+    def test_updated_since(self):
+        Pet.objects.filter(pk=self.pets[0].pk).update(updated_at=timezone.now() + datetime.timedelta(hours=1))
+        since = (timezone.now() + datetime.timedelta(minutes=30)).isoformat()
+        response = self.client.get(reverse('pet-export', args=['ndjson']), {'updated_since': since})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+        self.assertEqual(self.client.get(reverse('pet-export', args=['ndjson']), {'updated_since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('pet-export', args=['xml'])).status_code, 404)
+
+    @override_settings(LISTINGS_EXPORT_OVERLAP_SECONDS=60)
+    def test_next_updated_since_overlaps_the_export(self):
+        Pet.objects.update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        response = self.client.get(reverse('pet-export', args=['ndjson']))
+        started = datetime.datetime.fromisoformat(response['X-Export-Started'])
+        since = datetime.datetime.fromisoformat(response['X-Export-Next-Updated-Since'])
+        self.assertEqual(started - since, datetime.timedelta(seconds=60))
+        # A row written just before the export started but committed after it is still picked up.
+        Pet.objects.filter(pk=self.pets[1].pk).update(updated_at=started - datetime.timedelta(seconds=1))
+        response = self.client.get(reverse('pet-export', args=['ndjson']), {'updated_since': since.isoformat()})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.pets[1].pk])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_pets', '--format', 'csv', '--filter', 'type=cat', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+    def test_hidden_duplicates_are_not_exported(self):
+        PetDuplicate.objects.create(pet=self.pets[1], original=self.pets[0], same_owner=True)
+        response = self.client.get(reverse('pet-export', args=['ndjson']), {'type': 'dog', 'hide_duplicates': 'true'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.pets[0].pk])
+        out = io.StringIO()
+        call_command('export_pets', '--filter', 'hide_duplicates=true', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+@mock.patch('listings.changes.SETTLE_SECONDS', 0)
+class ChangesFeedTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.pets = [make_pet(cls.owner, name=f'Pet {i}') for i in range(5)]
+
+    def sync(self, cursor=None, limit=2):
+        pets, deletes = [], []
+        while True:
+            params = {'limit': limit}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('pet-changes'), params).json()
+            pets += [pet['name'] for pet in data['upserts']]
+            deletes += data['deletes']
+            cursor = data['cursor']
+            if not data['has_more']:
+                return pets, deletes, cursor
+
+    def test_full_then_delta_sync(self):
+        pets, deletes, cursor = self.sync()
+        self.assertEqual((len(pets), deletes), (5, []))
+        self.client.force_authenticate(self.owner)
+        self.client.patch(reverse('pet-update', args=[self.pets[1].pk]), {'name': 'Renamed'})
+        self.client.delete(reverse('pet-delete', args=[self.pets[2].pk]))
+        self.client.post(reverse('pet-owner-bulk-delete'), {'ids': [self.pets[3].pk]}, format='json')
+        pets, deletes, cursor = self.sync(cursor)
+        self.assertEqual(pets, ['Renamed'])
+        self.assertEqual(deletes, [self.pets[2].pk, self.pets[3].pk])
+        self.assertEqual(self.sync(cursor)[:2], ([], []))
+
+    def test_bad_and_expired_cursors(self):
+        self.assertEqual(self.client.get(reverse('pet-changes'), {'cursor': 'nope'}).status_code, 404)
+        with override_settings(LISTINGS_TOMBSTONE_RETENTION_DAYS=-1):
+            cursor = self.client.get(reverse('pet-changes')).json()['cursor']
+            self.assertEqual(self.client.get(reverse('pet-changes'), {'cursor': cursor}).status_code, 410)
+
+
+class SavedSearchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        cls.user = User.objects.create_user(username='user', email='user@example.com', password='password123')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def save_search(self, **params):
+        response = self.client.post(reverse('saved-search-list'), {'params': params}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+    def notified(self):
+        return {
+            (row['saved_search'], row['pet']['name'])
+            for row in self.client.get(reverse('search-notification-list')).json()['results']
+        }
+
+    def test_new_and_updated_pets_are_matched(self):
+        dogs = self.save_search(type='dog', city='Baku', price__lte=500)
+        cheap_labs = self.save_search(breed__icontains='lab', max_price=50, vaccinated=True)
+        self.save_search(breed__icontains='poodle', city__icontains='ak')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_pet(self.owner, name='Rex', price=100)
+            make_pet(self.owner, name='Pricey', price=900)
+            make_pet(self.owner, name='Tom', type='cat')
+            lab = make_pet(self.owner, name='Lab', price=20)
+        self.assertEqual(self.notified(), {(dogs, 'Rex'), (dogs, 'Lab')})
+
+        lab.vaccinated = True
+        with self.captureOnCommitCallbacks(execute=True):
+            lab.save()
+            lab.save()
+        self.assertEqual(self.notified(), {(dogs, 'Rex'), (dogs, 'Lab'), (cheap_labs, 'Lab')})
+
+        marked = self.client.post(reverse('search-notification-mark-read'), {}, format='json').json()['marked']
+        self.assertEqual(marked, 3)
+        self.assertEqual(self.client.get(reverse('search-notification-list'), {'unread': 'true'}).json()['results'], [])
+
+    def test_own_pets_and_invalid_params(self):
+        self.save_search(type='dog')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_pet(self.user)
+        self.assertEqual(self.notified(), set())
+        response = self.client.post(reverse('saved-search-list'), {'params': {'colour': 'red'}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PetStreamTests(APITestCase):
+
+    def stream(self, query_string, events=()):
+        """Run the stream app, publish `events` once it has subscribed, then disconnect."""
+        broker = LocalBroker()
+        sent, disconnect = [], asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async def scenario():
+            scope = {'type': 'http', 'method': 'GET', 'query_string': query_string, 'headers': []}
+            task = asyncio.ensure_future(pet_stream(scope, receive, send))
+            while not sent and not task.done():
+                await asyncio.sleep(0)
+            broker.dispatch(list(events))
+            for _ in range(10):
+                await asyncio.sleep(0)
+            disconnect.set()
+            await task
+
+        with mock.patch('listings.events._broker', broker):
+            asyncio.run(scenario())
+        self.assertFalse(broker.has_subscribers())
+        return sent[0], b''.join(message.get('body', b'') for message in sent[1:])
+
+    def test_only_matching_events_are_pushed(self):
+        def event(name, **fields):
+            return {'event': 'created', 'pet': {'id': 1, 'name': name, 'type': 'dog', 'city': 'Baku', 'is_urgent': True, **fields}}
+
+        start, body = self.stream(b'type=dog&city=baku&is_urgent=true', [
+            event('Rex'), event('Tom', type='cat'), event('Calm', is_urgent=False), event('Max', city='Ganja'),
+        ])
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream; charset=utf-8'), start['headers'])
+        self.assertIn(b'event: created\ndata: {"id":1,"name":"Rex"', body)
+        self.assertEqual(body.count(b'event: '), 1)
+
+    def test_invalid_filter(self):
+        start, body = self.stream(b'is_urgent=maybe')
+        self.assertEqual(start['status'], 400)
+        self.assertIn(b'is_urgent', body)
+
+    def test_writes_are_published_on_commit(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        broker = mock.Mock(**{'has_subscribers.return_value': True})
+        with mock.patch('listings.events._broker', broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                pet = make_pet(owner, name='Rex', is_urgent=True)
+            pet.save()
+            self.assertEqual(broker.publish.call_count, 1)
+        [event] = broker.publish.call_args.args[0]
+        self.assertEqual(event['event'], 'created')
+        self.assertEqual((event['pet']['name'], event['pet']['owner'], event['pet']['is_urgent']), ('Rex', 'owner', True))
+
+
+def image_upload(name='photo.png', size=(1600, 900), mode='RGBA'):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 100, 50, 128) if mode == 'RGBA' else (200, 100, 50)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageDerivativeTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.enterContext(mock.patch('listings.images._pending', {}))
+        # Run the worker inline instead of on the pool.
+        executor = self.enterContext(mock.patch('listings.images.get_executor')).return_value
+        self.submit = executor.submit
+        self.submit.side_effect = lambda function, *args: function(*args)
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.client.force_authenticate(self.owner)
+
+    def create(self):
+        data = {
+            'name': 'Rex', 'type': 'dog', 'breed': 'Labrador', 'age': 12, 'gender': 'male',
+            'description': 'Friendly.', 'status': 'adopting', 'price': '100', 'city': 'Baku', 'image': image_upload(),
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('pet-create'), data, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        # Built after the response, on commit.
+        self.assertIsNone(response.json()['image_derivatives'])
+        self.submit.assert_called_once_with(mock.ANY, response.json()['id'], 'default')
+        return Pet.objects.get(pk=response.json()['id'])
+
+    def test_upload_builds_sizes_in_both_formats(self):
+        pet = self.create()
+        derivatives = self.client.get(reverse('pet-detail', args=[pet.pk])).json()['image_derivatives']
+        self.assertEqual(list(derivatives), ['thumb', 'card', 'full'])
+        self.assertEqual((derivatives['thumb']['width'], derivatives['thumb']['height']), (200, 113))
+        self.assertEqual((derivatives['full']['width'], derivatives['full']['height']), (1280, 720))
+        self.assertTrue(derivatives['card']['webp'].startswith('http://testserver/media/pets/derivatives/'))
+        storage = Pet._meta.get_field('image').storage
+        for entry in Pet.objects.get(pk=pet.pk).image_derivatives['sizes'].values():
+            self.assertTrue(storage.exists(entry['webp']) and storage.exists(entry['jpeg']))
+
+    def test_derivatives_leave_the_if_match_version_alone(self):
+        data = {
+            'name': 'Rex', 'type': 'dog', 'breed': 'Labrador', 'age': 12, 'gender': 'male',
+            'description': 'Friendly.', 'status': 'adopting', 'price': '100', 'city': 'Baku', 'image': image_upload(),
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.client.post(reverse('pet-create'), data, format='multipart')
+        pet_id = created.json()['id']
+        # The worker ran on commit, after the ETag was sent.
+        self.assertIn('sizes', Pet.objects.get(pk=pet_id).image_derivatives)
+        update = reverse('pet-update', args=[pet_id])
+        response = self.client.patch(update, {'name': 'Max'}, HTTP_IF_MATCH=created['ETag'])
+        self.assertEqual(response.status_code, 200, response.content)
+
+        photo = image_upload('photo.png', mode='RGB').read()
+        session_id = self.client.post(
+            reverse('upload-session-list'), {'filename': 'photo.png', 'size': len(photo)}, format='json',
+        ).json()['id']
+        self.client.put(
+            reverse('upload-session-detail', args=[session_id]), photo,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='0',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            finalized = self.client.post(
+                reverse('upload-session-finalize', args=[session_id]), {'pet': pet_id},
+                format='json', HTTP_IF_MATCH=response['ETag'],
+            )
+        self.assertEqual(finalized.status_code, 200, finalized.content)
+        self.assertEqual(Pet.objects.get(pk=pet_id).image_derivatives['source'], finalized.json()['image'].split('/media/')[-1])
+        response = self.client.patch(update, {'name': 'Rex'}, HTTP_IF_MATCH=finalized['ETag'])
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_detail_etag_follows_the_derivatives(self):
+        pet = self.create()
+        Pet.objects.filter(pk=pet.pk).update(image_derivatives={})
+        etag = self.client.get(reverse('pet-detail', args=[pet.pk]))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_derivatives(pet.pk)
+        self.assertEqual(self.client.get(reverse('pet-detail', args=[pet.pk]), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_new_image_replaces_derivatives(self):
+        pet = self.create()
+        old = Pet.objects.get(pk=pet.pk).image_derivatives
+        pet.refresh_from_db()
+        pet.image = image_upload('other.png', mode='RGB')
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            pet.save()
+        self.assertEqual(Pet.objects.get(pk=pet.pk).image_derivatives, {})
+        for callback in callbacks:
+            callback()
+        new = Pet.objects.get(pk=pet.pk).image_derivatives
+        self.assertEqual(new['source'], pet.image.name)
+        self.assertNotEqual(new['sizes']['thumb']['webp'], old['sizes']['thumb']['webp'])
+
+
+def noise_upload(name, seed, size=(640, 480)):
+    from PIL import Image
+
+    pattern = Image.frombytes('L', (16, 12), random.Random(seed).randbytes(16 * 12))
+    buffer = io.BytesIO()
+    pattern.resize(size, Image.Resampling.BILINEAR).convert('RGB').save(buffer, 'JPEG', quality=85)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(LISTINGS_RESPONSE_CACHE_TIMEOUT=0)
+class DuplicateDetectionTests(APITestCase):
+    DESCRIPTION = (
+        'Max is a playful two year old golden retriever who loves long walks, swimming and children. '
+        'He is fully vaccinated, neutered and microchipped. We are moving abroad and cannot take him with us.'
+    )
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.enterContext(mock.patch('listings.images._pending', {}))
+        executor = self.enterContext(mock.patch('listings.images.get_executor')).return_value
+        executor.submit.side_effect = lambda function, *args: function(*args)
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.client.force_authenticate(self.owner)
+
+    def create(self, name, description='Friendly.', image=None):
+        data = {
+            'name': name, 'type': 'dog', 'breed': 'Retriever', 'age': 24, 'gender': 'male',
+            'description': description, 'status': 'adopting', 'price': '100', 'city': 'Baku',
+        }
+        if image is not None:
+            data['image'] = image
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('pet-create'), data, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+    def list_ids(self, **params):
+        response = self.client.get(reverse('pet-list'), {'include': '', **params})
+        return {pet['id'] for pet in response.json()['pets']}
+
+    def test_renamed_repost_is_flagged_and_can_be_hidden(self):
+        original = self.create('Max', self.DESCRIPTION)
+        other = self.create('Luna', 'Lovely calm tabby cat looking for a quiet home. She is litter trained and spayed.')
+        repost = self.create('Buddy', self.DESCRIPTION.replace('Max is', 'Buddy is').replace('abroad', 'to Canada'))
+
+        duplicate = PetDuplicate.objects.get()
+        self.assertEqual((duplicate.pet_id, duplicate.original_id, duplicate.same_owner), (repost, original, True))
+        self.assertGreaterEqual(duplicate.text_similarity, 0.7)
+        self.assertIsNone(duplicate.image_distance)
+
+        self.assertEqual(self.list_ids(), {original, other, repost})
+        self.assertEqual(self.list_ids(hide_duplicates='true'), {original, other})
+
+        self.assertEqual(self.client.get(reverse('pet-duplicates')).status_code, 403)
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'password123'))
+        results = self.client.get(reverse('pet-duplicates'), {'pet': original}).json()['results']
+        self.assertEqual([(row['pet']['id'], row['original']['id']) for row in results], [(repost, original)])
+
+        # Rewriting the description clears the match; deleting pets clears their rows.
+        self.client.force_authenticate(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('pet-update', args=[repost]), {'description': 'A different dog entirely, ' * 4}, format='json')
+        self.assertFalse(PetDuplicate.objects.exists())
+        self.create('Max again', self.DESCRIPTION)
+        self.assertEqual(PetDuplicate.objects.count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('pet-owner-bulk-delete'), {'ids': [original]}, format='json')
+        self.assertFalse(PetDuplicate.objects.exists())
+
+    def test_resized_photo_is_flagged_once_its_derivatives_are_built(self):
+        original = self.create('Rex', image=noise_upload('a.jpg', seed=1))
+        self.create('Spot', image=noise_upload('b.jpg', seed=2))
+        repost = self.create('Rex II', image=noise_upload('c.jpg', seed=1, size=(320, 240)))
+
+        duplicate = PetDuplicate.objects.get()
+        self.assertEqual((duplicate.pet_id, duplicate.original_id), (repost, original))
+        self.assertLessEqual(duplicate.image_distance, 4)
+        self.assertIsNone(duplicate.text_similarity)
+
+
+class ContentAddressedMediaTests(APITestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.enterContext(mock.patch('listings.images.get_executor'))
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.client.force_authenticate(self.owner)
+        self.storage = Pet._meta.get_field('image').storage
+
+    def upload(self, photo):
+        data = {
+            'name': 'Rex', 'type': 'dog', 'breed': 'Labrador', 'age': 12, 'gender': 'male',
+            'description': 'Friendly.', 'status': 'adopting', 'price': '100', 'city': 'Baku', 'image': photo,
+        }
+        with mock.patch('listings.storage.content_hash', wraps=content_hash) as hashed:
+            response = self.client.post(reverse('pet-create'), data, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        # The upload handler already hashed the stream.
+        self.assertTrue(hashed.call_args.args[0].content_hash)
+        return Pet.objects.get(pk=response.json()['id'])
+
+    def test_identical_uploads_share_one_blob_until_both_are_deleted(self):
+        first = self.upload(image_upload('a.png'))
+        second = self.upload(image_upload('b.PNG'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^pets/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(len(self.storage.listdir(os.path.dirname(first.image.name))[1]), 1)
+
+        with mock.patch('listings.storage.BLOB_GRACE_SECONDS', 0):
+            with self.captureOnCommitCallbacks(execute=True):
+                first.delete()
+            self.assertTrue(self.storage.exists(second.image.name))
+            with self.captureOnCommitCallbacks(execute=True):
+                second.delete()
+            self.assertFalse(self.storage.exists(second.image.name))
+
+
+class ResumableUploadTests(APITestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.enterContext(mock.patch('listings.images.get_executor'))
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.client.force_authenticate(self.owner)
+        self.pet = make_pet(self.owner)
+        self.photo = image_upload('photo.png').read()
+
+    def put_chunk(self, session_id, offset, data):
+        return self.client.put(
+            reverse('upload-session-detail', args=[session_id]), data,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_chunks_resume_at_the_offset_and_finalize_onto_the_pet(self):
+        response = self.client.post(reverse('upload-session-list'), {'filename': 'photo.png', 'size': len(self.photo)}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        session_id = response.json()['id']
+        half = len(self.photo) // 2
+
+        response = self.put_chunk(session_id, 0, self.photo[:half])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response['Upload-Offset'], str(half))
+        # A retried chunk the server already has is refused with the offset to resume from.
+        response = self.put_chunk(session_id, 0, self.photo[:half])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], half)
+        self.assertEqual(self.client.get(reverse('upload-session-detail', args=[session_id]))['Upload-Offset'], str(half))
+        self.assertEqual(self.put_chunk(session_id, half, self.photo[half:]).json()['offset'], len(self.photo))
+
+        session = UploadSession.objects.get(pk=session_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('upload-session-finalize', args=[session_id]), {'pet': self.pet.pk}, format='json',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response['ETag'])
+        self.pet.refresh_from_db()
+        self.assertRegex(self.pet.image.name, r'^pets/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        with self.pet.image.open('rb') as image:
+            self.assertEqual(image.read(), self.photo)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(part_path(session)))
+
+    def test_finalize_needs_a_complete_upload_and_an_owned_pet(self):
+        session_id = self.client.post(
+            reverse('upload-session-list'), {'filename': 'photo.png', 'size': len(self.photo)}, format='json',
+        ).json()['id']
+        finalize = reverse('upload-session-finalize', args=[session_id])
+        self.assertEqual(self.client.post(finalize, {'pet': self.pet.pk}, format='json').status_code, 400)
+
+        self.put_chunk(session_id, 0, self.photo)
+        other = User.objects.create_user(username='other', email='other@example.com', password='password123')
+        self.assertEqual(self.client.post(finalize, {'pet': make_pet(other).pk}, format='json').status_code, 404)
+
+        self.client.force_authenticate(other)
+        self.assertEqual(self.put_chunk(session_id, 0, self.photo).status_code, 404)
+
+    def test_malformed_session_ids_are_not_found(self):
+        for method in (self.client.get, self.client.delete):
+            self.assertEqual(method(reverse('upload-session-detail', args=['not-a-uuid'])).status_code, 404)
+        self.assertEqual(self.put_chunk('not-a-uuid', 0, self.photo).status_code, 404)
+
+    def test_a_chunk_that_loses_the_race_is_a_conflict(self):
+        session = start_upload(self.owner, 'photo.png', len(self.photo))
+
+        class Racing(io.BytesIO):
+            def read(stream, size=-1):
+                # Another request for the same offset lands while this one streams.
+                UploadSession.objects.filter(pk=session.pk).update(offset=10)
+                return super().read(size)
+
+        with self.assertRaises(UploadConflict):
+            write_chunk(session, Racing(self.photo), 0, len(self.photo))
+        # Answered with the offset the winner left.
+        self.assertEqual(session.offset, 10)
+
+    def test_a_chunk_for_a_part_file_being_written_is_a_conflict(self):
+        session = start_upload(self.owner, 'photo.png', len(self.photo))
+        with open(part_path(session), 'r+b') as part:
+            # Another request is streaming into the part file.
+            locks.lock(part, locks.LOCK_EX)
+            with self.assertRaises(UploadConflict):
+                write_chunk(session, io.BytesIO(self.photo), 0, len(self.photo))
+        self.assertEqual(write_chunk(session, io.BytesIO(self.photo), 0, len(self.photo)), len(self.photo))
+
+    def test_rejects_non_images_and_oversized_uploads(self):
+        response = self.client.post(reverse('upload-session-list'), {'filename': 'notes.txt', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(LISTINGS_UPLOAD_MAX_SIZE=100):
+            response = self.client.post(reverse('upload-session-list'), {'filename': 'a.png', 'size': 101}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class MediaServingTests(APITestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        storage = Pet._meta.get_field('image').storage
+        self.blob = storage.save('pets/photo.jpg', io.BytesIO(b'0123456789'))
+        # Saved before content-addressed storage.
+        self.legacy = 'pets/old.jpg'
+        with open(storage.path(self.legacy), 'wb') as file:
+            file.write(b'abc')
+
+    def get(self, name, **headers):
+        response = self.client.get('/media/' + name, headers=headers)
+        self.addCleanup(response.close)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_blobs_are_immutable_and_conditional(self):
+        response, body = self.get(self.blob)
+        self.assertEqual((response.status_code, body), (200, b'0123456789'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        etag = response['ETag']
+        self.assertIn(etag.strip('"'), self.blob)
+
+        response, _ = self.get(self.blob, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(self.legacy)[0]['Cache-Control'], 'public, max-age=3600')
+
+    def test_ranges(self):
+        response, body = self.get(self.blob, range='bytes=2-5')
+        self.assertEqual((response.status_code, body, response['Content-Range']), (206, b'2345', 'bytes 2-5/10'))
+        self.assertEqual(self.get(self.blob, range='bytes=-3')[1], b'789')
+        self.assertEqual(self.get(self.blob, range='bytes=8-100')[1], b'89')
+        response, _ = self.get(self.blob, range='bytes=10-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+        # A stale If-Range gets the whole file.
+        response, body = self.get(self.blob, range='bytes=2-5', if_range='"stale"')
+        self.assertEqual((response.status_code, body), (200, b'0123456789'))
+
+    def test_proxy_handoff_and_path_validation(self):
+        with override_settings(LISTINGS_MEDIA_SENDFILE='nginx'):
+            response, body = self.get(self.blob)
+        self.assertEqual((response.status_code, body), (200, b''))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.blob)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        for name in ['pets/../secret.jpg', 'pets/.hidden.jpg', 'secret.jpg', 'pets/missing.jpg']:
+            self.assertEqual(self.get(name)[0].status_code, 404, name)
@@ -0,0 +1,38 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+from .storage import BLOB_HASH
+
+
+class HashingUploadMixin:
+    """
+    Hash each file as its chunks arrive and attach the hex digest to the
+    uploaded file as `content_hash`, so ContentAddressedStorage does not
+    have to read it back.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # Before super(): MemoryFileUploadHandler ends new_file() with StopFutureHandlers.
+        self.hasher = hashlib.new(BLOB_HASH)
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # MemoryFileUploadHandler passes large files on to the next handler untouched.
+        if getattr(self, 'activated', True):
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,172 @@
+import datetime
+import os
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File, locks
+from django.core.validators import validate_image_file_extension
+from django.http import UnreadablePostError
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+
+from .models import Pet, UploadSession
+from .writes import check_if_match, conditional_update
+
+UPLOAD_OFFSET_HEADER = 'Upload-Offset'
+UPLOAD_CHUNK_READ_SIZE = 64 * 1024
+
+
+def upload_dir():
+    # Under MEDIA_ROOT so finalizing is a rename on the same filesystem; the
+    # leading dot keeps serve_media from ever exposing part files.
+    return getattr(settings, 'LISTINGS_UPLOAD_DIR', None) or os.path.join(settings.MEDIA_ROOT, '.uploads')
+
+
+def upload_max_size():
+    return getattr(settings, 'LISTINGS_UPLOAD_MAX_SIZE', 20 * 1024 * 1024)
+
+
+def upload_expiry():
+    return datetime.timedelta(hours=getattr(settings, 'LISTINGS_UPLOAD_EXPIRY_HOURS', 24))
+
+
+def part_path(session):
+    return os.path.join(upload_dir(), f'{session.pk}.part')
+
+
+class UploadConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Upload-Offset does not match the bytes received so far.'
+    default_code = 'upload_offset_mismatch'
+
+
+def validate_upload(filename, size):
+    try:
+        validate_image_file_extension(File(None, filename))
+    except DjangoValidationError as exc:
+        raise ValidationError({'filename': exc.messages})
+    if size > upload_max_size():
+        raise ValidationError({'size': [f'Uploads are limited to {upload_max_size()} bytes.']})
+
+
+def get_session(user, pk):
+    try:
+        pk = uuid.UUID(str(pk))
+    except ValueError:
+        raise NotFound('No such upload session, or it expired.')
+    session = UploadSession.objects.filter(user=user, pk=pk).first()
+    if session is None or session.created_at < timezone.now() - upload_expiry():
+        raise NotFound('No such upload session, or it expired.')
+    return session
+
+
+def start_upload(user, filename, size):
+    validate_upload(filename, size)
+    session = UploadSession.objects.create(user=user, filename=filename, size=size)
+    os.makedirs(upload_dir(), exist_ok=True)
+    # Reserve the part file; chunks are written into it at their offsets.
+    open(part_path(session), 'xb').close()
+    return session
+
+
+def current_offset(session):
+    offset = UploadSession.objects.filter(pk=session.pk).values_list('offset', flat=True).first()
+    if offset is None:
+        raise NotFound('No such upload session, or it expired.')
+    return offset
+
+
+def write_chunk(session, stream, offset, length):
+    """
+    Copy `length` bytes from the request stream into the part file at
+    `offset`, UPLOAD_CHUNK_READ_SIZE at a time, and move the session's
+    offset past whatever arrived, so even a chunk cut off mid-way only has
+    to resend its tail. Returns the new offset.
+    """
+    if offset + length > session.size:
+        raise ValidationError({'detail': f'The chunk runs past the declared size of {session.size} bytes.'})
+
+    received = 0
+    error = None
+    with open(part_path(session), 'r+b') as part:
+        # One writer per part file; no database transaction is held while
+        # the body streams in. A second PUT to the session gets its 409
+        # straight away rather than queueing behind the first.
+        if not locks.lock(part, locks.LOCK_EX | locks.LOCK_NB):
+            session.offset = current_offset(session)
+            raise UploadConflict()
+        session.offset = current_offset(session)
+        if offset != session.offset:
+            raise UploadConflict()
+
+        part.seek(offset)
+        try:
+            while received < length:
+                data = stream.read(min(UPLOAD_CHUNK_READ_SIZE, length - received))
+                if not data:
+                    break
+                part.write(data)
+                received += len(data)
+        except (OSError, UnreadablePostError) as exc:
+            error = exc
+        part.flush()
+
+        # Only moves forward if nothing else moved the offset meanwhile.
+        updated = UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+            offset=offset + received, updated_at=timezone.now(),
+        )
+        if not updated:
+            session.offset = current_offset(session)
+            raise UploadConflict()
+    session.offset = offset + received
+    if error is not None or received < length:
+        raise ValidationError({'detail': f'Received {received} of {length} bytes; resume from {session.offset}.'})
+    return session.offset
+
+
+class PartFile(File):
+    """A finished part file; FileSystemStorage moves it into place instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def finalize_upload(request, session, pet):
+    """
+    Check the finished upload is an image, move it into content-addressed
+    storage and make it `pet`'s image with the same If-Match guarded write
+    as a pet update. Returns the updated pet.
+    """
+    if session.offset != session.size:
+        raise ValidationError({'detail': f'Only {session.offset} of {session.size} bytes have been uploaded.'})
+    # Fail a stale If-Match before the part file is consumed.
+    check_if_match(request, pet)
+    path = part_path(session)
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValidationError({'detail': 'The upload is not a valid image.'})
+
+    storage = Pet._meta.get_field('image').storage
+    upload_to = Pet._meta.get_field('image').upload_to
+    with open(path, 'rb') as part:
+        name = storage.save(upload_to + os.path.basename(session.filename), PartFile(part))
+    session.delete()
+    if os.path.exists(path):
+        # Copied rather than moved (the blob already existed, or another filesystem).
+        os.remove(path)
+    # On a 412 conditional_update releases the blob again (unless another pet shares it).
+    return conditional_update(request, pet, {'image': name})
+
+
+def abort_upload(session):
+    session.delete()
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+
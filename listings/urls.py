@@ -7,26 +7,36 @@ from . import views
 router = DefaultRouter()
 router.register(r'pets/utils', views.PetUtilityViewSet, basename='pet-utils')
 router.register(r'pets/owner', views.PetOwnerViewSet, basename='pet-owner')
+router.register(r'saved-searches', views.SavedSearchViewSet, basename='saved-search')
+router.register(r'notifications', views.SearchNotificationViewSet, basename='search-notification')
+router.register(r'uploads', views.UploadSessionViewSet, basename='upload-session')
 
 urlpatterns = [
     # Option 1: Generic Views - Separate CRUD endpoints
     path('pets/', views.PetListView.as_view(), name='pet-list'),
     path('pets/create/', views.PetCreateView.as_view(), name='pet-create'),
+    path('pets/facets/', views.PetFacetsView.as_view(), name='pet-facets'),
+    path('pets/changes/', views.PetChangesView.as_view(), name='pet-changes'),
+    path('pets/duplicates/', views.PetDuplicateListView.as_view(), name='pet-duplicates'),
+    path('pets/bulk/', views.PetBulkCreateView.as_view(), name='pet-bulk-create'),
     path('pets/<int:pk>/', views.PetDetailView.as_view(), name='pet-detail'),
     path('pets/<int:pk>/update/', views.PetUpdateView.as_view(), name='pet-update'),
     path('pets/<int:pk>/delete/', views.PetDeleteView.as_view(), name='pet-delete'),
     
     # Option 2: Custom Management View
     path('pets/manage/<int:pk>/', views.PetManagementView.as_view(), name='pet-manage'),
+    path('pets/cache/metrics/', views.ResponseCacheMetricsView.as_view(), name='pet-cache-metrics'),
     
     # Option 3: Function-based views with custom endpoints
     path('pets/list/', views.list_pets, name='pet-list-fbv'),
+    path('pets/export/<str:export_format>/', views.export_pets, name='pet-export'),
     path('pets/add/', views.create_pet, name='pet-create-fbv'),
     path('pets/detail/<int:pk>/', views.get_pet, name='pet-detail-fbv'),
     path('pets/edit/<int:pk>/', views.update_pet, name='pet-update-fbv'),
     path('pets/remove/<int:pk>/', views.delete_pet, name='pet-delete-fbv'),
     
     path('favorites/', views.FavoriteListView.as_view(), name="favorite-list"),
+    path('favorites/batch/', views.FavoriteBatchView.as_view(), name="favorite-batch"),
     path('favorites/<int:pet_id>/', views.AddFavoriteView.as_view(), name="favorite-add"),
     path('favorites/<int:pet_id>/remove/', views.RemoveFavoriteView.as_view(), name="favorite-remove"),
 
@@ -1,27 +1,139 @@
+import json
+
+from django.db.models import Max, Min, Q
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, filters, status, generics
+from django.utils import timezone
+from rest_framework import viewsets, mixins, permissions, filters, status, generics
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Pet,Favorite
-from .serializers import PetSerializer,FavoriteSerializer
+from .models import Pet,Favorite,SavedSearch,SearchNotification,UploadSession,PetDuplicate
+from .serializers import PetSerializer,FavoriteSerializer,FavoriteBatchSerializer,PetBulkSerializer,PetBulkUpdateSerializer
+from .serializers import SavedSearchSerializer,SearchNotificationSerializer,UploadSessionSerializer,PetDuplicateSerializer
 from .filters import PetFilter
+from .cache import anonymous_response_cache, get_metrics
+from .cards import CARD_FIELDS, card_queryset, pet_cards
+from .changes import get_changes, parse_limit
+from .conditional import detail_validators, list_validators, not_modified, set_validators
+from .distribution import DEFAULT_BUCKETS, MAX_BUCKETS, distribution
+from .duplicates import HideDuplicatesFilter
+from .export import EXPORT_FORMATS, export_lines, export_queryset, next_updated_since
+from .facets import cached_facet_counts, facet_params, filtered_pets
+from .favorites import add_favorites, annotate_favorited, remove_favorites
+from .fieldsets import parse_fieldset, pet_field_names, prune_pet_columns
+from .media import media_response
+from .pagination import (
+    DuplicateCursorPagination, FavoriteCursorPagination, NotificationCursorPagination, PetCursorPagination,
+)
+from .parsers import NDJSONParser
+from .saved_searches import MAX_SAVED_SEARCHES_PER_USER
+from .search import PetSearchFilter
+from .stats import get_pet_stats
+from .uploads import (
+    UPLOAD_OFFSET_HEADER, UploadConflict, abort_upload, finalize_upload, get_session, start_upload, write_chunk,
+)
+from .writes import (
+    BULK_CREATE_MAX_ITEMS, bulk_create_pets, bulk_delete_pets, bulk_results, bulk_update_pets,
+    conditional_update, save_pet, with_version,
+)
 from django.shortcuts import get_object_or_404
 from .models import ContactMessage
 from .serializers import ContactMessageSerializer
 from rest_framework.permissions import AllowAny
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe
+
+
+def get_pet_fieldset(request, cards=False):
+    """The `?fields=` / `?exclude=` subset for a pet read, or None for all fields."""
+    return parse_fieldset(request.query_params, pet_field_names(), CARD_FIELDS if cards else None)
+
+
+def wants_cards(request):
+    return request.query_params.get('view') == 'card'
+
+
+class PetFieldsetMixin:
+    """
+    Sparse fieldsets for GET requests: the serializer drops unrequested fields
+    and the queryset only SELECTs their columns.
+    """
+    fieldset_prefix = ''
+
+    def wants_cards(self):
+        return False
+
+    def get_fieldset(self):
+        if self.request.method != 'GET':
+            return None
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = get_pet_fieldset(self.request, self.wants_cards())
+        return self._fieldset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fieldset', self.get_fieldset())
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        queryset = prune_pet_columns(queryset, self.get_fieldset(), self.fieldset_prefix)
+        if self.request.method == 'GET' and (self.lookup_url_kwarg or self.lookup_field) in self.kwargs:
+            # Detail reads; list pages annotate just the page in serialize_page().
+            queryset = annotate_favorited(queryset, self.request.user)
+        return queryset
+
+
+class ConditionalListMixin:
+    """
+    ETag / Last-Modified for list endpoints from the page about to be
+    returned (see list_validators); a matching conditional GET is answered
+    with a 304 before anything is serialized.
+    """
+
+    def get(self, request, *args, **kwargs):
+        validators = list_validators(request, self.filter_queryset(self.get_queryset()), self.pagination_class())
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        return set_validators(super().get(request, *args, **kwargs), validators)
+
+
+class PetCardListMixin(PetFieldsetMixin):
+    """
+    `?view=card` serves lean `.values()` cards (PetSerializer minus description)
+    instead of full serializer rows.
+    """
+
+    def wants_cards(self):
+        return wants_cards(self.request)
+
+    def serialize_page(self, queryset):
+        queryset = annotate_favorited(queryset, self.request.user)
+        if self.wants_cards():
+            fieldset = self.get_fieldset()
+            return pet_cards(self.paginate_queryset(card_queryset(queryset, fieldset)), self.request, fieldset)
+        page = self.paginate_queryset(queryset)
+        return self.get_serializer(page, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        data = self.serialize_page(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(data)
 
 
 # Option 1: Separate Generic Views for each CRUD operation
-class PetListView(generics.ListAPIView):
+@method_decorator(anonymous_response_cache({'include': 'stats', 'page_size': '20'}), name='dispatch')
+class PetListView(ConditionalListMixin, PetCardListMixin, generics.ListAPIView):
     """GET /api/pets/ - List all pets with filtering and search"""
-    queryset = Pet.objects.all().order_by('-created_at')
+    queryset = Pet.objects.select_related('owner').order_by('-created_at')
     serializer_class = PetSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = PetCursorPagination
+    filter_backends = [DjangoFilterBackend, HideDuplicatesFilter, PetSearchFilter, filters.OrderingFilter]
     
     filterset_fields = {
         'type': ['exact'],
@@ -31,27 +143,65 @@ class PetListView(generics.ListAPIView):
         'price': ['gte', 'lte'],
         'age': ['gte', 'lte'],
         'vaccinated': ['exact'],
+        'is_urgent': ['exact'],
         'city': ['exact', 'icontains'],
     }
     
     search_fields = ['name', 'breed', 'description', 'city']
-    ordering_fields = ['created_at', 'price', 'age', 'name']
+    ordering_fields = ['created_at', 'price', 'age', 'name', 'favorites_count']
+
+    def get_includes(self):
+        """Optional response blocks; `?include=` (empty) skips the stats banner."""
+        include = self.request.query_params.get('include')
+        if include is None:
+            return {'stats'}
+        return {part.strip() for part in include.split(',') if part.strip()}
 
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        pets = self.get_queryset()
-        stats = {
-            "total": pets.count(),
-            "adopting": pets.filter(status="adopting").count(),
-            "selling": pets.filter(status="selling").count(),
-            "breeding": pets.filter(status="breeding").count(),
-            "urgent": pets.filter(is_urgent=True).count()
+        queryset = self.filter_queryset(self.get_queryset())
+        data = {
+            "pets": self.serialize_page(queryset),
+            "next": self.paginator.get_next_link(),
         }
-        response.data = {
-            "stats": stats,
-            "pets": response.data
-        }
-        return response
+        if 'stats' in self.get_includes():
+            data = {"stats": get_pet_stats(queryset), **data}
+        return Response(data)
+
+class PetFacetsView(APIView):
+    """GET /api/pets/facets/ - Sidebar counts per type, status, gender, city and vaccinated"""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        return Response(cached_facet_counts(request.query_params))
+
+
+class PetDuplicateListView(generics.ListAPIView):
+    """GET /api/pets/duplicates/?pet=&same_owner= - Listings that look like re-posts, for moderation"""
+    serializer_class = PetDuplicateSerializer
+    permission_classes = [permissions.IsAdminUser]
+    pagination_class = DuplicateCursorPagination
+
+    def get_queryset(self):
+        queryset = PetDuplicate.objects.select_related('pet__owner', 'original__owner')
+        pet = self.request.query_params.get('pet')
+        if pet:
+            if not pet.isdigit():
+                raise ValidationError({'pet': ['Expected a pet id.']})
+            queryset = queryset.filter(Q(pet_id=pet) | Q(original_id=pet))
+        same_owner = self.request.query_params.get('same_owner')
+        if same_owner in ('1', 'true', '0', 'false'):
+            queryset = queryset.filter(same_owner=same_owner in ('1', 'true'))
+        return queryset
+
+
+class PetChangesView(APIView):
+    """GET /api/pets/changes/?cursor=...&limit=200 - Pets changed and deleted since the cursor"""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        limit = parse_limit(request.query_params.get('limit'))
+        return Response(get_changes(request.query_params.get('cursor'), limit))
+
 
 class PetCreateView(generics.CreateAPIView):
     """POST /api/pets/create/ - Create a new pet"""
@@ -60,39 +210,103 @@ class PetCreateView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        self.pet = serializer.save(owner=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        # With the version to send back as If-Match on the first edit.
+        return with_version(request, super().create(request, *args, **kwargs), self.pet)
+
+
+class PetBulkCreateView(APIView):
+    """
+    POST /api/pets/bulk/ - Create many pets in one request
+
+    Accepts a JSON array, an NDJSON stream (application/x-ndjson), or a
+    multipart form whose `pets` field holds the JSON array and whose file
+    parts are referenced by name from each pet's `image`. The batch is
+    all-or-nothing: any invalid pet returns 400 with its index and errors.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser, MultiPartParser]
+
+    def get_items(self, request):
+        items = request.data
+        if hasattr(items, 'getlist'):
+            try:
+                items = json.loads(items.get('pets', ''))
+            except ValueError:
+                raise ValidationError({'pets': ['Expected a JSON array of pets.']})
+            for item in items if isinstance(items, list) else []:
+                if isinstance(item, dict) and item.get('image') in request.FILES:
+                    item['image'] = request.FILES[item['image']]
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of pets.']})
+        if not items:
+            raise ValidationError({'non_field_errors': ['No pets were submitted.']})
+        if len(items) > BULK_CREATE_MAX_ITEMS:
+            raise ValidationError({'non_field_errors': [f'At most {BULK_CREATE_MAX_ITEMS} pets per request.']})
+        return items
+
+    def post(self, request):
+        serializer = PetSerializer(data=self.get_items(request), many=True)
+        if not serializer.is_valid():
+            errors = [
+                {'index': index, 'errors': item_errors}
+                for index, item_errors in enumerate(serializer.errors) if item_errors
+            ]
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        pets = bulk_create_pets(request.user, serializer.validated_data)
+        return Response(
+            {'created': len(pets), 'ids': [pet.pk for pet in pets]},
+            status=status.HTTP_201_CREATED
+        )
 
 
-class PetDetailView(generics.RetrieveAPIView):
+@method_decorator(anonymous_response_cache(), name='dispatch')
+class PetDetailView(PetFieldsetMixin, generics.RetrieveAPIView):
     """GET /api/pets/{id}/ - Get a specific pet"""
-    queryset = Pet.objects.all()
+    queryset = Pet.objects.select_related('owner')
     serializer_class = PetSerializer
     permission_classes = [permissions.AllowAny]
 
+    def retrieve(self, request, *args, **kwargs):
+        validators = detail_validators(request, kwargs['pk'])
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        return set_validators(super().retrieve(request, *args, **kwargs), validators)
+
+
+class OwnerUpdateMixin:
+    """
+    PUT/PATCH for owners: one fetch for the owner check, then one conditional
+    UPDATE that honours If-Match (see listings/writes.py).
+    """
+    owner_update_error = 'You do not have permission to update this pet. Only the owner can update.'
 
-class PetUpdateView(generics.UpdateAPIView):
-    """PUT/PATCH /api/pets/{id}/update/ - Update a pet"""
-    queryset = Pet.objects.all()
-    serializer_class = PetSerializer
-    permission_classes = [permissions.IsAuthenticated]
-    
     def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
         instance = self.get_object()
-        if instance.owner != request.user:
+        if instance.owner_id != request.user.pk:
             return Response(
-                {'error': 'You do not have permission to update this pet. Only the owner can update.'},
+                {'error': self.owner_update_error},
                 status=status.HTTP_403_FORBIDDEN
             )
-        return super().update(request, *args, **kwargs)
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        pet = save_pet(request, serializer)
+        return with_version(request, Response(serializer.data), pet)
 
     def partial_update(self, request, *args, **kwargs):
-        instance = self.get_object()
-        if instance.owner != request.user:
-            return Response(
-                {'error': 'You do not have permission to update this pet. Only the owner can update.'},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        return super().partial_update(request, *args, **kwargs)
+        kwargs['partial'] = True
+        return self.update(request, *args, **kwargs)
+
+
+class PetUpdateView(OwnerUpdateMixin, generics.UpdateAPIView):
+    """PUT/PATCH /api/pets/{id}/update/ - Update a pet"""
+    queryset = Pet.objects.select_related('owner')
+    serializer_class = PetSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
 
 class PetDeleteView(generics.DestroyAPIView):
@@ -103,7 +317,7 @@ class PetDeleteView(generics.DestroyAPIView):
     
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-        if instance.owner != request.user:
+        if instance.owner_id != request.user.pk:
             return Response(
                 {'error': 'You do not have permission to delete this pet. Only the owner can delete.'},
                 status=status.HTTP_403_FORBIDDEN
@@ -123,9 +337,15 @@ class PetManagementView(APIView):
     def get(self, request, pk=None):
         """GET /api/pets/manage/{id}/ - Get pet details"""
         try:
-            pet = Pet.objects.get(pk=pk)
-            serializer = PetSerializer(pet)
-            return Response(serializer.data)
+            validators = detail_validators(request, pk)
+            response = not_modified(request, validators)
+            if response is not None:
+                return response
+            fieldset = get_pet_fieldset(request)
+            pets = prune_pet_columns(Pet.objects.select_related('owner'), fieldset)
+            pet = annotate_favorited(pets, request.user).get(pk=pk)
+            serializer = PetSerializer(pet, fieldset=fieldset)
+            return set_validators(Response(serializer.data), validators)
         except Pet.DoesNotExist:
             return Response(
                 {'error': 'Pet not found'}, 
@@ -135,8 +355,8 @@ class PetManagementView(APIView):
     def put(self, request, pk=None):
         """PUT /api/pets/manage/{id}/ - Full update"""
         try:
-            pet = Pet.objects.get(pk=pk)
-            if pet.owner != request.user:
+            pet = Pet.objects.select_related('owner').get(pk=pk)
+            if pet.owner_id != request.user.pk:
                 return Response(
                     {'error': 'Only the owner can update this pet'},
                     status=status.HTTP_403_FORBIDDEN
@@ -144,8 +364,8 @@ class PetManagementView(APIView):
             
             serializer = PetSerializer(pet, data=request.data)
             if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data)
+                save_pet(request, serializer)
+                return with_version(request, Response(serializer.data), pet)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Pet.DoesNotExist:
             return Response(
@@ -157,7 +377,7 @@ class PetManagementView(APIView):
         """DELETE /api/pets/manage/{id}/ - Delete pet"""
         try:
             pet = Pet.objects.get(pk=pk)
-            if pet.owner != request.user:
+            if pet.owner_id != request.user.pk:
                 return Response(
                     {'error': 'Only the owner can delete this pet'},
                     status=status.HTTP_403_FORBIDDEN
@@ -175,70 +395,84 @@ class PetManagementView(APIView):
 
 
 # Keep utility endpoints separate
-class PetUtilityViewSet(viewsets.GenericViewSet):
+class PetUtilityViewSet(PetCardListMixin, viewsets.GenericViewSet):
     """Utility endpoints that don't fit CRUD pattern"""
-    queryset = Pet.objects.all()
+    queryset = Pet.objects.select_related('owner')
     serializer_class = PetSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = PetCursorPagination
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def change_status(self, request, pk=None):
         """POST /api/pets/utils/{id}/change_status/"""
         pet = self.get_object()
         
-        if pet.owner != request.user:
+        if pet.owner_id != request.user.pk:
             return Response(
                 {'error': 'Only the owner can change the status'},
                 status=status.HTTP_403_FORBIDDEN
             )
         
         new_status = request.data.get('status')
-        # Note: Fix the reference to Pet.STATUS_CHOICES instead of Item.ITEM_STATUS
-        if new_status not in dict(Pet.STATUS_CHOICES):  # Assuming Pet has STATUS_CHOICES
+        if new_status not in dict(Pet.PET_STATUS):
             return Response(
                 {'error': 'Invalid status'},
                 status=status.HTTP_400_BAD_REQUEST
             )
             
-        pet.status = new_status
-        pet.save()
+        conditional_update(request, pet, {'status': new_status})
         
-        return Response({'status': 'Pet status updated successfully'})
+        return with_version(request, Response({'status': 'Pet status updated successfully'}), pet)
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def my_pets(self, request):
         """GET /api/pets/utils/my_pets/"""
-        pets = Pet.objects.filter(owner=request.user)
-        serializer = self.get_serializer(pets, many=True)
-        return Response(serializer.data)
+        pets = Pet.objects.filter(owner=request.user).select_related('owner')
+        pets = prune_pet_columns(pets, self.get_fieldset())
+        return self.get_paginated_response(self.serialize_page(pets))
 
     @action(detail=False, methods=['get'])
     def available_pets(self, request):
         """GET /api/pets/utils/available_pets/"""
-        pets = Pet.objects.filter(status='available')
-        serializer = self.get_serializer(pets, many=True)
-        return Response(serializer.data)
+        pets = prune_pet_columns(self.get_queryset().filter(status='available'), self.get_fieldset())
+        return self.get_paginated_response(self.serialize_page(pets))
 
     @action(detail=False, methods=['get'])
     def price_ranges(self, request):
         """GET /api/pets/utils/price_ranges/"""
-        queryset = Pet.objects.all()
-        min_price = queryset.exclude(price__isnull=True).order_by('price').values_list('price', flat=True).first()
-        max_price = queryset.exclude(price__isnull=True).order_by('-price').values_list('price', flat=True).first()
+        # Kept for older clients; distribution/ also returns the histograms.
+        summary = filtered_pets(facet_params(request.query_params)).aggregate(
+            min_price=Min('price'), max_price=Max('price')
+        )
         
         return Response({
-            'min_price': min_price,
-            'max_price': max_price
+            'min_price': summary['min_price'],
+            'max_price': summary['max_price']
         })
 
+    @action(detail=False, methods=['get'])
+    def distribution(self, request):
+        """GET /api/pets/utils/distribution/?buckets=10 - Price and age histograms under the current filters"""
+        try:
+            buckets = int(request.query_params.get('buckets', DEFAULT_BUCKETS))
+        except ValueError:
+            buckets = 0
+        if not 1 <= buckets <= MAX_BUCKETS:
+            return Response(
+                {'error': f'buckets must be an integer between 1 and {MAX_BUCKETS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(distribution(filtered_pets(facet_params(request.query_params)), buckets))
+
 
 # Option 3: Separate ViewSets for different concerns
-class PetListAPIView(generics.ListAPIView):
+class PetListAPIView(ConditionalListMixin, PetCardListMixin, generics.ListAPIView):
     """Read-only operations for public access"""
-    queryset = Pet.objects.order_by('-created_at')
+    queryset = Pet.objects.select_related('owner').order_by('-created_at')
     serializer_class = PetSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = PetCursorPagination
+    filter_backends = [DjangoFilterBackend, HideDuplicatesFilter, PetSearchFilter, filters.OrderingFilter]
     
     filterset_fields = {
         'type': ['exact'],
@@ -251,20 +485,39 @@ class PetListAPIView(generics.ListAPIView):
     }
     
     search_fields = ['name', 'breed', 'description', 'city']
-    ordering_fields = ['created_at', 'price', 'age', 'name']
+    ordering_fields = ['created_at', 'price', 'age', 'name', 'favorites_count']
 
 
-class PetOwnerViewSet(viewsets.ModelViewSet):
+class PetOwnerViewSet(OwnerUpdateMixin, PetCardListMixin, viewsets.ModelViewSet):
     """Full CRUD operations for pet owners"""
     serializer_class = PetSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PetCursorPagination
     
     def get_queryset(self):
-        return Pet.objects.filter(owner=self.request.user)
+        return Pet.objects.filter(owner=self.request.user).select_related('owner')
     
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def bulk_update(self, request):
+        """POST /api/pets/owner/bulk_update/ - Set status, is_urgent and/or price on many pets"""
+        serializer = PetBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        updated = bulk_update_pets(request.user, ids, serializer.changes)
+        return Response({'updated': len(updated), 'results': bulk_results(ids, updated, 'updated')})
+
+    @action(detail=False, methods=['post'])
+    def bulk_delete(self, request):
+        """POST /api/pets/owner/bulk_delete/ - Delete many pets"""
+        serializer = PetBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        deleted = bulk_delete_pets(request.user, ids)
+        return Response({'deleted': len(deleted), 'results': bulk_results(ids, deleted, 'deleted')})
+
 
 # Option 4: Function-based views for maximum control
 from rest_framework.decorators import api_view, permission_classes
@@ -273,9 +526,44 @@ from rest_framework.decorators import api_view, permission_classes
 @permission_classes([permissions.AllowAny])
 def list_pets(request):
     """GET /api/pets/list/ - List all available pets"""
-    pets = Pet.objects.filter(status='available').order_by('-created_at')
-    serializer = PetSerializer(pets, many=True)
-    return Response(serializer.data)
+    paginator = PetCursorPagination()
+    cards = wants_cards(request)
+    fieldset = get_pet_fieldset(request, cards)
+    pets = Pet.objects.filter(status='available').select_related('owner').order_by('-created_at')
+    validators = list_validators(request, pets, PetCursorPagination())
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    pets = annotate_favorited(prune_pet_columns(pets, fieldset), request.user)
+    if cards:
+        data = pet_cards(paginator.paginate_queryset(card_queryset(pets, fieldset), request), fieldset=fieldset)
+    else:
+        data = PetSerializer(paginator.paginate_queryset(pets, request), many=True, fieldset=fieldset).data
+    return set_validators(paginator.get_paginated_response(data), validators)
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def export_pets(request, export_format):
+    """GET /api/pets/export/{ndjson|csv}/ - Stream every pet matching the list filters"""
+    if export_format not in EXPORT_FORMATS:
+        raise Http404('Unknown export format')
+    started = timezone.now()
+    queryset = export_queryset(request.query_params)
+    response = StreamingHttpResponse(
+        export_lines(export_format, queryset, request),
+        content_type=f'{EXPORT_FORMATS[export_format]}; charset=utf-8',
+    )
+    filename = f'pets-{started:%Y%m%d-%H%M%S}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Export-Started'] = started.isoformat()
+    # Pass this back as ?updated_since= for the next incremental export.
+    response['X-Export-Next-Updated-Since'] = next_updated_since(started).isoformat()
+    return response
+
+@require_safe
+def serve_media(request, path):
+    """GET /media/<path> - Serve an uploaded image, handing the transfer to the proxy when configured"""
+    return media_response(request, path)
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -292,9 +580,15 @@ def create_pet(request):
 def get_pet(request, pk):
     """GET /api/pets/detail/{id}/ - Get specific pet"""
     try:
-        pet = Pet.objects.get(pk=pk)
-        serializer = PetSerializer(pet)
-        return Response(serializer.data)
+        validators = detail_validators(request, pk)
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        fieldset = get_pet_fieldset(request)
+        pets = prune_pet_columns(Pet.objects.select_related('owner'), fieldset)
+        pet = annotate_favorited(pets, request.user).get(pk=pk)
+        serializer = PetSerializer(pet, fieldset=fieldset)
+        return set_validators(Response(serializer.data), validators)
     except Pet.DoesNotExist:
         return Response(
             {'error': 'Pet not found'}, 
@@ -306,8 +600,8 @@ def get_pet(request, pk):
 def update_pet(request, pk):
     """PUT/PATCH /api/pets/edit/{id}/ - Update pet"""
     try:
-        pet = Pet.objects.get(pk=pk)
-        if pet.owner != request.user:
+        pet = Pet.objects.select_related('owner').get(pk=pk)
+        if pet.owner_id != request.user.pk:
             return Response(
                 {'error': 'Only the owner can update this pet'},
                 status=status.HTTP_403_FORBIDDEN
@@ -316,8 +610,8 @@ def update_pet(request, pk):
         partial = request.method == 'PATCH'
         serializer = PetSerializer(pet, data=request.data, partial=partial)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
+            save_pet(request, serializer)
+            return with_version(request, Response(serializer.data), pet)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Pet.DoesNotExist:
         return Response(
@@ -331,7 +625,7 @@ def delete_pet(request, pk):
     """DELETE /api/pets/remove/{id}/ - Delete pet"""
     try:
         pet = Pet.objects.get(pk=pk)
-        if pet.owner != request.user:
+        if pet.owner_id != request.user.pk:
             return Response(
                 {'error': 'Only the owner can delete this pet'},
                 status=status.HTTP_403_FORBIDDEN
@@ -347,12 +641,14 @@ def delete_pet(request, pk):
             status=status.HTTP_404_NOT_FOUND
         )
     
-class FavoriteListView(generics.ListAPIView):
+class FavoriteListView(PetFieldsetMixin, generics.ListAPIView):
     serializer_class = FavoriteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = FavoriteCursorPagination
+    fieldset_prefix = 'pet__'
 
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user)
+        return Favorite.objects.filter(user=self.request.user).select_related('pet__owner')
 
 
 class AddFavoriteView(generics.CreateAPIView):
@@ -375,7 +671,125 @@ class RemoveFavoriteView(generics.DestroyAPIView):
         favorite = get_object_or_404(Favorite, user=request.user, pet_id=pet_id)
         favorite.delete()
         return Response({"message": "Pet removed from favorites"}, status=status.HTTP_200_OK)
+
+
+class FavoriteBatchView(APIView):
+    """POST /api/favorites/batch/ - Add and/or remove many favorites in one request"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = FavoriteBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add = serializer.validated_data.get('add', [])
+        remove = serializer.validated_data.get('remove', [])
+        added = add_favorites(request.user, add) if add else []
+        if remove:
+            remove_favorites(request.user, remove)
+        results = [{'id': pk, 'is_favorited': True} for pk in dict.fromkeys(added)]
+        results += [{'id': pk, 'is_favorited': False} for pk in dict.fromkeys(remove)]
+        not_found = sorted(set(add) - set(added))
+        return Response({'results': results, 'not_found': not_found})
     
+class SavedSearchViewSet(viewsets.ModelViewSet):
+    """CRUD for the user's saved searches; new and updated pets are matched against them"""
+    serializer_class = SavedSearchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return SavedSearch.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        if SavedSearch.objects.filter(user=self.request.user).count() >= MAX_SAVED_SEARCHES_PER_USER:
+            raise ValidationError({'error': f'You can keep at most {MAX_SAVED_SEARCHES_PER_USER} saved searches.'})
+        serializer.save(user=self.request.user)
+
+
+class SearchNotificationViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """GET /api/notifications/?unread=true - Pets that matched the user's saved searches"""
+    serializer_class = SearchNotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationCursorPagination
+
+    def get_queryset(self):
+        queryset = SearchNotification.objects.filter(user=self.request.user).select_related('saved_search', 'pet__owner')
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(read_at__isnull=True)
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """POST /api/notifications/mark_read/ - Mark the given ids (or all) as read"""
+        notifications = SearchNotification.objects.filter(user=request.user, read_at__isnull=True)
+        ids = request.data.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+                raise ValidationError({'ids': ['Expected a list of notification ids.']})
+            notifications = notifications.filter(id__in=ids)
+        return Response({'marked': notifications.update(read_at=timezone.now())})
+
+
+class UploadSessionViewSet(viewsets.ViewSet):
+    """
+    Resumable image uploads, one bounded request per chunk:
+
+    POST   /api/uploads/                 {filename, size} - Start a session
+    PUT    /api/uploads/<id>/            raw bytes, Upload-Offset header - Write a chunk
+    GET    /api/uploads/<id>/            How far it got (also the Upload-Offset header)
+    POST   /api/uploads/<id>/finalize/   {pet} - Attach the finished image to one of your pets
+    DELETE /api/uploads/<id>/            Abort it
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def offset_response(self, session, status_code=status.HTTP_200_OK):
+        response = Response(UploadSessionSerializer(session).data, status=status_code)
+        response[UPLOAD_OFFSET_HEADER] = str(session.offset)
+        return response
+
+    def create(self, request):
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        return self.offset_response(start_upload(request.user, data['filename'], data['size']), status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return self.offset_response(get_session(request.user, pk))
+
+    def update(self, request, pk=None):
+        session = get_session(request.user, pk)
+        try:
+            offset = int(request.headers[UPLOAD_OFFSET_HEADER])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            raise ValidationError({'detail': f'Send the chunk with Content-Length and {UPLOAD_OFFSET_HEADER} headers.'})
+        try:
+            # request.stream, not request.data: the chunk goes to disk as it arrives.
+            write_chunk(session, request.stream, offset, length)
+        except UploadConflict as exc:
+            response = Response({'detail': exc.detail, 'offset': session.offset}, status=exc.status_code)
+            response[UPLOAD_OFFSET_HEADER] = str(session.offset)
+            return response
+        return self.offset_response(session)
+
+    def destroy(self, request, pk=None):
+        abort_upload(get_session(request.user, pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = get_session(request.user, pk)
+        pet = get_object_or_404(Pet, pk=request.data.get('pet'), owner=request.user)
+        pet = finalize_upload(request, session, pet)
+        return with_version(request, Response(PetSerializer(pet, context={'request': request}).data), pet)
+
+
+class ResponseCacheMetricsView(APIView):
+    """GET /api/pets/cache/metrics/ - Hit/miss counters for the anonymous response cache"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(get_metrics())
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class ContactCreateView(generics.CreateAPIView):
     """Handle contact form submission"""
@@ -0,0 +1,232 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import CASCADE, FileField
+from django.db.models.signals import post_save
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .cache import invalidate_on_commit
+from .conditional import etag_versions, make_etag, pet_version, set_validators
+from .duplicates import fingerprint_on_commit
+from .events import publish_on_commit
+from .images import derivatives_on_commit
+from .media import release_blobs, release_on_commit
+from .models import Pet, PetTombstone
+from .saved_searches import match_on_commit
+from .search import get_search_backend
+from .stats import bump_stats, stats_contribution
+
+BULK_CREATE_MAX_ITEMS = 1000
+BULK_CREATE_BATCH_SIZE = 200
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'This pet was changed by another request. Fetch it again and retry.'
+    default_code = 'precondition_failed'
+
+
+def check_if_match(request, pet):
+    header = request.META.get('HTTP_IF_MATCH')
+    if not header:
+        return
+    versions = etag_versions(header)
+    if '*' not in versions and pet_version(pet.pk, pet.updated_at) not in versions:
+        raise PreconditionFailed()
+
+
+def conditional_update(request, pet, changes):
+    """
+    Write `changes` to an already fetched pet with a single
+    `UPDATE ... WHERE id = ? AND updated_at = ?`.
+
+    A stale If-Match, or a row that changed since it was read, raises
+    PreconditionFailed (412) instead of silently overwriting the other
+    write. post_save is sent by hand so the stats, search and cache
+    receivers see the change like any other save.
+    """
+    check_if_match(request, pet)
+
+    stored_files = []
+    values = {}
+    for name, value in changes.items():
+        field = Pet._meta.get_field(name)
+        if isinstance(field, FileField):
+            previous = getattr(pet, field.attname).name
+            setattr(pet, field.attname, value)
+            # Stores the upload (if any) and returns the committed FieldFile.
+            value = field.pre_save(pet, add=False)
+            if value and value.name != previous:
+                stored_files.append(value)
+            if field.name == 'image' and (value.name if value else None) != (previous or None):
+                # The image changed: the old derivatives go, post_save queues new ones.
+                pet.image_derivatives = values['image_derivatives'] = {}
+        else:
+            setattr(pet, field.attname, value)
+        values[field.name] = value
+
+    updated_at = timezone.now()
+    matched = Pet.objects.filter(pk=pet.pk, updated_at=pet.updated_at).update(updated_at=updated_at, **values)
+    if not matched:
+        # Blobs may be shared with other pets; only unreferenced ones go.
+        release_blobs([file.name for file in stored_files])
+        raise PreconditionFailed()
+
+    pet.updated_at = updated_at
+    post_save.send(
+        sender=Pet, instance=pet, created=False, raw=False,
+        using=pet._state.db, update_fields=frozenset(values) | {'updated_at'},
+    )
+    return pet
+
+
+def save_pet(request, serializer):
+    """`serializer.save()` for pet updates, routed through conditional_update()."""
+    conditional_update(request, serializer.instance, dict(serializer.validated_data))
+    return serializer.instance
+
+
+def with_version(request, response, pet):
+    """Attach the new ETag so the client can send it back as If-Match next time."""
+    validators = (make_etag(request, pet_version(pet.pk, pet.updated_at)), pet.updated_at)
+    return set_validators(response, validators, status=response.status_code)
+
+
+def bulk_create_pets(owner, items, using='default'):
+    """
+    Insert already validated pets with chunked bulk_create() in one transaction.
+
+    bulk_create() sends no signals, so the work of the post_save receivers is
+    done here once per batch: the stats counters are bumped on commit, the new
+    rows are indexed for search, cached responses are invalidated, saved
+    searches are matched, the pets are published to the event stream,
+    fingerprinted for duplicate detection and image derivatives are queued.
+    """
+    pets = [Pet(owner=owner, **values) for values in items]
+    try:
+        with transaction.atomic(using=using):
+            search = get_search_backend(using)
+            for start in range(0, len(pets), BULK_CREATE_BATCH_SIZE):
+                chunk = Pet.objects.using(using).bulk_create(pets[start:start + BULK_CREATE_BATCH_SIZE])
+                search.index([pet.pk for pet in chunk])
+            deltas = {}
+            for pet in pets:
+                for name, value in stats_contribution(pet.status, pet.is_urgent).items():
+                    deltas[name] = deltas.get(name, 0) + value
+            transaction.on_commit(lambda: bump_stats(deltas), using=using)
+            invalidate_on_commit(using)
+            match_on_commit([pet.pk for pet in pets], using)
+            publish_on_commit([pet.pk for pet in pets], 'created', using)
+            fingerprint_on_commit([pet.pk for pet in pets], using)
+            derivatives_on_commit([pet.pk for pet in pets if pet.image], using)
+    except Exception:
+        # FileField.pre_save() stored the uploads as the rows were inserted.
+        release_blobs([pet.image.name for pet in pets if pet.image and pet.image._committed], using)
+        raise
+    return pets
+
+
+def _owned_rows(owner, ids, using):
+    # Lock the rows so the stats deltas below match what the UPDATE/DELETE sees.
+    return list(
+        Pet.objects.using(using).select_for_update()
+        .filter(owner=owner, id__in=ids).values_list('id', 'status', 'is_urgent')
+    )
+
+
+def _stats_deltas(rows, new_values=None):
+    """Counter deltas for removing `rows`, or for rewriting them with `new_values`."""
+    deltas = {}
+    for _, status, is_urgent in rows:
+        for name, value in stats_contribution(status, is_urgent).items():
+            deltas[name] = deltas.get(name, 0) - value
+        if new_values is not None:
+            current = stats_contribution(new_values.get('status', status), new_values.get('is_urgent', is_urgent))
+            for name, value in current.items():
+                deltas[name] = deltas.get(name, 0) + value
+    return deltas
+
+
+def bulk_update_pets(owner, ids, changes, using='default'):
+    """
+    Apply `changes` (status, is_urgent, price) to the owner's pets among `ids`
+    with one `UPDATE ... WHERE owner_id = ? AND id IN (...)`. Returns the ids
+    that were updated; the rest are missing or belong to someone else.
+    """
+    with transaction.atomic(using=using):
+        rows = _owned_rows(owner, ids, using)
+        matched = [pk for pk, _, _ in rows]
+        if matched:
+            # update() skips auto_now, so updated_at (and with it every ETag) is set here.
+            Pet.objects.using(using).filter(owner=owner, id__in=matched).update(updated_at=timezone.now(), **changes)
+            deltas = _stats_deltas(rows, changes)
+            transaction.on_commit(lambda: bump_stats(deltas), using=using)
+            invalidate_on_commit(using)
+            match_on_commit(matched, using)
+            publish_on_commit(matched, 'updated', using)
+    return matched
+
+
+def delete_rows(queryset):
+    """
+    Delete the rows of `queryset` with the single DELETE that QuerySet.delete()
+    fast-deletes with, and return the row count.
+
+    QuerySet.delete() only takes that path for models without delete
+    receivers; Pet and Favorite have post_delete receivers, so it would load
+    every row to send them. Callers remove the rows that reference these
+    first and do the signal work themselves.
+    """
+    # None when the filter can match nothing (an empty __in) and no query ran.
+    return queryset._raw_delete(queryset.db) or 0
+
+
+def check_pet_references():
+    """
+    Fail at startup if a relation to Pet is one a DELETE per relation cannot
+    follow (a nested cascade or a SET_NULL), so bulk_delete_pets never has to.
+    """
+    for relation in Pet._meta.related_objects:
+        if relation.on_delete is not CASCADE or relation.related_model._meta.related_objects:
+            raise ImproperlyConfigured(f'Set-based pet deletes cannot follow {relation!r}.')
+
+
+def delete_pet_references(pet_ids, using='default'):
+    """The DELETEs a cascade from `pet_ids` would make, one per relation in Pet's model metadata."""
+    for relation in Pet._meta.related_objects:
+        delete_rows(relation.related_model._base_manager.using(using).filter(**{f'{relation.field.name}__in': pet_ids}))
+
+
+def bulk_delete_pets(owner, ids, using='default'):
+    """
+    Delete the owner's pets among `ids` with set-based DELETEs and return the
+    deleted ids.
+
+    QuerySet.delete() would load every pet and favorite to send post_delete,
+    so every row that references the pets (favorites, notifications, search
+    and duplicate-detection rows) is removed first, a statement per
+    relation, then the pets in one more. Tombstones for the changes feed are
+    written in one more, and the images no other pet shares are deleted on
+    commit.
+    """
+    with transaction.atomic(using=using):
+        rows = _owned_rows(owner, ids, using)
+        matched = [pk for pk, _, _ in rows]
+        if matched:
+            images = list(Pet.objects.using(using).filter(id__in=matched).values_list('image', flat=True))
+            delete_pet_references(matched, using)
+            get_search_backend(using).remove(matched)
+            delete_rows(Pet.objects.using(using).filter(id__in=matched, owner=owner))
+            PetTombstone.objects.using(using).bulk_create([PetTombstone(pet_id=pk) for pk in matched])
+            deltas = _stats_deltas(rows)
+            transaction.on_commit(lambda: bump_stats(deltas), using=using)
+            invalidate_on_commit(using)
+            release_on_commit(images, using)
+    return matched
+
+
+def bulk_results(ids, matched, done):
+    """Per-id outcome, in request order."""
+    matched = set(matched)
+    return [{'id': pk, 'result': done if pk in matched else 'not_found'} for pk in dict.fromkeys(ids)]